@@ -5,7 +5,8 @@ import logging
 import subprocess
 from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparator
 from ..postgres_rest_api.decorators import rest_endpoint
-from ..document_fragment import extract_fragment, document_length
+from ..document_fragment import extract_fragment
+from ..document_index import DocumentIndex, store_document_index
 from .clean import clean_html
 
 # this is where we pre-define endpoints
@@ -120,19 +121,22 @@ def add_document(cursor):
         content_type = flask.request.form['content_type']
 
         if content_type == 'text/plain;charset=UTF-8':
-            length = len(content)
+            pass
         elif content_type == 'text/html;charset=UTF-8':
             content = clean_html(content)
             bytes_ = content.encode('utf-8')
-            length = document_length(content)
         else:
             raise werkzeug.exceptions.UnsupportedMediaType('Only plain text and HTML files allowed!')
 
+        # the length of the inner text, for HTML documents
+        index = DocumentIndex.build(content, content_type)
+        length = len(index.text)
+
         source_id = int(flask.request.form['source_id'])
         version = flask.request.form['version']
         comment = flask.request.form['comment']
 
-        document_id = cursor.one('''INSERT INTO document (
+        document = cursor.one('''INSERT INTO document (
             source_id,
             version,
             comment,
@@ -146,14 +150,16 @@ def add_document(cursor):
             %(content_type)s,
             %(content_length)s,
             %(content)s
-        ) RETURNING id;''', content=bytes_,
+        ) RETURNING id, version;''', content=bytes_,
                content_type=content_type,
                content_length=length,
                source_id=source_id,
                version=version,
                comment=comment)
 
-        return flask.redirect(flask.url_for('annotator.root') + F'?document_id={document_id}')
+        store_document_index(cursor, document.id, document.version, index)
+
+        return flask.redirect(flask.url_for('annotator.root') + F'?document_id={document.id}')
     else:
         raise werkzeug.exceptions.MethodNotAllowed()
 
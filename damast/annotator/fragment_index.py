@@ -0,0 +1,113 @@
+'''
+Index of the text fragments of a document for the approximate matching of
+annotation suggestions.
+
+`Levenshtein.ratio(a, b)` is the normalized indel similarity
+`1 - d / (len(a) + len(b))`, where `d` is the number of insertions and
+deletions that turn `a` into `b`. A ratio of at least 0.9 thus means
+`d <= (len(a) + len(b)) // 10`, which also bounds the difference in length.
+
+The index uses the partition filter of Pass-Join (Li et al., 2011): each
+distinct fragment text is split into `d + 1` pieces, for the largest `d` a
+search term of compatible length allows. If the term is within `d` edits of
+the text, at least one piece is not touched by the edits and appears in the
+term, at its offset in the text shifted by `s`. If `i` pieces before it are
+edited, `max(i, |s|) + |len(term) - len(text) - s| <= d`, so only pieces at
+these positions of the term need to be looked up. Only the texts found this
+way are compared with `ratio`, and the matches are the same as when comparing
+all pairs.
+'''
+
+from collections import defaultdict
+
+
+def _max_distance(total_length):
+    ''' Largest indel distance with a ratio of at least 0.9. '''
+    return total_length // 10
+
+
+def _compatible(a, b):
+    ''' Checks if strings of lengths `a` and `b` can have a ratio of at least 0.9. '''
+    return abs(a - b) <= _max_distance(a + b)
+
+
+def _partition(length):
+    '''
+    Split a text of `length` into pieces for the largest distance to any
+    compatible length, returning `(offset, size)` for each piece.
+    '''
+    other = length
+    while _compatible(length, other + 1):
+        other += 1
+    count = _max_distance(length + other) + 1
+
+    pieces = []
+    offset = 0
+    for i in range(count):
+        size = length // count + (1 if i >= count - length % count else 0)
+        pieces.append((offset, size))
+        offset += size
+
+    return pieces
+
+
+class FragmentIndex:
+    '''
+    Index of the fragments of a document (`TextFragment`s), by the pieces of
+    their distinct texts.
+    '''
+    def __init__(self, fragments):
+        self.fragments = fragments
+        self.texts = []
+        self.occurrences = []  # text ID -> indices of the fragments with that text
+        self._partitions = dict()  # text length -> pieces
+        self._pieces = defaultdict(dict)  # (text length, piece index) -> piece -> text IDs
+
+        text_ids = dict()
+        for fragment_id, fragment in enumerate(fragments):
+            text_id = text_ids.get(fragment.text)
+            if text_id is None:
+                text_id = len(self.texts)
+                text_ids[fragment.text] = text_id
+                self.texts.append(fragment.text)
+                self.occurrences.append([])
+                self._add(text_id, fragment.text)
+
+            self.occurrences[text_id].append(fragment_id)
+
+        self._lengths = sorted(self._partitions)
+
+    def _add(self, text_id, text):
+        length = len(text)
+        if length not in self._partitions:
+            self._partitions[length] = _partition(length)
+
+        for i, (offset, size) in enumerate(self._partitions[length]):
+            self._pieces[length, i].setdefault(text[offset:offset+size], []).append(text_id)
+
+    def candidates(self, term):
+        '''
+        Get the IDs of the distinct texts that can have a ratio of at least 0.9
+        with `term`.
+        '''
+        length = len(term)
+        found = set()
+
+        for other in self._lengths:
+            if not _compatible(length, other):
+                continue
+
+            d = _max_distance(length + other)
+            difference = length - other
+            for i, (offset, size) in enumerate(self._partitions[other][:d+1]):
+                pieces = self._pieces[other, i]
+                for shift in range(-d, d+1):
+                    start = offset + shift
+                    if max(i, abs(shift)) + abs(difference - shift) > d or start < 0 or start + size > length:
+                        continue
+
+                    text_ids = pieces.get(term[start:start+size])
+                    if text_ids is not None:
+                        found.update(text_ids)
+
+        return found
@@ -9,19 +9,22 @@ import pathlib
 import sys
 import datetime
 import json
+import gc
 from io import BytesIO
 from Levenshtein import ratio
 from psycopg2.extras import NumericRange
-from itertools import repeat
-from multiprocessing import Pool
+import multiprocessing
 from functools import namedtuple, reduce
 from logging.handlers import TimedRotatingFileHandler
 import subprocess
 import hashlib
 
 from ..postgres_database import postgres_database
-from ..document_fragment import tokenize_html_document, tokenize_text_document, inner_text
+from ..document_fragment import tokenize_html_document, tokenize_text_document
+from ..document_index import get_document_index
 from ..config import get_config
+from ..scheduler import leader_job
+from .fragment_index import FragmentIndex
 
 logger = logging.getLogger('flask.error')
 conf = get_config()
@@ -29,6 +32,16 @@ conf = get_config()
 def start_refresh_job():
     p = subprocess.Popen(['python', '-m', 'damast.annotator.suggestions'])
     logger.info(F'Starting annotation suggestion refresh (PID {p.pid}).')
+    return p
+
+
+def run_refresh_job():
+    '''
+    Run the annotation suggestion refresh and wait for it to finish.
+    '''
+    p = start_refresh_job()
+    if p.wait() != 0:
+        raise RuntimeError(F'Annotation suggestion refresh (PID {p.pid}) failed with exit code {p.returncode}.')
 
 
 def register_scheduler(sched):
@@ -37,7 +50,7 @@ def register_scheduler(sched):
     if interval is not None:
         period = 'each day' if interval == 1 else F'every {interval} days'
         logger.info('Registering annotation suggestion refresh job to run %s at 1AM.', period)
-        sched.add_job(start_refresh_job, trigger='cron', day=F'*/{interval}', hour='1', minute='0')
+        sched.add_job(leader_job('annotation-suggestion-refresh', run_refresh_job), trigger='cron', day=F'*/{interval}', hour='1', minute='0')
 
     else:
         logger.info('Will not run annotation suggestion refresh job regularly.')
@@ -104,7 +117,10 @@ def get_all_religions(c):
 
 
 def get_other_annotation_content_data(c, text, document_id):
-    text = inner_text(text)
+    '''
+    Get the search terms from the annotations of a document, and their spans
+    by (type, ID). `text` is the inner text of the document.
+    '''
     query = c.mogrify('select * from annotation_overview where document_id = %s;', (document_id,))
     c.execute(query)
 
@@ -160,15 +176,21 @@ def tokenize_text(text, doctype, ngrams=2):
         logger.error('Unknown document type for document: "%s".', doctype)
         tokens = []
 
+    return text_fragments(tokens, ngrams)
+
+
+def text_fragments(tokens, ngrams=2):
+    '''
+    Get the n-grams of the tokens (text, start, end) as `TextFragment`s, up
+    to n=`ngrams`.
+    '''
+    texts = [ t[0] for t in tokens ]
+    starts = [ t[1] for t in tokens ]
+    ends = [ t[2] for t in tokens ]
+
     fragments = []
     for i in range(1, ngrams+1):
-        for idx in range(len(tokens) + 1 - i):
-            toks = tokens[idx:idx+i]
-            text = ' '.join(map(lambda x: x[0], toks))
-            start = toks[0][1]
-            end = toks[-1][2]
-
-            fragments.append(TextFragment(text, start, end))
+        fragments.extend(TextFragment(' '.join(texts[idx:idx+i]), starts[idx], ends[idx+i-1]) for idx in range(len(tokens) + 1 - i))
 
     logger.info('Extracted %d tokens using n-grams up to n=%d.', len(fragments), ngrams)
 
@@ -220,48 +242,147 @@ def prune_existing(results, existing):
 # Prune candidates that are already present in the document (i.e., matching entity in same space)       OK
 
 
-def search_with_term(document, frags, search_term):
+def search_with_term(index, search_term):
+    '''
+    Find the fragments in the `FragmentIndex` with a ratio of at least 0.9 to
+    any of the terms of `search_term`. Only the candidates of the index are
+    compared, but the results are the same as comparing all fragments, in
+    fragment order for each term.
+    '''
     key = (type(search_term.data).__name__, search_term.data.id)
     vals = []
 
     for term in search_term.terms:
-        for token in frags:
-            rat = ratio(token.text, term)
+        matched = []
+        for text_id in index.candidates(term):
+            rat = ratio(index.texts[text_id], term)
             if rat >= 0.9:
-                vals.append(Result(rat, set([search_term.source]), token.start, token.end))
+                matched.extend((fragment_id, rat) for fragment_id in index.occurrences[text_id])
+
+        for fragment_id, rat in sorted(matched):
+            token = index.fragments[fragment_id]
+            vals.append(Result(rat, set([search_term.source]), token.start, token.end))
 
     return key, vals
 
 
+# index of the document being matched, inherited by the worker processes when
+# they are forked, so that the tasks only carry the search terms
+_shared_index = None
+
+
+def _search_with_terms(search_terms):
+    return [ search_with_term(_shared_index, search_term) for search_term in search_terms ]
+
+
+def match_search_terms(frags, search_terms, batch_size=256):
+    '''
+    Match the search terms against the fragments of a document in worker
+    processes, and get the matches by (type, ID). The fragment index is built
+    once and shared with the workers by forking them.
+    '''
+    global _shared_index
+
+    _shared_index = FragmentIndex(frags)
+    logger.info('Indexed %d distinct fragment texts.', len(_shared_index.texts))
+
+    # the garbage collector of the workers would otherwise touch, and thereby
+    # copy, the memory of all objects of the index
+    gc.freeze()
+    try:
+        matches = dict()
+        batches = [ search_terms[i:i+batch_size] for i in range(0, len(search_terms), batch_size) ]
+        with multiprocessing.get_context('fork').Pool() as p:
+            for results in p.imap(_search_with_terms, batches):
+                for key, vals in results:
+                    if len(vals) > 0:
+                        if key in matches:
+                            matches[key].extend(vals)
+                        else:
+                            matches[key] = vals
+
+        return matches
+
+    finally:
+        gc.unfreeze()
+        _shared_index = None
+
+
 def refresh_annotation_suggestions():
-    db = postgres_database()
+    db = postgres_database('damast-annotation-suggestions')
     with db.get_cursor() as c:
         c.execute('SELECT * FROM document;')
         for doc in c.fetchall():
             _refresh_for_document(c, doc)
 
 
+def _serialize_search_term(v):
+    return json.dumps(tuple([
+        v.type,
+        v.source,
+        *sorted(map(lambda x: str(x), tuple(v.data))),
+        *sorted(v.terms),
+        ]))
+
+
+def entity_fingerprints(content, search_terms, existing_by_type_id):
+    '''
+    Calculate a fingerprint of the search terms of each entity, by key (type,
+    ID), including the spans of the entity's annotations and the document
+    `content`. The suggestions of an entity only change if its fingerprint
+    does.
+    '''
+    content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    terms_by_key = dict()
+    for v in search_terms:
+        terms_by_key.setdefault((v.type, v.data.id), []).append(_serialize_search_term(v))
+
+    fingerprints = dict()
+    for key, vs in terms_by_key.items():
+        existing = sorted(existing_by_type_id.get(key, []))
+        fingerprint = json.dumps([content_hash, sorted(vs), existing]).encode('utf-8')
+        fingerprints[key] = hashlib.sha256(fingerprint).hexdigest()
+
+    return fingerprints
+
+
+def changed_entities(fingerprints, stored):
+    '''
+    Compare the `fingerprints` of the entities with the `stored` ones, both by
+    key (type, ID). Returns the keys of the added or changed entities, and of
+    the removed entities.
+    '''
+    changed = set(key for key, fingerprint in fingerprints.items() if stored.get(key) != fingerprint)
+    removed = set(stored) - set(fingerprints)
+    return changed, removed
+
+
+# entity types as stored in the database
+_entity_types = { t.__name__.lower(): t.__name__ for t in (Place, Person, Religion) }
+
+
+def _entity_state_tracked(c):
+    return c.one("SELECT to_regclass('public.annotation_suggestion_entity_state');") is not None
+
+
 def _refresh_for_document(c, document):
     logger.info('Starting annotation suggestion refresh for document with ID %d.', document.id)
     doc = bytes(document.content).decode('utf-8')
+    try:
+        index = get_document_index(c, document)
+    except ValueError as err:
+        logger.error('%s Skipping document with ID %d.', err, document.id)
+        return
 
     search_terms = get_all_places(c)
     search_terms.extend(get_all_persons(c))
     search_terms.extend(get_all_religions(c))
-    annotations, existing_by_type_id = get_other_annotation_content_data(c, doc, document.id)
+    annotations, existing_by_type_id = get_other_annotation_content_data(c, index.text, document.id)
     search_terms.extend(annotations)
 
     # calculate hash
-    vs = []
-    for v in search_terms:
-        vs.append(tuple([
-            v.type,
-            v.source,
-            *sorted(map(lambda x: str(x), tuple(v.data))),
-            *sorted(v.terms),
-            ]))
-
-    vs = sorted(map(lambda x: json.dumps(x), vs))
+    vs = sorted(map(_serialize_search_term, search_terms))
     stj = json.dumps(vs).encode('utf-8')
     newhash = hashlib.sha512(stj).hexdigest()
 
@@ -271,17 +392,27 @@ def _refresh_for_document(c, document):
         logger.info('Old and new hash of search terms match, skipping update for document with ID %d.', document.id)
         return
 
+    # only match the entities whose search terms changed, if their fingerprints are stored
+    tracked = _entity_state_tracked(c)
+    fingerprints = entity_fingerprints(doc, search_terms, existing_by_type_id)
+    stored = dict()
+    if tracked:
+        rows = c.all('SELECT type, entity_id, fingerprint FROM annotation_suggestion_entity_state WHERE document_id = %s;', (document.id,))
+        stored = { (_entity_types[r.type], r.entity_id): r.fingerprint for r in rows }
+
+    incremental = len(stored) > 0
+    if incremental:
+        changed, removed = changed_entities(fingerprints, stored)
+        logger.info('Search terms of %d of %d entities changed, %d entities removed, for document with ID %d.', len(changed), len(fingerprints), len(removed), document.id)
+    else:
+        changed, removed = set(fingerprints), set()
 
-    matches = dict()
-    frags = tokenize_text(doc, document.content_type, ngrams=3)
-
-    with Pool() as p:
-        for key, vals in p.starmap(search_with_term, zip(repeat(doc), repeat(frags), search_terms), 256):
-            if len(vals) > 0:
-                if key in matches:
-                    matches[key].extend(vals)
-                else:
-                    matches[key] = vals
+    search_terms = [ v for v in search_terms if (v.type, v.data.id) in changed ]
+    if len(search_terms) > 0:
+        frags = text_fragments(index.tokens(), ngrams=3)
+        matches = match_search_terms(frags, search_terms)
+    else:
+        matches = dict()
 
     matches = { k: reduce_spans(v) for k,v in matches.items() }
     matchcount = 0
@@ -297,7 +428,19 @@ def _refresh_for_document(c, document):
     logger.info('Eliminated %d existing annotations, %d matches left.', matchcount_old - matchcount, matchcount)
 
     f = BytesIO()
-    f.write(c.mogrify('DELETE FROM annotation_suggestion WHERE document_id = %s;\n\n', (document.id,)))
+    if incremental:
+        replaced = sorted(changed | removed)
+        replaced = dict(document_id=document.id, types=[ t.lower() for t, _ in replaced ], ids=[ id_ for _, id_ in replaced ])
+        f.write(c.mogrify('''DELETE FROM annotation_suggestion
+            WHERE document_id = %(document_id)s
+            AND (type, entity_id) IN (SELECT * FROM unnest(%(types)s::text[], %(ids)s::integer[]));\n\n''', replaced))
+        f.write(c.mogrify('''DELETE FROM annotation_suggestion_entity_state
+            WHERE document_id = %(document_id)s
+            AND (type, entity_id) IN (SELECT * FROM unnest(%(types)s::text[], %(ids)s::integer[]));\n\n''', replaced))
+    else:
+        f.write(c.mogrify('DELETE FROM annotation_suggestion WHERE document_id = %s;\n\n', (document.id,)))
+        if tracked:
+            f.write(c.mogrify('DELETE FROM annotation_suggestion_entity_state WHERE document_id = %s;\n\n', (document.id,)))
 
     insertions = []
     for (t, id_), vs in matches.items():
@@ -314,8 +457,14 @@ def _refresh_for_document(c, document):
         f.write(b',\n'.join(insertions))
         f.write(b';\n')
 
-        f.write(c.mogrify('''DELETE FROM annotation_suggestion_document_state WHERE document_id = %(document_id)s;
-        INSERT INTO annotation_suggestion_document_state (document_id, suggestion_hash) VALUES (%(document_id)s, %(suggestion_hash)s);\n''', dict(document_id=document.id, suggestion_hash=newhash)))
+    if tracked and len(changed) > 0:
+        states = [ c.mogrify('    (%s, %s, %s, %s)', (document.id, t.lower(), id_, fingerprints[t, id_])) for t, id_ in sorted(changed) ]
+        f.write(b'INSERT INTO annotation_suggestion_entity_state (document_id, type, entity_id, fingerprint) VALUES\n')
+        f.write(b',\n'.join(states))
+        f.write(b';\n')
+
+    f.write(c.mogrify('''DELETE FROM annotation_suggestion_document_state WHERE document_id = %(document_id)s;
+    INSERT INTO annotation_suggestion_document_state (document_id, suggestion_hash) VALUES (%(document_id)s, %(suggestion_hash)s);\n''', dict(document_id=document.id, suggestion_hash=newhash)))
 
     logger.info('Writing updated annotation suggestions for document with ID %d to the database.', document.id)
     c.execute(f.getvalue())
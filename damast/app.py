@@ -13,26 +13,29 @@ import urllib.parse
 import yaml
 import atexit
 import sqlite3
+import threading
 import brotli, gzip
 import uuid
 import traceback
 from contextlib import contextmanager
 import werkzeug.exceptions
 from .token import HTTPCookieTokenAuth
-from .user import User, default_visitor_roles, visitor
+from .user import User, UserCache, default_visitor_roles, visitor
 from .logging import BlueprintFilter
 from functools import lru_cache, partial
 from logging.handlers import TimedRotatingFileHandler
-from passlib.pwd import genword
 from postgres import Postgres
 from werkzeug.middleware.proxy_fix import ProxyFix
 from apscheduler.schedulers.gevent import GeventScheduler
 
 from .response_compression import compress
-from .postgres_database import postgres_database
+from .postgres_database import postgres_database, refresh_materialized_view
 from .annotator.suggestions import register_scheduler as register_scheduler_for_annotation_suggestions
 from .reporting.check_evict import register_scheduler as register_scheduler_for_report_eviction
+from .reporting.report_database import register_scheduler as register_scheduler_for_report_access
 from .config import get_config
+from .scheduler import leader_job
+from .secret_keys import load_secrets
 from .customjsonprovider import CustomJSONProvider
 
 
@@ -60,19 +63,9 @@ class FlaskApp(flask.Flask):
         self._init_logging()
 
         # load secrets, or generate them
-        if self.damast_config.secret_file is not None:
-            with open(self.damast_config.secret_file) as f:
-                if is_testing:
-                    logging.getLogger('flask.error').info('Loading secrets from file %s.', f.name)
-                else:
-                    logging.getLogger('flask.error').warning('Loading secrets from file %s. This should not happen on a production server.', f.name)
-
-                _secrets = json.load(f)
-        else:
-            _secrets = dict()
-
-        self.secret_key = _secrets.get('secret_key', genword(entropy='secure', charset='ascii_72'))
-        self.config['jwt_secret'] = _secrets.get('jwt_secret', genword(entropy='secure', charset='ascii_72')).encode('ascii')
+        _secrets = load_secrets(self.damast_config.secret_file, is_testing)
+        self.secret_key = _secrets['secret_key']
+        self.config['jwt_secret'] = _secrets['jwt_secret'].encode('ascii')
 
         # ProxyFix
         proxies_count = self.damast_config.proxycount
@@ -173,55 +166,87 @@ class FlaskApp(flask.Flask):
 
     @contextmanager
     def auth_cursor(self):
-        if not self.user_db:
+        '''
+        Cursor on the user database. The connection is shared by the requests
+        of the process, so the cursor is used by one request at a time.
+        '''
+        user_db = self.user_db
+        if not user_db:
             raise werkzeug.exceptions.InternalServerError('User database was not properly initialized.')
 
-        cursor = self.user_db.cursor()
-        yield cursor
-        cursor.close()
+        with self._user_db_lock:
+            cursor = user_db.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+
+    @property
+    def user_db(self):
+        '''
+        Connection to the user database. Each process opens its own connection
+        on first use, because SQLite connections must not be used across a
+        fork. The connection inherited from the parent process is kept open.
+        '''
+        if self._user_db_pid != os.getpid():
+            if self._user_db is not None:
+                self._inherited_user_dbs.append(self._user_db)
+
+            self._user_db = sqlite3.connect(self.damast_config.user_file, detect_types=sqlite3.PARSE_DECLTYPES)
+            self._user_db_lock = threading.RLock()
+            self._user_db_pid = os.getpid()
+
+        return self._user_db
 
 
     def _init_auth(self):
         # init database
-        dbfile = self.damast_config.user_file
-        self.user_db = sqlite3.connect(dbfile, detect_types=sqlite3.PARSE_DECLTYPES)
+        self._user_db = None
+        self._user_db_pid = None
+        self._inherited_user_dbs = []
+        self.user_db  # fail early if the user database cannot be opened
+        self.user_cache = UserCache(self.damast_config.user_file)
         def _onclose():
-            if self.user_db:
-                self.user_db.close()
+            if self._user_db is not None and self._user_db_pid == os.getpid():
+                self._user_db.close()
         atexit.register(_onclose)
 
         self.auth = HTTPCookieTokenAuth(scheme='Bearer')
 
         visitor_roles = default_visitor_roles()
 
+        def load_user(user_id):
+            with self.auth_cursor() as c:
+                c.execute('SELECT id, expires, roles FROM users WHERE id = ?;', (user_id,))
+                return c.fetchone()
+
         # VERIFICATION
         @self.auth.verify_token
         def verify_token(token):
             try:
                 payload = jwt.decode(token, self.config['jwt_secret'], algorithms=['HS256'])
                 if 'role' in payload:
-                    # get user from db
-                    with self.auth_cursor() as c:
-                        c.execute('SELECT id, password, expires, roles FROM users WHERE id = ?;', (payload['role'],))
-                        userdata = c.fetchone()
-                        if userdata is not None:
-                            expiry = userdata[2]
-                            if expiry is not None:
-                                expires = (userdata[2] - datetime.date.today()).days
-                                if expires <= 0:
-                                    logging.getLogger('flask.error').info('User %s tried to log in, account expired for %d days.', userdata[0], -expires)
-                                    flask.flash('User account expired, please contact administrator', 'error')
-                                    return visitor(visitor_roles)
-
-                            # parse roles
-                            r = userdata[3]
-                            roles = [] if r is None else list(map(lambda x: x.strip(), r.split(',')))
-                            return User(name=userdata[0], roles=roles)
-
-                        else:
-                            logging.getLogger('flask.error').info('Wrong username or password for user %s.', payload['role'])
-                            flask.flash('Wrong username or password', 'error')
-                            return visitor(visitor_roles)
+                    # get user from db, or the cache
+                    userdata = self.user_cache.get(payload['role'], load_user)
+                    if userdata is not None:
+                        expiry = userdata[1]
+                        if expiry is not None:
+                            expires = (expiry - datetime.date.today()).days
+                            if expires <= 0:
+                                logging.getLogger('flask.error').info('User %s tried to log in, account expired for %d days.', userdata[0], -expires)
+                                flask.flash('User account expired, please contact administrator', 'error')
+                                return visitor(visitor_roles)
+
+                        # parse roles
+                        r = userdata[2]
+                        roles = [] if r is None else list(map(lambda x: x.strip(), r.split(',')))
+                        return User(name=userdata[0], roles=roles)
+
+                    else:
+                        logging.getLogger('flask.error').info('Wrong username or password for user %s.', payload['role'])
+                        flask.flash('Wrong username or password', 'error')
+                        return visitor(visitor_roles)
 
             except jwt.PyJWTError:
                 return visitor(visitor_roles)
@@ -266,7 +291,8 @@ class FlaskApp(flask.Flask):
 
 
     def _init_database(self):
-        self.pg = postgres_database()
+        cfg = self.damast_config
+        self.pg = postgres_database('damast-server', cfg.pg_statement_timeout, cfg.pg_pool_minconn, cfg.pg_pool_maxconn)
 
 
     def _create_errorhandlers(self):
@@ -331,6 +357,7 @@ class FlaskApp(flask.Flask):
         @self.errorhandler(416)
         @self.errorhandler(417)
         @self.errorhandler(428)
+        @self.errorhandler(503)
         def _40x_handler(err):
             return _render_error(err)
 
@@ -422,7 +449,9 @@ class FlaskApp(flask.Flask):
             if flask.request.blueprint == 'override':
                 return response
 
-            response.add_etag()
+            # computing the ETag of a streamed response would buffer it
+            if not response.is_streamed or response.direct_passthrough:
+                response.add_etag()
             return response.make_conditional(flask.request)
 
         # do conditional compression
@@ -514,20 +543,23 @@ class FlaskApp(flask.Flask):
         '''
         Create a scheduler that rebuilds the materialized view(s) in the
         database and evicts from the report database regularly. This also
-        regularly recreates annotation suggestions.
+        regularly recreates annotation suggestions and writes report accesses.
+        Except for the latter, the jobs only run in one process (see
+        `scheduler.leader_job`).
         '''
         def rebuild_view(self):
-            try:
-                with self.pg.get_cursor() as c:
-                    c.execute('REFRESH MATERIALIZED VIEW place_religion_overview;')
-            except Exception as e:
-                logging.getLogger('flask.error').warn('Could not rebuild materialized views (%s): %s', str(type(e)), str(e))
-        rebuild_fn = partial(rebuild_view, self)
+            with self.pg.get_cursor() as c:
+                duration = refresh_materialized_view(c, 'place_religion_overview')
+            if duration is not None:
+                logging.getLogger('flask.error').info('Refreshed materialized view place_religion_overview in %.1fs.', duration)
+        rebuild_fn = leader_job('refresh-place-religion-overview', partial(rebuild_view, self))
 
+        # the view is only refreshed if the data changed, so this can run often
         self.scheduler = GeventScheduler(timezone='Europe/Berlin')
-        self.scheduler.add_job(rebuild_fn, trigger='interval', minutes=10, start_date=datetime.datetime.now()+datetime.timedelta(seconds=10))
+        self.scheduler.add_job(rebuild_fn, trigger='interval', minutes=1, start_date=datetime.datetime.now()+datetime.timedelta(seconds=10))
 
         register_scheduler_for_annotation_suggestions(self.scheduler)
         register_scheduler_for_report_eviction(self.scheduler)
+        register_scheduler_for_report_access(self.scheduler)
 
         self.scheduler.start()
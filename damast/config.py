@@ -65,6 +65,34 @@ _config_entries = [
             default = 'api',
             description = 'PostgreSQL user'
             ),
+        ConfigEntry(
+            envvar = 'DAMAST_PG_POOL_MINCONN',
+            varname = 'pg_pool_minconn',
+            type = int,
+            default = 1,
+            description = 'number of PostgreSQL connections the server keeps open',
+            ),
+        ConfigEntry(
+            envvar = 'DAMAST_PG_POOL_MAXCONN',
+            varname = 'pg_pool_maxconn',
+            type = int,
+            default = 10,
+            description = 'maximum number of PostgreSQL connections of the server',
+            ),
+        ConfigEntry(
+            envvar = 'DAMAST_PG_POOL_MAXSTREAMS',
+            varname = 'pg_pool_maxstreams',
+            type = int,
+            default = 4,
+            description = 'maximum number of streamed responses holding a PostgreSQL connection of the server',
+            ),
+        ConfigEntry(
+            envvar = 'DAMAST_PG_STATEMENT_TIMEOUT',
+            varname = 'pg_statement_timeout',
+            type = int,
+            default = None,
+            description = 'number of seconds after which PostgreSQL statements of the server are canceled',
+            ),
 
         ConfigEntry(
             envvar = 'DAMAST_VERSION',
@@ -89,6 +117,13 @@ _config_entries = [
             default = 8000,
             description = 'port at which `gunicorn` serves the content'
             ),
+        ConfigEntry(
+            envvar = 'DAMAST_WORKERS',
+            varname = 'workers',
+            type = int,
+            default = 1,
+            description = 'number of `gunicorn` worker processes, or 0 for one per CPU core',
+            ),
         ConfigEntry(
             envvar = 'DAMAST_PROXYCOUNT',
             varname = 'proxycount',
@@ -194,6 +229,48 @@ _config_entries = [
             default = None,
             description = 'file size in megabytes (MB) of report contents above which reports will be evicted',
             ),
+        ConfigEntry(
+            envvar = 'DAMAST_REPORT_WORKERS',
+            varname = 'report_workers',
+            type = int,
+            default = 2,
+            description = 'number of reports that are generated in parallel',
+            ),
+        ConfigEntry(
+            envvar = 'DAMAST_REPORT_QUEUE_MAXSIZE',
+            varname = 'report_queue_maxsize',
+            type = int,
+            default = 20,
+            description = 'number of reports waiting for generation above which new reports are rejected',
+            ),
+        ConfigEntry(
+            envvar = 'DAMAST_REPORT_DATA_CACHE_MAXSIZE',
+            varname = 'report_data_cache_maxsize',
+            type = int,
+            default = 100,
+            description = 'size in megabytes (MB) of cached report data above which cache entries are evicted',
+            ),
+        ConfigEntry(
+            envvar = 'DAMAST_REST_CACHE_MAXSIZE',
+            varname = 'rest_cache_maxsize',
+            type = int,
+            default = 50,
+            description = 'size in megabytes (MB) of cached REST API responses above which cache entries are evicted',
+            ),
+        ConfigEntry(
+            envvar = 'DAMAST_COMPRESSION_CACHE_MAXSIZE',
+            varname = 'compression_cache_maxsize',
+            type = int,
+            default = 50,
+            description = 'size in megabytes (MB) of cached compressed responses above which cache entries are evicted',
+            ),
+        ConfigEntry(
+            envvar = 'DAMAST_DOCUMENT_FRAGMENT_CACHE_MAXSIZE',
+            varname = 'document_fragment_cache_maxsize',
+            type = int,
+            default = 50,
+            description = 'size in megabytes (MB) of cached document offset indices above which cache entries are evicted',
+            ),
         ConfigEntry(
             envvar = 'DAMAST_ANNOTATION_SUGGESTION_REBUILD',
             varname = 'annotation_suggestion_rebuild',
@@ -1,6 +1,14 @@
 import html5lib
+from html5lib.constants import namespaces, voidElements, rcdataElements
+from html5lib.treewalkers.base import DOCTYPE, TEXT, ELEMENT, COMMENT, DOCUMENT
 from xml.dom.minidom import Text
+from xml.sax.saxutils import escape, unescape
+from bisect import bisect_right
+from collections import OrderedDict
+import array
+import flask
 import re
+import threading
 
 def extract_fragment(content, start, end):
     '''
@@ -18,6 +26,250 @@ def extract_fragment(content, start, end):
     return output
 
 
+class OffsetIndex:
+    '''
+    Index of an HTML document for extracting fragments like
+    `extract_fragment`, without parsing the document again. The document is
+    serialized once as `extract_fragment` would serialize it. For each node,
+    the byte positions of its tags in the serialization are stored, and for
+    each leaf (text and nodes without children), its text offsets. A fragment
+    is the contiguous serialization of the nodes from the first to the last
+    leaf overlapping the range, with the text at both ends cut, wrapped in the
+    tags of their open ancestors.
+    '''
+    def __init__(self, serialized, parents, tag_positions, leaf_nodes, leaf_starts, leaf_ends, leaf_raw):
+        self.serialized = serialized
+        self.parents = parents
+        self.tag_positions = tag_positions
+        self.leaf_nodes = leaf_nodes
+        self.leaf_starts = leaf_starts
+        self.leaf_ends = leaf_ends
+        self.leaf_raw = leaf_raw
+
+    @property
+    def size(self):
+        '''
+        Approximate size of the index in bytes.
+        '''
+        arrays = (self.parents, self.tag_positions, self.leaf_nodes, self.leaf_starts, self.leaf_ends)
+        return len(self.serialized) + len(self.leaf_raw) + sum(a.itemsize * len(a) for a in arrays)
+
+    @classmethod
+    def build(cls, content):
+        '''
+        Index the HTML document `content`. Returns None if fragments of the
+        document can not be extracted from the index, which is the case if
+        text in CDATA elements (like `script`) would be escaped differently
+        in fragments than in the whole document.
+        '''
+        document = html5lib.parse(content, treebuilder='dom')
+        walker = html5lib.getTreeWalker('dom')(document)
+        serializer = html5lib.serializer.HTMLSerializer(omit_optional_tags=False)
+
+        pieces = []
+        position = 0
+        offset = 0
+        parents = array.array('i')
+        # start and end of the opening and of the closing tag of each node
+        tag_positions = array.array('I')
+        leaf_nodes = array.array('i')
+        leaf_starts = array.array('I')
+        leaf_ends = array.array('I')
+        leaf_raw = bytearray()
+
+        # whether the serializer is within a CDATA element, and the number of
+        # open CDATA elements
+        in_cdata = False
+        cdata_depth = 0
+
+        stack = [ (document, -1, None) ]
+        while len(stack) > 0:
+            node, parent, end_tag = stack.pop()
+
+            if node is None:
+                # end of the node with ID `parent`
+                tag_positions[4*parent+2] = position
+                if end_tag is not None:
+                    piece = ''.join(serializer.serialize([end_tag])).encode('utf-8')
+                    pieces.append(piece)
+                    position += len(piece)
+                    if end_tag['name'] in rcdataElements:
+                        in_cdata = False
+                        cdata_depth -= 1
+                tag_positions[4*parent+3] = position
+                continue
+
+            node_id = len(parents)
+            parents.append(parent)
+            details = walker.getNodeDetails(node)
+            type_, details = details[0], details[1:]
+            tokens = []
+            children = []
+            end_tag = None
+
+            if type_ == TEXT:
+                data = details[0]
+                # a CDATA element was closed within another one, the text
+                # might be escaped differently in fragments
+                if in_cdata != (cdata_depth > 0) and escape(data) != data:
+                    return None
+                piece = data if in_cdata else escape(data)
+            else:
+                if type_ == DOCTYPE:
+                    tokens.append(walker.doctype(*details))
+                elif type_ == ELEMENT:
+                    namespace, name, attributes, has_children = details
+                    if (not namespace or namespace == namespaces['html']) and name in voidElements:
+                        tokens.extend(walker.emptyTag(namespace, name, attributes, has_children))
+                    else:
+                        tokens.append(walker.startTag(namespace, name, attributes))
+                        end_tag = walker.endTag(namespace, name)
+                        children = node.childNodes
+                    if name in rcdataElements:
+                        in_cdata = True
+                        if end_tag is not None:
+                            cdata_depth += 1
+                elif type_ == COMMENT:
+                    tokens.append(walker.comment(details[0]))
+                elif type_ == DOCUMENT:
+                    children = node.childNodes
+                else:
+                    tokens.append(walker.unknown(details[0]))
+                piece = ''.join(serializer.serialize(tokens))
+
+            piece = piece.encode('utf-8')
+            pieces.append(piece)
+            tag_positions.extend((position, position + len(piece), 0, 0))
+            position += len(piece)
+
+            if len(children) == 0:
+                length = len(data) if type_ == TEXT else 0
+                leaf_nodes.append(node_id)
+                leaf_starts.append(offset)
+                leaf_ends.append(offset + length)
+                leaf_raw.append(type_ == TEXT and in_cdata)
+                offset += length
+
+            stack.append((None, node_id, end_tag))
+            stack.extend((child, node_id, None) for child in reversed(children))
+
+        return cls(b''.join(pieces), parents, tag_positions, leaf_nodes, leaf_starts, leaf_ends, leaf_raw)
+
+    def _opening_tag(self, node):
+        return self.serialized[self.tag_positions[4*node]:self.tag_positions[4*node+1]]
+
+    def _closing_tag(self, node):
+        return self.serialized[self.tag_positions[4*node+2]:self.tag_positions[4*node+3]]
+
+    def _ancestors(self, node):
+        ancestors = []
+        node = self.parents[node]
+        while node >= 0:
+            ancestors.append(node)
+            node = self.parents[node]
+        return ancestors
+
+    def _cut_text(self, leaf, start, end):
+        node = self.leaf_nodes[leaf]
+        piece = self._opening_tag(node).decode('utf-8')
+        offset = self.leaf_starts[leaf]
+        if self.leaf_raw[leaf]:
+            return piece[max(0, start - offset):end - offset].encode('utf-8')
+        return escape(unescape(piece)[max(0, start - offset):end - offset]).encode('utf-8')
+
+    def extract(self, start, end):
+        '''
+        Extract the text between `start` and `end` like `extract_fragment`,
+        as UTF-8.
+        '''
+        # leaves ending before the range, and leaves not starting after it
+        first = bisect_right(self.leaf_ends, start)
+        last = bisect_right(self.leaf_starts, end)
+        if first == len(self.leaf_nodes):
+            return b''
+
+        # the fragment consists of the nodes from the one following the last
+        # leaf before the range to the one following the last leaf in it
+        begin = self.leaf_nodes[first - 1] + 1 if first > 0 else 0
+        stop = self.leaf_nodes[last - 1] + 1
+        stop_position = self.tag_positions[4*stop] if stop < len(self.parents) else len(self.serialized)
+
+        # the text at both ends of the range is cut
+        parts = [ self._opening_tag(node) for node in reversed(self._ancestors(begin)) ]
+        position = self.tag_positions[4*begin]
+        for leaf in sorted(set((first, last - 1))):
+            if first <= leaf < last and (self.leaf_starts[leaf] < start or self.leaf_ends[leaf] > end):
+                node = self.leaf_nodes[leaf]
+                parts.append(self.serialized[position:self.tag_positions[4*node]])
+                parts.append(self._cut_text(leaf, start, end))
+                position = self.tag_positions[4*node+1]
+        parts.append(self.serialized[position:stop_position])
+
+        if stop < len(self.parents):
+            parts.extend(self._closing_tag(node) for node in self._ancestors(stop))
+
+        return b''.join(parts)
+
+
+class OffsetIndexCache:
+    '''
+    Cache of the `OffsetIndex`es of documents, keyed by document ID and
+    version, which is bounded in size and evicts the least-recently used
+    entries. Documents that can not be indexed are remembered as well.
+    '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> OffsetIndex or None
+        self._lock = threading.Lock()
+
+    def get(self, key, content):
+        '''
+        Get the index for `key`, and index the document returned by
+        `content()` if it is not cached. Returns None if the cache is disabled
+        or the document can not be indexed.
+        '''
+        if self.maxsize <= 0:
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            self.misses += 1
+
+        index = OffsetIndex.build(content())
+        size = index.size if index is not None else 0
+        with self._lock:
+            if key not in self._entries and size <= self.maxsize:
+                self._entries[key] = index
+                self.size += size
+
+                while self.size > self.maxsize:
+                    _, evicted = self._entries.popitem(last=False)
+                    if evicted is not None:
+                        self.size -= evicted.size
+
+        return index
+
+    def stats(self):
+        with self._lock:
+            return dict(entries=len(self._entries), size=self.size, maxsize=self.maxsize, hits=self.hits, misses=self.misses)
+
+
+_cache = None
+
+def get_offset_index_cache():
+    global _cache
+    if _cache is None:
+        _cache = OffsetIndexCache(flask.current_app.damast_config.document_fragment_cache_maxsize * 1000000)
+    return _cache
+
+
 WORD = re.compile('\\b\\w+\\b')
 def tokenize_html_document(content):
     document = html5lib.parse(content, treebuilder='dom')
@@ -29,8 +281,8 @@ def tokenize_text_document(content):
     tokens = []
     for tok in re.finditer(WORD, content):
         text = tok.group(0)
-        start = tok.span()[0] + offset
-        end = tok.span()[1] + offset
+        start = tok.span()[0]
+        end = tok.span()[1]
 
         tokens.append((text,start,end))
 
@@ -0,0 +1,164 @@
+'''
+Persisted index of the text of a document: its inner text (the concatenated
+text nodes of an HTML document, or a plain text document as is) and the
+character offsets of its word tokens, so that the document does not need to be
+parsed again for annotation suggestions and text extraction.
+
+The index is stored in the `document_index` table, keyed by document ID and
+version, if that table exists (see `util/postgres/document-index.sql`).
+'''
+
+import array
+import html5lib
+import logging
+import sys
+from xml.dom.minidom import Text
+
+from .document_fragment import WORD
+
+logger = logging.getLogger('flask.error')
+
+# token offsets are stored as little-endian unsigned 32 bit integers
+_OFFSET_TYPECODE = 'I'
+
+
+class DocumentIndex:
+    '''
+    Inner text of a document, and the start and end offsets of its tokens.
+    '''
+    def __init__(self, text, starts, ends):
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentIndex) and (self.text, self.starts, self.ends) == (other.text, other.starts, other.ends)
+
+    def tokens(self):
+        '''
+        Get the tokens as tuples (text, start, end), like
+        `tokenize_html_document`.
+        '''
+        return [ (self.text[start:end], start, end) for start, end in zip(self.starts, self.ends) ]
+
+    @classmethod
+    def build(cls, content, content_type):
+        '''
+        Index the `content` of a document of type `content_type`, with only
+        one parse of an HTML document.
+        '''
+        if 'text/html' in content_type:
+            document = html5lib.parse(content, treebuilder='dom')
+            return cls._from_texts(_text_nodes(document))
+        elif 'text/plain' in content_type:
+            return cls._from_texts([content])
+        else:
+            raise ValueError(F'Unknown document type: "{content_type}".')
+
+    @classmethod
+    def _from_texts(cls, texts):
+        parts = []
+        starts = array.array(_OFFSET_TYPECODE)
+        ends = array.array(_OFFSET_TYPECODE)
+        offset = 0
+
+        # tokens do not span text nodes, as in `tokenize_html_document`
+        for data in texts:
+            for tok in WORD.finditer(data):
+                starts.append(offset + tok.start())
+                ends.append(offset + tok.end())
+
+            parts.append(data)
+            offset += len(data)
+
+        return cls(''.join(parts), starts, ends)
+
+    def offsets_to_bytes(self):
+        '''
+        Serialize the token offsets, interleaved as start and end of each
+        token.
+        '''
+        offsets = array.array(_OFFSET_TYPECODE, bytes(2 * len(self) * array.array(_OFFSET_TYPECODE).itemsize))
+        offsets[0::2] = array.array(_OFFSET_TYPECODE, self.starts)
+        offsets[1::2] = array.array(_OFFSET_TYPECODE, self.ends)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        return offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, text, data):
+        '''
+        Create the index from the inner `text` and the serialized token
+        offsets.
+        '''
+        offsets = array.array(_OFFSET_TYPECODE)
+        offsets.frombytes(data)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        return cls(text, offsets[0::2], offsets[1::2])
+
+
+def _text_nodes(node):
+    '''
+    Get the data of the text nodes below `node`, in document order.
+    '''
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if type(node) == Text:
+            yield node.data
+        else:
+            stack.extend(reversed(node.childNodes))
+
+
+def _index_stored(cursor):
+    return cursor.one("SELECT to_regclass('public.document_index');") is not None
+
+
+def load_document_index(cursor, document_id, version):
+    '''
+    Load the stored index of a document, or None if there is none.
+    '''
+    if not _index_stored(cursor):
+        return None
+
+    row = cursor.one('SELECT inner_text, token_offsets FROM document_index WHERE document_id = %s AND document_version = %s;', (document_id, version))
+    if row is None:
+        return None
+
+    return DocumentIndex.from_bytes(row.inner_text, bytes(row.token_offsets))
+
+
+def store_document_index(cursor, document_id, version, index):
+    '''
+    Store the index of a document, if the `document_index` table exists.
+    '''
+    if not _index_stored(cursor):
+        return
+
+    cursor.run('''DELETE FROM document_index WHERE document_id = %(document_id)s AND document_version <> %(version)s;
+    INSERT INTO document_index (document_id, document_version, inner_text, token_offsets)
+    VALUES (%(document_id)s, %(version)s, %(inner_text)s, %(token_offsets)s)
+    ON CONFLICT (document_id, document_version) DO NOTHING;''',
+        dict(document_id=document_id, version=version, inner_text=index.text, token_offsets=index.offsets_to_bytes()))
+
+
+def get_document_index(cursor, document, store=True):
+    '''
+    Get the index of a `document` row (with `id`, `version`, `content`, and
+    `content_type`). If none is stored, the document is indexed, and the index
+    is stored if `store` is set (the cursor must then be writable).
+    '''
+    index = load_document_index(cursor, document.id, document.version)
+    if index is not None:
+        return index
+
+    logger.info('Indexing text of document with ID %d.', document.id)
+    index = DocumentIndex.build(bytes(document.content).decode('utf-8'), document.content_type)
+    if store:
+        store_document_index(cursor, document.id, document.version, index)
+
+    return index
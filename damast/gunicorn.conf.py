@@ -0,0 +1,31 @@
+'''
+`gunicorn` configuration of the production server:
+
+    python3 -m gunicorn -c damast/gunicorn.conf.py -b <address> 'damast:create_app()'
+
+The number of worker processes is set by `DAMAST_WORKERS`. The master process
+generates the secret keys once and hands them to each worker after the fork,
+so that all workers, also those restarted later, accept the same sessions.
+Everything else is set up by each worker when it loads the app: database
+connections are opened per process, and the scheduled jobs only run in one
+worker (see `damast/scheduler.py`).
+'''
+
+import multiprocessing
+
+from damast.config import get_config
+from damast.secret_keys import generate_secrets, share_secrets
+
+_workers = get_config().workers
+
+worker_class = 'gevent'
+workers = _workers if _workers > 0 else multiprocessing.cpu_count()
+timeout = 0
+
+
+def on_starting(server):
+    server.damast_secrets = generate_secrets()
+
+
+def post_fork(server, worker):
+    share_secrets(server.damast_secrets)
@@ -7,9 +7,12 @@ import logging
 import os
 import re
 import subprocess
+import time
 import sys
+import threading
 import urllib.parse
 from postgres import Postgres
+from psycopg2_pool import ThreadSafeConnectionPool, PoolError
 from .config import get_config
 
 _databases = {
@@ -17,7 +20,12 @@ _databases = {
     'TESTING': 'testing'
         }
 
-def postgres_database():
+def postgres_url(application_name='damast', statement_timeout=None):
+    '''
+    Get the connection URL of the database. The `application_name` identifies
+    the connections of a subsystem in `pg_stat_activity`, and statements of
+    the connections are canceled after `statement_timeout` seconds, if set.
+    '''
     cfg = get_config()
     pg_user = cfg.pguser
     pg_host = cfg.pghost
@@ -28,7 +36,198 @@ def postgres_database():
         pg_db = _databases.get(cfg.environment)
     pg_pass = cfg.pgpassword
 
-    pg_url = F"postgres://{pg_user}:{urllib.parse.quote(pg_pass, safe='')}@{pg_host}:{pg_port}/{pg_db}"
+    params = dict(application_name=application_name)
+    if statement_timeout is not None:
+        params['options'] = F'-c statement_timeout={int(statement_timeout * 1000)}'
 
-    return Postgres(url=pg_url)
+    return F"postgres://{pg_user}:{urllib.parse.quote(pg_pass, safe='')}@{pg_host}:{pg_port}/{pg_db}?{urllib.parse.urlencode(params, quote_via=urllib.parse.quote)}"
 
+
+class InstrumentedConnectionPool(ThreadSafeConnectionPool):
+    '''
+    Connection pool that waits up to `wait_timeout` seconds for a connection
+    to be returned if all `maxconn` connections are in use, instead of failing
+    right away, and counts the checkouts and the time spent waiting.
+    '''
+    wait_timeout = 30
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.returned = threading.Condition(self.lock)
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+
+    def getconn(self):
+        with self.lock:
+            t0 = time.perf_counter()
+            waited = False
+            while True:
+                try:
+                    conn = super().getconn()
+                    # psycopg2_pool only marks newly opened connections as in use
+                    self.connections_in_use.add(conn)
+                    break
+                except PoolError:
+                    remaining = self.wait_timeout - (time.perf_counter() - t0)
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise
+
+                    waited = True
+                    self.returned.wait(remaining)
+
+            self.checkouts += 1
+            if waited:
+                wait_time = time.perf_counter() - t0
+                self.waits += 1
+                self.wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+
+            return conn
+
+    def putconn(self, conn):
+        with self.lock:
+            super().putconn(conn)
+            self.returned.notify()
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                    minconn=self.minconn,
+                    maxconn=self.maxconn,
+                    in_use=len(self.connections_in_use),
+                    idle=len(self.idle_connections),
+                    checkouts=self.checkouts,
+                    waits=self.waits,
+                    wait_time=self.wait_time,
+                    max_wait_time=self.max_wait_time,
+                    timeouts=self.timeouts,
+                    )
+
+
+def postgres_database(application_name='damast', statement_timeout=None, minconn=1, maxconn=10):
+    '''
+    Create a connection pool to the database for a subsystem (see
+    `postgres_url`). The pool statistics are available with `pg.pool.stats()`.
+    '''
+    return Postgres(url=postgres_url(application_name, statement_timeout), minconn=minconn, maxconn=maxconn,
+            pool_class=InstrumentedConnectionPool)
+
+
+def get_data_version(cursor):
+    '''
+    Get the current value of the data version counter, which is incremented on
+    each change to the historical data (see `util/postgres/data-version.sql`).
+    Returns `None` if the database does not provide the counter.
+    '''
+    if cursor.one("SELECT to_regclass('public.data_version');") is None:
+        return None
+
+    return cursor.one('SELECT version FROM data_version;')
+
+
+# refreshes of materialized views by this process: name -> (data version, time.monotonic())
+_refreshed = dict()
+_fallback_refresh_interval = 600
+
+
+def _refresh_tracked(cursor):
+    return cursor.one("SELECT to_regclass('public.materialized_view_refresh');") is not None
+
+
+def _up_to_date(cursor, name, version, tracked):
+    if tracked:
+        return version == cursor.one('SELECT data_version FROM materialized_view_refresh WHERE name = %s;', (name,))
+
+    if name not in _refreshed:
+        return False
+
+    last, refreshed = _refreshed[name]
+    if version is None:
+        return time.monotonic() - refreshed < _fallback_refresh_interval
+    return version == last
+
+
+def refresh_materialized_view(cursor, name):
+    '''
+    Refresh the materialized view `name` if the historical data changed since
+    its last refresh, i.e., if the data version counter changed. The refresh
+    is done concurrently, without blocking readers, if the view has a unique
+    index (see `util/postgres/place-religion-overview.sql`). Without the
+    counter, the view is refreshed if this process did not refresh it in the
+    last ten minutes. Returns the duration of the refresh in seconds, or None
+    if it was skipped.
+    '''
+    view = cursor.one('''SELECT M.ispopulated, EXISTS (
+            SELECT 1 FROM pg_index I
+            WHERE I.indrelid = to_regclass(%(name)s) AND I.indisunique AND I.indpred IS NULL AND I.indexprs IS NULL
+        ) AS unique_index
+        FROM pg_matviews M
+        WHERE M.schemaname = 'public' AND M.matviewname = %(name)s;''', dict(name=name))
+    if view is None:
+        return None
+
+    version = get_data_version(cursor)
+    tracked = version is not None and _refresh_tracked(cursor)
+    if view.ispopulated and _up_to_date(cursor, name, version, tracked):
+        return None
+
+    # the refresh is not subject to the statement timeout of the server's requests
+    cursor.execute('SET LOCAL statement_timeout = 0;')
+
+    # the view can only be refreshed concurrently once it is populated
+    concurrently = 'CONCURRENTLY ' if view.ispopulated and view.unique_index else ''
+    t0 = time.perf_counter()
+    cursor.execute(F'REFRESH MATERIALIZED VIEW {concurrently}{name};')
+    duration = time.perf_counter() - t0
+
+    _refreshed[name] = (version, time.monotonic())
+    if tracked:
+        cursor.execute('''INSERT INTO materialized_view_refresh (name, data_version, refreshed, duration)
+            VALUES (%(name)s, %(version)s, now(), %(duration)s)
+            ON CONFLICT (name) DO UPDATE SET data_version = EXCLUDED.data_version, refreshed = EXCLUDED.refreshed, duration = EXCLUDED.duration;''',
+            dict(name=name, version=version, duration=duration))
+
+    return duration
+
+
+def get_materialized_view_version(cursor, name):
+    '''
+    Get a string that changes with each refresh of the materialized view
+    `name`, or None if the view does not exist. A plain refresh replaces the
+    file of the view, a concurrent refresh is recorded in the database.
+    '''
+    filenode = cursor.one('SELECT relfilenode FROM pg_class WHERE oid = to_regclass(%(name)s);', dict(name=name))
+    if filenode is None:
+        return None
+
+    if _refresh_tracked(cursor):
+        refreshed = cursor.one('SELECT refreshed FROM materialized_view_refresh WHERE name = %s;', (name,))
+        if refreshed is not None:
+            return F'{name}-{filenode}-{refreshed.isoformat()}'
+
+    return F'{name}-{filenode}'
+
+
+def get_refresh_status(cursor, name):
+    '''
+    Get the time (`refreshed`) and duration in seconds (`duration`) of the last
+    refresh of the materialized view `name`, and for how many seconds since
+    then the historical data has changed without the view being refreshed
+    (`staleness`, 0 if the view is up to date). Returns None if the refreshes
+    are not recorded in the database.
+    '''
+    if get_data_version(cursor) is None or not _refresh_tracked(cursor):
+        return None
+
+    status = cursor.one('''SELECT R.refreshed, R.duration,
+            CASE WHEN R.data_version = V.version THEN 0 ELSE extract(epoch FROM now() - R.refreshed) END AS staleness
+        FROM materialized_view_refresh R, data_version V
+        WHERE R.name = %s;''', (name,))
+    if status is None:
+        return None
+
+    return dict(refreshed=status.refreshed.isoformat(), duration=status.duration, staleness=float(status.staleness))
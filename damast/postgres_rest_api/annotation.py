@@ -3,7 +3,7 @@ import werkzeug.exceptions
 from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparator
 from .decorators import rest_endpoint
 from .user_action import add_user_action
-from ..document_fragment import inner_text, extract_fragment
+from ..document_index import get_document_index
 
 name = 'annotation'
 
@@ -293,7 +293,8 @@ def jsonld_annotation_list_for_document(cursor, document_id):
 
     annotations = list(map(lambda x: x._asdict(), cursor.fetchall()))
 
-    document_content = str(cursor.one('SELECT content FROM document WHERE id = %s;', (document_id,)), 'utf-8')
+    document = cursor.one('SELECT id, version, content, content_type FROM document WHERE id = %s;', (document_id,))
+    text = get_document_index(cursor, document, store=False).text
 
     for annotation in annotations:
         ann = dict(type='Annotation')
@@ -312,7 +313,7 @@ def jsonld_annotation_list_for_document(cursor, document_id):
                 ),
             dict(
                 type='TextQuoteSelector',
-                exact=inner_text(extract_fragment(document_content, start, end - 1)),
+                exact=text[start:end - 1],
                 ),
             ])
 
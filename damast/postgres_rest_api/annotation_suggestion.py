@@ -2,6 +2,7 @@ import flask
 import werkzeug.exceptions
 from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparator
 from .decorators import rest_endpoint
+from .streaming import stream_json_list
 from .user_action import add_user_action
 from ..document_fragment import inner_text, extract_fragment
 
@@ -56,9 +57,6 @@ def document_annotation_suggestion_list(cursor, document_id):
     if 0 == cursor.one('SELECT COUNT(*) FROM document WHERE id = %s;', (document_id,)):
         raise werkzeug.exceptions.NotFound(F'No document with ID {document_id}.')
 
-    query = cursor.mogrify('SELECT * FROM annotation_suggestion WHERE document_id = %s;', (document_id,))
-    cursor.execute(query)
-
-    return flask.jsonify(list(map(lambda x: x._asdict(), cursor.fetchall())))
+    return stream_json_list(cursor, 'SELECT * FROM annotation_suggestion WHERE document_id = %s;', (document_id,))
 
 
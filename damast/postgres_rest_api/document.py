@@ -3,7 +3,7 @@ import re
 import werkzeug.exceptions
 from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparator
 from .decorators import rest_endpoint
-from ..document_fragment import extract_fragment
+from ..document_fragment import extract_fragment, get_offset_index_cache
 
 name = 'document'
 
@@ -133,9 +133,9 @@ def document(cursor, document_id):
     '''
     # TODO: suffix-length
     content = cursor.one('''SELECT
-        content,
         content_type,
-        content_length
+        content_length,
+        version
     FROM
         document
     WHERE
@@ -144,8 +144,8 @@ def document(cursor, document_id):
     if content is None:
         raise werkzeug.exceptions.NotFound(F'No document with ID {document_id}')
 
-    barr = content.content.tobytes()
     length = content.content_length
+    barr = None
 
     range_ = flask.request.headers.get('Range', None)
 
@@ -159,21 +159,34 @@ def document(cursor, document_id):
             if start > 0 or end < length-1:
                 return_code = 206
                 headers['Content-Range'] = F'bytes {start}-{end}/{length}'
-                barr = barr[start:end+1]
+                barr = _document_content(cursor, document_id)[start:end+1]
 
         elif 'text/html' in content.content_type:
             start, end = _calc_range(_characters_spec, range_, 'Only a single range of characters supported', length)
             if start > 0 or end < length-1:
                 return_code = 206
                 headers['Content-Range'] = F'content-characters {start}-{end}/{length}'
-                barr = extract_fragment(barr, start, end+1)
+
+                # cut out of the cached index of the document if possible
+                index = get_offset_index_cache().get((document_id, content.version), lambda: _document_content(cursor, document_id))
+                if index is not None:
+                    barr = index.extract(start, end+1)
+                else:
+                    barr = extract_fragment(_document_content(cursor, document_id), start, end+1)
         else:
             raise werkzeug.exceptions.RequestedRangeNotSatisfiable(length, description=F'Document content type \'{content.content_type}\' does not support range requests.')
 
+    if barr is None:
+        barr = _document_content(cursor, document_id)
+
     resp = flask.Response(barr, content_type=content.content_type, headers=headers)
 
     return resp, return_code
 
+
+def _document_content(cursor, document_id):
+    return cursor.one('SELECT content FROM document WHERE id = %s;', (document_id,)).tobytes()
+
 def _calc_range(regex, range_, err_msg, length):
     m = regex.fullmatch(range_)
     if not m:
@@ -2,6 +2,7 @@ import flask
 from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparator
 
 from .decorators import rest_endpoint
+from .streaming import stream_json_list
 
 name = 'person-list'
 
@@ -29,6 +30,4 @@ def person_list(cursor):
           ...
         ]
     '''
-    cursor.execute('select * from person;')
-
-    return flask.jsonify(list(map(lambda x: x._asdict(), cursor.fetchall())))
+    return stream_json_list(cursor, 'select * from person;')
@@ -8,6 +8,8 @@ from .util import parse_place,parse_geoloc,format_geoloc
 from .user_action import add_user_action
 
 from .decorators import rest_endpoint
+from .response_cache import versioned_response
+from .streaming import stream_json_list
 
 name = 'place'
 
@@ -41,14 +43,12 @@ def place_data_all(c):
           ...
         ]
     '''
-    c.execute('select * from place;')
-
     def _parse(x):
         d = x._asdict()
         d['geoloc'] = parse_geoloc(d['geoloc'])
         return d
 
-    return flask.jsonify(list(map(_parse, c.fetchall())))
+    return stream_json_list(c, 'select * from place;', parse=_parse)
 
 
 @app.route('/place-type-list', role=['user', 'visitor'])
@@ -398,6 +398,7 @@ def get_places(c):
 
 @app.route('/place-list', role=['user', 'visitor'])
 @rest_endpoint
+@versioned_response
 def get_place_list(c):
     '''
     Get a list of places.
@@ -829,7 +830,7 @@ def get_place_list_detailed(c):
           ...
         ]
     '''
-    c.execute('''SELECT
+    return stream_json_list(c, '''SELECT
     P.id AS place_id,
     P.name AS place_name,
     P.comment AS place_comment,
@@ -858,5 +859,3 @@ def get_place_list_detailed(c):
 FROM place P
 JOIN place_type PT ON P.place_type_id = PT.id
 WHERE P.visible AND PT.visible;''')
-
-    return flask.jsonify(list(map(lambda x: x._asdict(), c.fetchall())))
@@ -2,6 +2,7 @@ import flask
 import psycopg2
 from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparator
 from .decorators import rest_endpoint
+from .response_cache import versioned_response
 
 name = 'religion'
 app = AuthenticatedBlueprintPreparator(name, __name__, template_folder=None)
@@ -9,6 +10,7 @@ app = AuthenticatedBlueprintPreparator(name, __name__, template_folder=None)
 
 @app.route('/religions', role=['user', 'visitor'])
 @rest_endpoint
+@versioned_response
 def get_all_religions(c):
     '''
     Get a hierarchy of religions.
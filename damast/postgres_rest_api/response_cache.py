@@ -0,0 +1,137 @@
+'''
+Caching of REST API responses that only depend on the historical data.
+
+The responses of the decorated endpoints are versioned by the data version
+counter of the database (see `util/postgres/data-version.sql`), or, for
+endpoints that read from a materialized view, by its last refresh. The version determines the ETag of the
+response, so that a client's `If-None-Match` request is answered with 304
+before the data is queried, and the key under which the rendered response is
+kept in an in-memory LRU cache (`DAMAST_REST_CACHE_MAXSIZE`). If the database
+does not provide the counter, responses are neither versioned nor cached.
+'''
+
+import hashlib
+import threading
+from functools import wraps
+from collections import OrderedDict, namedtuple
+
+import flask
+
+from ..postgres_database import get_data_version, get_materialized_view_version
+
+_CachedResponse = namedtuple('CachedResponse', ['version', 'data', 'mimetype'])
+
+_cache = OrderedDict()  # (endpoint, arguments) -> _CachedResponse
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+
+def _version(cursor, materialized_view):
+    if materialized_view is None:
+        version = get_data_version(cursor)
+        return None if version is None else F'data-{version}'
+
+    return get_materialized_view_version(cursor, materialized_view)
+
+
+def _lookup(key, version):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None or entry.version != version:
+            return None
+
+        _cache.move_to_end(key)
+        return entry
+
+
+def _store(key, entry, maxsize):
+    global _cache_size
+    with _cache_lock:
+        previous = _cache.pop(key, None)
+        if previous is not None:
+            _cache_size -= len(previous.data)
+
+        _cache[key] = entry
+        _cache_size += len(entry.data)
+
+        # evict least-recently used entries above the size limit
+        while _cache_size > maxsize and len(_cache) > 0:
+            _, evicted = _cache.popitem(last=False)
+            _cache_size -= len(evicted.data)
+
+
+def _store_when_complete(chunks, key, version, mimetype, maxsize):
+    '''
+    Pass the chunks of a streamed response through, and cache the response
+    once it was sent completely.
+    '''
+    data = []
+    for chunk in chunks:
+        data.append(chunk)
+        yield chunk
+
+    _store(key, _CachedResponse(version, b''.join(data), mimetype), maxsize)
+
+
+def clear_response_cache():
+    global _cache_size
+    with _cache_lock:
+        _cache.clear()
+        _cache_size = 0
+
+
+def versioned_response(func=None, *, materialized_view=None, media_types=None):
+    '''
+    Decorator for read-only REST endpoints whose response only depends on the
+    historical data and the request arguments. If the data is read from a
+    materialized view, its name must be passed as `materialized_view`. If the
+    endpoint negotiates its format by the Accept header, the `media_types` it
+    offers must be passed, so that each format is cached separately. This
+    must be applied below `rest_endpoint`, so that the user is authorized
+    before a response is served from the cache.
+    '''
+    if func is None:
+        return lambda f: versioned_response(f, materialized_view=materialized_view, media_types=media_types)
+
+    @wraps(func)
+    def wrapper(cursor, *args, **kwargs):
+        if flask.request.method not in ('GET', 'HEAD'):
+            return func(cursor, *args, **kwargs)
+
+        version = _version(cursor, materialized_view)
+        if version is None:
+            return func(cursor, *args, **kwargs)
+
+        key = (flask.request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(flask.request.args.items(multi=True))))
+        if media_types is not None:
+            key += (flask.request.accept_mimetypes.best_match(media_types, media_types[0]),)
+        etag = hashlib.sha1(repr((flask.current_app.version, version, key)).encode('utf-8')).hexdigest()
+
+        if flask.request.if_none_match.contains_weak(etag):
+            response = flask.Response(status=304)
+
+        else:
+            entry = _lookup(key, version)
+            if entry is not None:
+                response = flask.Response(entry.data, mimetype=entry.mimetype)
+            else:
+                response = flask.make_response(func(cursor, *args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+                maxsize = flask.current_app.damast_config.rest_cache_maxsize * 1000000
+                if maxsize > 0 and response.is_streamed:
+                    response.response = _store_when_complete(response.iter_encoded(), key, version, response.mimetype, maxsize)
+                elif maxsize > 0:
+                    _store(key, _CachedResponse(version, response.get_data(), response.mimetype), maxsize)
+
+        # weak, because the compression is applied later and depends on the request
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        if media_types is not None:
+            response.vary.add('Accept')
+
+        return response
+
+    return wrapper
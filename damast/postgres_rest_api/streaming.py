@@ -0,0 +1,122 @@
+'''
+Streaming JSON responses for large list endpoints.
+
+The rows are read with a server-side (named) cursor in batches of `itersize`
+and encoded batch by batch, so that neither the full result set nor the full
+JSON document is held in memory, and the client receives the first rows while
+the rest are still read. The items are encoded like `CustomJSONProvider` does,
+i.e., with the `NumericRangeEncoder` and the `json.dumps` defaults, so the
+streamed document is identical to the one of `flask.jsonify`.
+
+The named cursor lives on its own connection from the pool, because the cursor
+of `rest_endpoint` is closed when the endpoint returns. The connection is put
+back into the pool when the response is closed, i.e., only after the client
+has read the whole response. A streamed response thus holds up to two
+connections, the one of the endpoint and its own. So that slow clients cannot
+use up the pool, at most `DAMAST_PG_POOL_MAXSTREAMS` responses are streamed at
+a time, and never so many that their connections would fill the pool; further
+responses are read completely on the cursor of the endpoint, without another
+connection, and sent with `flask.jsonify`.
+'''
+
+import contextlib
+import threading
+
+import flask
+
+from .util import NumericRangeEncoder
+
+_itersize = 2000
+
+
+def _as_dict(row):
+    return row._asdict()
+
+
+def _encode_batches(first, cursor, parse, itersize):
+    encode = NumericRangeEncoder().encode
+
+    batch = first
+    prefix = '['
+    while len(batch) > 0:
+        yield (prefix + ', '.join(encode(parse(row)) for row in batch)).encode('utf-8')
+        prefix = ', '
+        batch = cursor.fetchmany(itersize)
+
+    yield (']' if prefix == ', ' else '[]').encode('utf-8')
+
+
+class StreamSlots:
+    '''
+    Bounded number of responses that may be streamed at the same time, and
+    counts of the streamed and buffered responses.
+    '''
+    def __init__(self, maxstreams):
+        self.maxstreams = maxstreams
+        self.streaming = 0
+        self.streamed = 0
+        self.buffered = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.streaming >= self.maxstreams:
+                self.buffered += 1
+                return False
+
+            self.streaming += 1
+            self.streamed += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.streaming -= 1
+
+    def stats(self):
+        with self._lock:
+            return dict(maxstreams=self.maxstreams, streaming=self.streaming, streamed=self.streamed, buffered=self.buffered)
+
+
+_slots = None
+
+def get_stream_slots():
+    global _slots
+    if _slots is None:
+        config = flask.current_app.damast_config
+        # each stream holds the connection of its endpoint while it gets its own
+        _slots = StreamSlots(max(0, min(config.pg_pool_maxstreams, (config.pg_pool_maxconn - 1) // 2)))
+    return _slots
+
+
+def stream_json_list(cursor, query, params=None, parse=_as_dict, itersize=_itersize):
+    '''
+    Run the read-only `query` with `params` and respond with a streamed JSON
+    array of `parse(row)` for each row. The query is executed, and the first
+    batch is fetched, before the response is returned, so that database errors
+    are still handled by `rest_endpoint`. If too many responses are streamed
+    already, the rows are read completely with `cursor`, the cursor of the
+    endpoint.
+    '''
+    slots = get_stream_slots()
+    if not slots.acquire():
+        cursor.execute(query, params)
+        return flask.jsonify([ parse(row) for row in cursor.fetchall() ])
+
+    resources = contextlib.ExitStack()
+    resources.callback(slots.release)
+    try:
+        connection = resources.enter_context(flask.current_app.pg.get_connection(readonly=True))
+        cursor = connection.cursor(name='stream_json_list')
+        resources.callback(cursor.close)
+
+        cursor.itersize = itersize
+        cursor.execute(query, params)
+        first = cursor.fetchmany(itersize)
+
+    except:
+        resources.close()
+        raise
+
+    response = flask.Response(_encode_batches(first, cursor, parse, itersize), mimetype='application/json')
+    response.call_on_close(resources.close)
+    return response
@@ -7,6 +7,7 @@ from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparato
 from .user_action import add_user_action
 from .util import parse_evidence, parse_geoloc
 from .decorators import rest_endpoint
+from .response_cache import versioned_response
 
 name = 'tags'
 app = AuthenticatedBlueprintPreparator(name, __name__, template_folder=None)
@@ -37,6 +38,7 @@ def get_tag_list(c):
 
 @app.route('/tag-sets', role=['user', 'visitor'])
 @rest_endpoint
+@versioned_response
 def get_tag_sets(c):
     '''
     Get the set of evidence IDs for each tag.
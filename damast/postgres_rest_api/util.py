@@ -31,6 +31,12 @@ def parse_place(place):
 def format_geoloc(g):
     return None if g is None else F'({g["lat"]},{g["lng"]})'
 
+def _span_start(ts):
+    return None if ts is None else ts.lower if (ts.lower is None or ts.lower_inc) else ts.lower+1
+
+def _span_end(ts):
+    return None if ts is None else ts.upper if (ts.upper is None or ts.upper_inc) else ts.upper-1
+
 def parse_evidence(record):
     d = dict(
             tuple_id=record.tuple_id,
@@ -44,14 +50,58 @@ def parse_evidence(record):
             religion_confidence=record.religion_confidence,
             source_ids=record.source_ids
             )
-    ts = record.time_span
-    start_time = None if ts is None else ts.lower if (ts.lower is None or ts.lower_inc) else ts.lower+1
-    end_time = None if ts is None else ts.upper if (ts.upper is None or ts.upper_inc) else ts.upper-1
-    d['time_span'] = dict(start=start_time, end=end_time)
+    d['time_span'] = dict(start=_span_start(record.time_span), end=_span_end(record.time_span))
 
     return d
 
 
+evidence_columns_mimetype = 'application/vnd.damast.evidence-columns+json'
+
+def _dictionary_encode(values):
+    '''
+    Encode a column as its distinct values, in order of appearance, and the
+    index of each value among them.
+    '''
+    dictionary = dict()
+    codes = [ dictionary.setdefault(v, len(dictionary)) for v in values ]
+    return dict(dictionary=list(dictionary), codes=codes)
+
+def _list_encode(lists, encode=list):
+    '''
+    Encode a column of lists as the length of each list (-1 for null) and the
+    concatenated values.
+    '''
+    lengths = [ -1 if l is None else len(l) for l in lists ]
+    values = [ v for l in lists if l is not None for v in l ]
+    return dict(lengths=lengths, values=encode(values))
+
+def evidence_columns(records):
+    '''
+    Column-oriented counterpart of `parse_evidence` for a list of records. Each
+    key of `parse_evidence` maps to the column of its values, except that
+    confidences are dictionary-encoded, lists are encoded by their lengths, and
+    `time_span` holds the columns `start` and `end`.
+    '''
+    def column(name):
+        return [ getattr(r, name) for r in records ]
+
+    spans = column('time_span')
+
+    return dict(
+            tuple_id=column('tuple_id'),
+            place_id=column('place_id'),
+            religion_id=column('religion_id'),
+            time_span=dict(start=[ _span_start(ts) for ts in spans ], end=[ _span_end(ts) for ts in spans ]),
+            source_ids=_list_encode(column('source_ids')),
+            time_confidence=_dictionary_encode(column('time_confidence')),
+            location_confidence=_dictionary_encode(column('location_confidence')),
+            place_attribution_confidence=_dictionary_encode(column('place_attribution_confidence')),
+            source_confidences=_list_encode(column('source_confidences'), _dictionary_encode),
+            interpretation_confidence=_dictionary_encode(column('interpretation_confidence')),
+            religion_confidence=_dictionary_encode(column('religion_confidence')),
+            )
+
+
 def istime(t):
     if isinstance(t, psycopg2.extras.NumericRange):
         if t.isempty:
@@ -13,7 +13,9 @@ import traceback
 import sys
 import os
 import gzip
-from io import BytesIO
+import zlib
+import hashlib
+from contextlib import contextmanager
 from datetime import datetime
 import dateutil.parser
 from functools import lru_cache, namedtuple
@@ -23,7 +25,7 @@ from .verbalize_filters import verbalize, get_filter_description
 
 from .filters import blueprint as filter_blueprint
 from .place_geojson import blueprint as geojson_blueprint
-from .report_database import ReportTuple, get_report_database, start_report, update_report_access, recreate_report_after_evict, evict_report as do_evict_report
+from .report_database import ReportMetadata, report_metadata_columns, open_report_artifact, get_report_database, start_report, update_report_access, flush_report_access, recreate_report_after_evict, ensure_report_worker, get_queue_status, ReportQueueFull, evict_report as do_evict_report
 from .datatypes import Evidence, Place
 from .init_post import init_post
 
@@ -41,10 +43,19 @@ def root():
 
 
 
+@contextmanager
+def _queue_admission():
+    try:
+        yield
+    except ReportQueueFull as err:
+        raise werkzeug.exceptions.ServiceUnavailable(F'{err} Please try again later.', retry_after=err.retry_after)
+
+
 def _start_report(filter_json):
     current_user = flask.current_app.auth.current_user()
     username = current_user.name if not current_user.visitor else 'visitor'
-    u = start_report(username, flask.current_app.version, filter_json)
+    with _queue_admission():
+        u = start_report(username, flask.current_app.version, filter_json)
     response = flask.redirect(flask.url_for('reporting.get_report', report_id=u))
 
     return response
@@ -96,11 +107,11 @@ def get_report_data(report_id):
     current_user = flask.current_app.auth.current_user()
     username = current_user.name if not current_user.visitor else 'visitor'
     with get_report_database() as db:
-        db.execute(F'SELECT {", ".join(ReportTuple._fields)} FROM reports WHERE uuid = ?;', (report_id,))
+        db.execute(F'SELECT {report_metadata_columns} FROM reports WHERE uuid = ?;', (report_id,))
         row = db.fetchone()
         if row is None:
             flask.abort(404)
-        tpl = ReportTuple(*row)
+        tpl = ReportMetadata(*row)
 
         if 'admin' not in current_user.roles and username != tpl.user:
             flask.abort(404)
@@ -108,16 +119,118 @@ def get_report_data(report_id):
         return tpl
 
 
+def _format_eta(seconds):
+    if seconds < 60:
+        return 'less than a minute'
+    minutes = math.ceil(seconds / 60)
+    return F'about {minutes} minute{"" if minutes == 1 else "s"}'
+
+
 def _wait_for_report(endpoint, report_id):
+    # (re)start the report worker in case it is not running, e.g., after a server restart
+    ensure_report_worker()
+
+    url = flask.url_for(endpoint, report_id=report_id)
+    status = get_queue_status(report_id)
+
+    if status is not None and status.eta is not None:
+        # reload when the report should be done, but regularly enough to update the queue position
+        delay = min(30, max(2, math.ceil(status.eta)))
+        return flask.render_template('reporting/wait.html', delay=delay, next_delay=delay, url=url,
+                position=status.position, eta=_format_eta(status.eta))
+
     try:
         delay = int(flask.request.args.get('t'))
     except:
         delay = 5
 
     next_delay = min(60, int(1.5*delay))
-    url = flask.url_for(endpoint, report_id=report_id)
 
-    return flask.render_template('reporting/wait.html', delay=delay, next_delay=next_delay, url=url)
+    return flask.render_template('reporting/wait.html', delay=delay, next_delay=next_delay, url=url,
+            position=None if status is None else status.position, eta=None)
+
+def _decompress(chunks):
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)  # gzip
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if len(data) > 0:
+            yield data
+
+    yield decompressor.flush()
+
+
+def _compress(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)  # gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if len(data) > 0:
+            yield data
+
+    yield compressor.flush()
+
+
+def _artifact_etag(artifact, completed, encoding, *parts):
+    h = hashlib.sha1()
+    for part in (artifact.report_id, artifact.column, str(completed), encoding, *parts):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def _artifact_response(artifact, report, chunks, encoding, *etag_parts, content_length=None, **kwargs):
+    '''
+    Create a response that streams `chunks` from the open `artifact`. The ETag
+    is set here, because computing it from the response data in `app.py` would
+    consume the stream.
+    '''
+    response = flask.Response(chunks, **kwargs)
+    response.call_on_close(artifact.close)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    if content_length is not None:
+        response.headers['Content-Length'] = content_length
+    response.set_etag(_artifact_etag(artifact, report.completed, encoding, *etag_parts))
+
+    return response
+
+
+# marks the place of the report content in the rendered report page
+_content_placeholder = '<!-- damast:report-content -->'
+
+def _report_page(report, artifact, status):
+    '''
+    Render the report page around the HTML content, which is decompressed (and
+    compressed again, if the client accepts gzip) chunk by chunk while it is
+    sent. The stored content cannot be passed through as is, because it is
+    embedded in the page.
+    '''
+    page = flask.render_template('reporting/report.html', content=_content_placeholder,
+            report_id=report.uuid, has_pdf=(report.pdf_report_size is not None))
+    head, tail = page.split(_content_placeholder, 1)
+    head = head.encode('utf-8')
+    tail = tail.encode('utf-8')
+
+    def chunks():
+        yield head
+        yield from _decompress(artifact)
+        yield tail
+
+    if 'gzip' in flask.request.accept_encodings:
+        return _artifact_response(artifact, report, _compress(chunks()), 'gzip', page, status=status, mimetype='text/html')
+
+    return _artifact_response(artifact, report, chunks(), 'identity', page, status=status, mimetype='text/html')
+
+
+def _send_pdf(report, artifact):
+    '''
+    Send a stored PDF. If the client accepts gzip, the stored gzip-compressed
+    BLOB is passed through as it is, otherwise it is decompressed chunk by chunk.
+    '''
+    if 'gzip' in flask.request.accept_encodings:
+        return _artifact_response(artifact, report, artifact, 'gzip', content_length=artifact.size, mimetype='application/pdf')
+
+    return _artifact_response(artifact, report, _decompress(artifact), 'identity', mimetype='application/pdf')
+
 
 @app.route('/<string:report_id>.html', role=['reporting', 'dev', 'admin'], methods=['GET'])
 def get_report(report_id):
@@ -126,7 +239,8 @@ def get_report(report_id):
     if report.report_state == 'started':
         return _wait_for_report('reporting.get_report', report_id)
     elif report.report_state == 'evicted':
-        recreate_report_after_evict(report_id)
+        with _queue_admission():
+            recreate_report_after_evict(report_id)
         return _wait_for_report('reporting.get_report', report_id)
     elif report.report_state in ('failed', 'completed'):
         if report.report_state == 'completed':
@@ -134,12 +248,13 @@ def get_report(report_id):
         else:
             errorcode = 410
 
-        content = gzip.decompress(report.content).decode('utf-8')
-        has_pdf = (report.pdf_report is not None)
+        artifact = open_report_artifact(report_id, 'content')
+        if artifact is None:
+            flask.abort(404)
 
         update_report_access(report_id)
 
-        return flask.render_template('reporting/report.html', content=content, report_id=report_id, has_pdf=has_pdf), errorcode
+        return _report_page(report, artifact, errorcode)
     else:
         flask.abort(500, F'Unknown report state reached: {report.report_state}')
 
@@ -152,23 +267,22 @@ def get_map(report_id):
     if report.report_state == 'started':
         return _wait_for_report('reporting.get_map', report_id)
     elif report.report_state == 'evicted':
-        recreate_report_after_evict(report_id)
+        with _queue_admission():
+            recreate_report_after_evict(report_id)
         return _wait_for_report('reporting.get_map', report_id)
     elif report.report_state in ('failed', 'completed'):
-        if report.pdf_map is None:
+        if report.pdf_map_size is None:
             flask.abort(404)
         elif report.report_state == 'failed':
             flask.abort(410, 'The report could not be completed.')
 
-        pdf = BytesIO(report.pdf_map)
-
-        response = flask.send_file(pdf, mimetype='application/pdf')
-        response.headers['Content-Encoding'] = 'gzip'
-        response.direct_passthrough = False
+        artifact = open_report_artifact(report_id, 'pdf_map')
+        if artifact is None:
+            flask.abort(404)
 
         update_report_access(report_id)
 
-        return response
+        return _send_pdf(report, artifact)
 
     else:
         flask.abort(500, F'Unknown report state reached: {report.report_state}')
@@ -182,23 +296,22 @@ def get_pdf_report(report_id):
     if report.report_state == 'started':
         return _wait_for_report('reporting.get_pdf_report', report_id)
     elif report.report_state == 'evicted':
-        recreate_report_after_evict(report_id)
+        with _queue_admission():
+            recreate_report_after_evict(report_id)
         return _wait_for_report('reporting.get_pdf_report', report_id)
     elif report.report_state in ('failed', 'completed'):
-        if report.pdf_report is None:
+        if report.pdf_report_size is None:
             flask.abort(404)
         elif report.report_state == 'failed':
             flask.abort(410, 'The report could not be completed.')
 
-        pdf = BytesIO(report.pdf_report)
-
-        response = flask.send_file(pdf, mimetype='application/pdf')
-        response.headers['Content-Encoding'] = 'gzip'
-        response.direct_passthrough = False
+        artifact = open_report_artifact(report_id, 'pdf_report')
+        if artifact is None:
+            flask.abort(404)
 
         update_report_access(report_id)
 
-        return response
+        return _send_pdf(report, artifact)
 
     else:
         flask.abort(500, F'Unknown report state reached: {report.report_state}')
@@ -224,6 +337,9 @@ def list_available_reports():
     if current_user.visitor:
         flask.abort(401)
 
+    # show the current access counts
+    flush_report_access()
+
     with get_report_database() as db:
         restriction = '' if 'admin' in current_user.roles else 'WHERE user = :user'
         db.execute(F'SELECT count(*) FROM reports {restriction};', dict(user=current_user.name))
@@ -244,9 +360,9 @@ def list_available_reports():
 
         last_page_offset = count - (count % limit)
 
-        query = F'SELECT {", ".join(ReportTuple._fields)} FROM reports {restriction} ORDER BY started DESC LIMIT :limit OFFSET :offset;'
+        query = F'SELECT {report_metadata_columns} FROM reports {restriction} ORDER BY started DESC LIMIT :limit OFFSET :offset;'
 
-        reports_ = map(lambda x: ReportTuple(*x), db.execute(query, dict(user=current_user.name, limit=limit, offset=offset)))
+        reports_ = map(lambda x: ReportMetadata(*x), db.execute(query, dict(user=current_user.name, limit=limit, offset=offset)))
 
         reports = []
         for r in reports_:
@@ -301,6 +417,39 @@ def rerun_report(report_id):
     return _start_report(filt)
 
 
+@app.route('/queue', role=['admin'], methods=['GET'])
+def report_queue_status():
+    '''
+    Get the state of the report generation queue and the durations of the
+    report generation stages of recently finished reports, as JSON.
+    '''
+    limit = int(flask.request.args.get('limit', 100))
+    now = datetime.now().astimezone()
+
+    with get_report_database() as db:
+        db.execute('SELECT count(*) FROM report_queue WHERE claimed IS NULL;')
+        (queue_depth,) = db.fetchone()
+
+        db.execute('SELECT uuid, enqueued, claimed, worker_pid FROM report_queue WHERE claimed IS NOT NULL ORDER BY claimed ASC;')
+        running = [ dict(uuid=uuid, enqueued=enqueued.isoformat(), claimed=claimed.isoformat(), runtime=(now - claimed).total_seconds(), worker_pid=pid)
+                for uuid, enqueued, claimed, pid in db.fetchall() ]
+
+        db.execute('''SELECT stage, count(*), avg(duration), min(duration), max(duration)
+            FROM report_stage_duration
+            WHERE uuid IN (SELECT uuid FROM report_stage_duration WHERE stage = 'total' ORDER BY finished DESC LIMIT :limit)
+            GROUP BY stage
+            ORDER BY stage;''', dict(limit=limit))
+        stages = { stage: dict(count=count, mean=mean, min=min_, max=max_) for stage, count, mean, min_, max_ in db.fetchall() }
+
+    return flask.jsonify(dict(
+        workers=flask.current_app.damast_config.report_workers,
+        queue_maxsize=flask.current_app.damast_config.report_queue_maxsize,
+        queue_depth=queue_depth,
+        running=running,
+        stage_durations=stages,
+        ))
+
+
 @app.route('/<string:report_id>/evict', role=['admin'], methods=['GET'])
 def evict_report(report_id):
     do_evict_report(report_id)
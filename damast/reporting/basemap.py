@@ -0,0 +1,237 @@
+'''
+Pre-projected, tiled store of the map features (waterbodies and rivers) that
+are drawn below the report maps.
+
+The map features are projected to WebMercator (EPSG:3857) once, simplified at
+several levels of detail, and split along a quadtree tile grid, like the tiles
+of a web map. A report map then only loads the tiles that intersect its
+extent, at the level of detail that suits its size. Each level is split at a
+tile size of about 1000 times its simplification tolerance, so that a map
+always covers a similar number of tiles.
+
+The store is built from the map features (`features.geo.json.gz`) by
+`util/report-map` and saved next to them. If it does not exist, it is built
+when the map data is first loaded.
+'''
+
+import gzip
+import math
+import pickle
+import logging
+import os.path
+from collections import defaultdict, namedtuple
+
+import geopandas as gpd
+import shapely.wkb
+from shapely.ops import clip_by_rect
+from shapely.geometry import Polygon, MultiPolygon, LineString, MultiLineString
+from shapely.geometry.polygon import orient
+
+_max_latitude = 85.0511287798066
+_half_world = 20037508.342789244  # half the circumference of the earth in WebMercator
+
+# simplification tolerances of the levels in meters
+_tolerances = (250, 1000, 4000, 16000)
+
+# approximate width of the map in the report, in pixels
+_map_width_pixels = 1000
+
+_store_version = 1
+_map_data_dir = os.path.join(os.getcwd(), 'damast', 'reporting/map-data')
+features_file = os.path.join(_map_data_dir, 'features.geo.json.gz')
+store_file = os.path.join(_map_data_dir, 'basemap.pickle.gz')
+
+BasemapLevel = namedtuple('BasemapLevel', ['tolerance', 'zoom', 'tiles'])
+
+_polygonal = (Polygon, MultiPolygon)
+_lineal = (LineString, MultiLineString)
+
+
+def _zoom(tolerance):
+    return max(0, round(math.log2(2 * _half_world / (1000 * tolerance))))
+
+
+def _parts(geom, types):
+    '''
+    Get the non-empty parts of `geom` of the given geometry types, also from
+    geometry collections as they result from intersections.
+    '''
+    if geom.is_empty:
+        return []
+    if isinstance(geom, types):
+        return [geom]
+    if hasattr(geom, 'geoms'):
+        return [ p for g in geom.geoms for p in _parts(g, types) ]
+    return []
+
+
+def _tile_box(x, y, zoom):
+    size = 2 * _half_world / 2**zoom
+    return (-_half_world + x * size, -_half_world + y * size, -_half_world + (x+1) * size, -_half_world + (y+1) * size)
+
+
+def _split(geom, types, x, y, zoom, max_zoom, tiles):
+    '''
+    Split `geom`, which lies within tile (x, y) of `zoom`, into the tiles of
+    `max_zoom` by recursively splitting it into quadrants. Pieces that lie
+    completely within one quadrant are passed on without intersection.
+    '''
+    if zoom == max_zoom:
+        tiles[(x, y)].extend(_parts(geom, types))
+        return
+
+    minx, miny, maxx, maxy = geom.bounds
+    for cx in (2*x, 2*x + 1):
+        for cy in (2*y, 2*y + 1):
+            x0, y0, x1, y1 = _tile_box(cx, cy, zoom + 1)
+            if minx >= x1 or maxx <= x0 or miny >= y1 or maxy <= y0:
+                continue
+
+            if minx >= x0 and maxx <= x1 and miny >= y0 and maxy <= y1:
+                piece = geom
+            else:
+                piece = clip_by_rect(geom, x0, y0, x1, y1)
+
+            for part in _parts(piece, types):
+                _split(part, types, cx, cy, zoom + 1, max_zoom, tiles)
+
+
+def build_basemap(features):
+    '''
+    Build the store from the map features (a GeoSeries in EPSG:4326). Returns
+    a dictionary of plain Python types, which can be pickled independently of
+    the Shapely version.
+    '''
+    def _clip(geom):
+        # WebMercator does not reach the poles
+        minx, miny, maxx, maxy = geom.bounds
+        if miny >= -_max_latitude and maxy <= _max_latitude:
+            return geom
+        return clip_by_rect(geom, -180, -_max_latitude, 180, _max_latitude)
+
+    features = gpd.GeoSeries([ _clip(g) for g in features if g is not None ], crs='EPSG:4326').to_crs(epsg=3857)
+
+    waterbodies = [ p for g in features for p in _parts(g, _polygonal) ]
+    rivers = [ p for g in features for p in _parts(g, _lineal) ]
+
+    levels = []
+    for tolerance in _tolerances:
+        zoom = _zoom(tolerance)
+
+        water = [ orient(p) for w in waterbodies for p in _parts(w.simplify(tolerance, preserve_topology=True), Polygon) ]
+        layers = dict(
+                water=(water, Polygon),
+                coast=([ w.boundary for w in water ], LineString),
+                rivers=([ r.simplify(tolerance, preserve_topology=True) for r in rivers ], LineString),
+                )
+
+        level = dict(tolerance=tolerance, zoom=zoom, layers=dict())
+        for name, (geoms, types) in layers.items():
+            tiles = defaultdict(list)
+            for geom in geoms:
+                for part in _parts(geom, (types, MultiPolygon, MultiLineString)):
+                    _split(part, types, 0, 0, 0, zoom, tiles)
+
+            level['layers'][name] = [ (x, y, shapely.wkb.dumps(geom)) for (x, y), geoms in tiles.items() for geom in geoms ]
+
+        levels.append(level)
+        logging.getLogger('flask.error').info('Built basemap level with tolerance %dm (zoom %d): %s.', tolerance, zoom,
+                ', '.join(F'{len(v)} {k} pieces' for k, v in level['layers'].items()))
+
+    return dict(version=_store_version, crs='EPSG:3857', levels=levels)
+
+
+def save_basemap(store, path=store_file):
+    with gzip.open(path, 'wb') as f:
+        pickle.dump(store, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_features(path=features_file):
+    with gzip.open(path) as f:
+        return gpd.GeoSeries.from_file(f, crs='EPSG:4326', driver='GeoJSON')
+
+
+def load_basemap(path=store_file):
+    '''
+    Load the store as a list of `BasemapLevel`s, ordered from the finest to the
+    coarsest level. If the store does not exist, it is built from the map
+    features.
+    '''
+    if os.path.exists(path):
+        with gzip.open(path) as f:
+            store = pickle.load(f)
+        logging.getLogger('flask.error').info(F'Loaded basemap from {path}.')
+    else:
+        logging.getLogger('flask.error').warning(F'Basemap store {path} does not exist, building it from the map features. Run make in util/report-map to create it.')
+        store = build_basemap(_read_features())
+
+    if store['version'] != _store_version:
+        raise RuntimeError(F'Basemap store {path} has version {store["version"]}, expected {_store_version}.')
+
+    levels = []
+    for level in store['levels']:
+        tiles = dict()
+        for name, pieces in level['layers'].items():
+            layer = defaultdict(list)
+            for x, y, wkb in pieces:
+                layer[(x, y)].append(shapely.wkb.loads(wkb))
+            tiles[name] = dict(layer)
+
+        levels.append(BasemapLevel(level['tolerance'], level['zoom'], tiles))
+
+    return sorted(levels, key=lambda l: l.tolerance)
+
+
+def select_level(levels, extent):
+    '''
+    Select the coarsest level whose simplification is below half a pixel of a
+    map of the (WebMercator) extent.
+    '''
+    half_pixel = abs(extent[2] - extent[0]) / _map_width_pixels / 2
+    candidates = [ l for l in levels if l.tolerance <= half_pixel ]
+    return candidates[-1] if len(candidates) > 0 else levels[0]
+
+
+def basemap_features(levels, extent):
+    '''
+    Get the geometries of all layers (`water`, `coast`, `rivers`) within the
+    WebMercator extent, clipped to it, at a suitable level of detail.
+    '''
+    level = select_level(levels, extent)
+    x0, y0, x1, y1 = min(extent[0], extent[2]), min(extent[1], extent[3]), max(extent[0], extent[2]), max(extent[1], extent[3])
+    size = 2 * _half_world / 2**level.zoom
+    last = 2**level.zoom - 1
+    def _index(v):
+        return min(last, max(0, math.floor((v + _half_world) / size)))
+
+    tiles = [ (x, y) for x in range(_index(x0), _index(x1) + 1) for y in range(_index(y0), _index(y1) + 1) ]
+
+    result = dict()
+    for name, layer in level.tiles.items():
+        types = _polygonal if name == 'water' else _lineal
+        geoms = []
+        for tile in tiles:
+            for geom in layer.get(tile, []):
+                minx, miny, maxx, maxy = geom.bounds
+                if minx >= x1 or maxx <= x0 or miny >= y1 or maxy <= y0:
+                    continue
+
+                if minx >= x0 and maxx <= x1 and miny >= y0 and maxy <= y1:
+                    geoms.append(geom)
+                else:
+                    geoms.extend(_parts(clip_by_rect(geom, x0, y0, x1, y1), types))
+
+        result[name] = geoms
+
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('flask.error').setLevel(logging.INFO)
+
+    source = sys.argv[1] if len(sys.argv) > 1 else features_file
+    target = sys.argv[2] if len(sys.argv) > 2 else store_file
+
+    save_basemap(build_basemap(_read_features(source)), target)
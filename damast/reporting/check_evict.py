@@ -3,19 +3,66 @@ from datetime import date
 import logging
 import traceback
 
-from .report_database import get_report_database, evict_report, ReportTuple
+from .report_database import get_report_database, evict_reports, flush_report_access
 from .eviction import get_eviction_params, does_evict
 from ..config import get_config
+from ..scheduler import leader_job
 
 def register_scheduler(sched):
     conf = get_config()
     if conf.report_eviction_deferral is not None or conf.report_eviction_maxsize is not None:
         logging.getLogger('flask.error').info('Registering report eviction job to run each day at 3AM.')
-        sched.add_job(check_for_evictable, trigger='cron', hour='3', minute='0')
+        sched.add_job(leader_job('report-eviction', check_for_evictable), trigger='cron', hour='3', minute='0')
     else:
         logging.getLogger('flask.error').info('Reports will not be evicted regularly.')
 
 
+# reports not accessed for more than :deferral days, by the local date of the last access
+_deferred = '''julianday(:today) - julianday(substr(last_access, 1, 10)) > :deferral'''
+
+
+def plan_eviction(db, deferral, maxsize, today):
+    '''
+    Select the reports to evict, from the report metadata only. Returns the
+    UUIDs of the reports to evict because they were not accessed for more
+    than `deferral` days, the UUIDs of the reports to evict (least-recently
+    accessed first) to reduce the size of the report artifacts to `maxsize`
+    bytes, and the size of the latter. Either limit can be None.
+    '''
+    params = dict(today=today.isoformat(), deferral=deferral)
+    deferred = _deferred if deferral is not None else '0'
+
+    db.execute(F'''SELECT uuid FROM reports
+        WHERE report_state <> 'evicted' AND {deferred}
+        ORDER BY last_access ASC;''', params)
+    to_evict_deferral = [ uuid for (uuid,) in db.fetchall() ]
+
+    if maxsize is None:
+        return to_evict_deferral, [], 0
+
+    # artifacts shared by several reports are counted once in the total size
+    db.execute(F'''SELECT
+            (SELECT coalesce(sum(size), 0) FROM report_artifact)
+          - (SELECT coalesce(sum(coalesce(content_size, 0) + coalesce(pdf_map_size, 0) + coalesce(pdf_report_size, 0)), 0)
+             FROM reports WHERE report_state <> 'evicted' AND {deferred});''', params)
+    (totalsize,) = db.fetchone()
+
+    # evict in ascending order of last access until the sizes of the evicted reports add up to the excess
+    db.execute(F'''SELECT uuid, size FROM (
+            SELECT uuid, size, sum(size) OVER (ORDER BY last_access ASC, uuid ASC ROWS UNBOUNDED PRECEDING) AS cumulative_size
+            FROM (
+                SELECT uuid, last_access, coalesce(content_size, 0) + coalesce(pdf_map_size, 0) + coalesce(pdf_report_size, 0) AS size
+                FROM reports
+                WHERE report_state <> 'evicted' AND NOT ({deferred})
+            )
+        )
+        WHERE cumulative_size - size < :exceed
+        ORDER BY cumulative_size ASC;''', dict(**params, exceed=totalsize - maxsize))
+    victims = db.fetchall()
+
+    return to_evict_deferral, [ uuid for uuid, _ in victims ], sum(size for _, size in victims)
+
+
 def check_for_evictable():
     '''
     Check the report database for reports that can be evicted, and do so with those.
@@ -35,66 +82,41 @@ def check_for_evictable():
     logging.getLogger('flask.error').info('Checking for evictable reports.')
 
     try:
-        # get all reports
+        # the eviction depends on the last access times
+        flush_report_access()
+
         with get_report_database() as db:
-            db.execute(F'SELECT {", ".join(ReportTuple._fields)} FROM reports WHERE report_state <> ? ORDER BY last_access ASC;', ('evicted',))
-            reports = list(map(lambda row: ReportTuple(*row), db.fetchall()))
-            to_evict_deferral = list()
-            to_evict_maxsize = list()
-            today = date.today()
-
-            if deferral is not None:
-                for r in reports:
-                    days = (today - r.last_access.date()).days
-                    if days > deferral:
-                        to_evict_deferral.append(r.uuid)
-
-                logging.getLogger('flask.error').info('%d report%s will be evicted because they have not been accessed for %d days.',
-                        len(to_evict_deferral),
-                        '' if len(to_evict_deferral) == 1 else 's',
-                        deferral)
-
-
-            if maxsize is not None:
-                maxsize = 1000000 * maxsize  # in bytes
-                # get total size
-                totalsize = 0
-                candidates = []
-                for r in filter(lambda r: r.uuid not in to_evict_deferral, reports):
-                    size = 0
-                    if r.content is not None:
-                        size += len(bytes(r.content))
-                    if r.pdf_map is not None:
-                        size += len(bytes(r.pdf_map))
-                    if r.pdf_report is not None:
-                        size += len(bytes(r.pdf_report))
-
-                    candidates.append((r, size))
-                    totalsize += size
-
-                rmsize = 0
-                if totalsize > maxsize:
-                    exceed = totalsize - maxsize
-                    for r, size in candidates:
-                        if exceed - rmsize <= 0:
-                            break
-
-                        rmsize += size
-                        to_evict_maxsize.append(r.uuid)
-
-                logging.getLogger('flask.error').info('%d report%s (%.1fMB) will be evicted to reduce database size below %dMB.',
-                        len(to_evict_maxsize),
-                        '' if len(to_evict_maxsize) == 1 else 's',
-                        rmsize / 1000000, maxsize // 1000000)
-
-
-            for uuid in [*to_evict_deferral, *to_evict_maxsize]:
-                evict_report(uuid)
-
-            db.execute('VACUUM;')
+            to_evict_deferral, to_evict_maxsize, rmsize = plan_eviction(db, deferral,
+                    None if maxsize is None else 1000000 * maxsize,  # in bytes
+                    date.today())
+
+        if deferral is not None:
+            logging.getLogger('flask.error').info('%d report%s will be evicted because they have not been accessed for %d days.',
+                    len(to_evict_deferral),
+                    '' if len(to_evict_deferral) == 1 else 's',
+                    deferral)
+
+        if maxsize is not None:
+            logging.getLogger('flask.error').info('%d report%s (%.1fMB) will be evicted to reduce database size below %dMB.',
+                    len(to_evict_maxsize),
+                    '' if len(to_evict_maxsize) == 1 else 's',
+                    rmsize / 1000000, maxsize)
 
+        evict_reports([*to_evict_deferral, *to_evict_maxsize])
+
+        with get_report_database() as db:
+            db.execute('PRAGMA auto_vacuum;')
+            (auto_vacuum,) = db.fetchone()
+            if auto_vacuum != 2:
+                # databases created before incremental auto-vacuum was used need to be vacuumed once to switch
+                logging.getLogger('flask.error').info('Switching report database to incremental auto-vacuum.')
+                db.execute('PRAGMA auto_vacuum = INCREMENTAL;')
+                db.execute('VACUUM;')
+            else:
+                # return the pages freed by the evictions to the file system, without rebuilding the database.
+                # executescript runs the pragma to completion, execute would only free one page.
+                db.executescript('PRAGMA incremental_vacuum;')
 
     except:
         tb = traceback.format_exc()
         logging.getLogger('flask.error').error('Something went wrong while checking for report evictions: %s', tb)
-
@@ -1,5 +1,6 @@
 import math
 import json
+from functools import namedtuple
 
 import psycopg2.extras
 
@@ -71,6 +72,25 @@ def create_filter_list(cursor, filters):
 
 
 
+def _group_rows(rows, key):
+    '''
+    Group the rows of a set-based query by the column `key`. The column is
+    removed from the grouped rows, so that they look the same as if they had
+    been queried separately for each value of `key`.
+    '''
+    groups = dict()
+    record = None
+    for row in rows:
+        if record is None:
+            record = namedtuple('Record', [ f for f in row._fields if f != key ])
+
+        values = row._asdict()
+        k = values.pop(key)
+        groups.setdefault(k, []).append(record(**values))
+
+    return groups
+
+
 def collect_report_data(cursor, filters, religion_filter = True):
     query = '''SELECT DISTINCT E.id, RI.religion_id, PI.place_id
 FROM evidence E
@@ -197,25 +217,33 @@ FROM evidence E
     ORDER BY E.id ASC;''', (evidence_ids,))
 
     cursor.execute(query)
-    evidences = []
-    for evidence in list(cursor.fetchall()):
-        cursor.execute('''SELECT
-            SI.id,
-            SI.source_id,
-            SI.source_page,
-            SI.source_confidence,
-            SI.comment,
-            S.short
-        FROM source_instance SI
-        JOIN source S ON S.id = SI.source_id
-        WHERE SI.evidence_id = %(eid)s;''', eid=evidence.id)
-        evidences.append(Evidence(evidence, list(cursor.fetchall())))
+    evidence_rows = list(cursor.fetchall())
+
+    # get source instances of all evidences at once, and join them in Python
+    cursor.execute('''SELECT
+        SI.evidence_id,
+        SI.id,
+        SI.source_id,
+        SI.source_page,
+        SI.source_confidence,
+        SI.comment,
+        S.short
+    FROM source_instance SI
+    JOIN source S ON S.id = SI.source_id
+    WHERE SI.evidence_id = ANY(%(evidence_ids)s)
+    ORDER BY (SI.evidence_id, SI.id) ASC;''', evidence_ids=evidence_ids)
+    source_instances_by_evidence = _group_rows(cursor.fetchall(), 'evidence_id')
+
+    evidences = [ Evidence(evidence, source_instances_by_evidence.get(evidence.id, [])) for evidence in evidence_rows ]
 
     # sort evidences first by city name, then by religion name, then by start of first time span
     evidences = sorted(evidences, key=sort_evidence)
 
 
-    source_evidence = { s.id: list(map(lambda e: e.evidence.id, filter(lambda e: any(map(lambda si: si.source_id == s.id, e.source_instances)), evidences))) for _, s in sources }
+    source_evidence = { s.id: [] for _, s in sources }
+    for e in evidences:
+        for source_id in dict.fromkeys(map(lambda si: si.source_id, e.source_instances)):
+            source_evidence[source_id].append(e.evidence.id)
 
     # place_data
     query = cursor.mogrify('''SELECT
@@ -236,32 +264,38 @@ FROM evidence E
     cursor.execute(query)
     places_ = list(cursor.fetchall())
 
+    place_ids = list(map(lambda x: x.id, places_))
+
+    # alternative names and external URIs of all places at once
+    cursor.execute('''SELECT
+        N.place_id,
+        N.name,
+        N.transcription,
+        L.name AS language
+    FROM name_var N
+    JOIN language L ON L.id = N.language_id
+    WHERE N.place_id = ANY(%(place_ids)s)
+    ORDER BY (N.place_id, L.id) ASC;''', place_ids=place_ids)
+    alternative_names_by_place = _group_rows(cursor.fetchall(), 'place_id')
+
+    cursor.execute('''SELECT
+        EPU.place_id,
+        format(UN.short_name, EPU.uri_fragment) AS short,
+        format(UN.uri_pattern, EPU.uri_fragment) AS uri,
+        EPU.comment,
+        ED.name,
+        EPU.id
+    FROM external_place_uri EPU
+    JOIN uri_namespace UN ON EPU.uri_namespace_id = UN.id
+    JOIN external_database ED ON UN.external_database_id = ED.id
+    WHERE EPU.place_id = ANY(%(place_ids)s)
+    ORDER BY (EPU.place_id, ED.name, EPU.uri_fragment);''', place_ids=place_ids)
+    external_uris_by_place = _group_rows(cursor.fetchall(), 'place_id')
+
     places = []
     for place in places_:
-        query = cursor.mogrify('''SELECT
-            N.name,
-            N.transcription,
-            L.name AS language
-        FROM name_var N
-        JOIN language L ON L.id = N.language_id
-        WHERE N.place_id = %s
-        ORDER BY L.id ASC;''', (place.id,))
-        cursor.execute(query)
-        alternative_names = sort_alternative_placenames(cursor.fetchall())
-
-        query = cursor.mogrify('''SELECT
-            format(UN.short_name, EPU.uri_fragment) AS short,
-            format(UN.uri_pattern, EPU.uri_fragment) AS uri,
-            EPU.comment,
-            ED.name,
-            EPU.id
-        FROM external_place_uri EPU
-        JOIN uri_namespace UN ON EPU.uri_namespace_id = UN.id
-        JOIN external_database ED ON UN.external_database_id = ED.id
-        WHERE EPU.place_id = %s
-        ORDER BY (ED.name, EPU.uri_fragment);''', (place.id,))
-        cursor.execute(query)
-        external_uris = list(cursor.fetchall())
+        alternative_names = sort_alternative_placenames(alternative_names_by_place.get(place.id, []))
+        external_uris = external_uris_by_place.get(place.id, [])
 
         places.append(Place(place, external_uris, alternative_names))
 
@@ -341,7 +375,10 @@ FROM evidence E
     _yrs.add(yr1)
     yrs = sorted(_yrs)
 
-    time_instances=[ (i, e, list(filter(lambda x: x.evidence_id == e, _time_instances))) for i, e in enumerate(_evidences) ]
+    time_instances_by_evidence = dict()
+    for t in _time_instances:
+        time_instances_by_evidence.setdefault(t.evidence_id, []).append(t)
+    time_instances=[ (i, e, time_instances_by_evidence[e]) for i, e in enumerate(_evidences) ]
 
     time_data = dict(year_start=yr0, year_end=yr1, ticks=yrs, num_evidences=num_evidences, time_instances=time_instances)
 
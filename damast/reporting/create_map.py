@@ -1,37 +1,38 @@
-import geopandas as gpd
-import geoplot as gplt
 import geoplot.crs as gcrs
 import matplotlib.pyplot as plt
 from matplotlib.transforms import Affine2D
 from matplotlib.lines import Line2D
-from shapely.geometry import Point, Polygon, LineString, box
+from matplotlib.collections import LineCollection
+import numpy as np
+from pyproj import Transformer
 from shapely.errors import ShapelyDeprecationWarning
 from io import StringIO, BytesIO
 import flask
 import os.path
-import gzip
 import warnings
 import logging
 import math
 import os
-from functools import namedtuple
+from functools import namedtuple, lru_cache
 from itertools import cycle
+from collections import defaultdict
 from colorsys import hls_to_rgb
 import re
 
 from ..postgres_rest_api.util import parse_geoloc
+from .basemap import load_basemap, basemap_features
 
 warnings.simplefilter('ignore', category=ShapelyDeprecationWarning)
 
 _min_dx_mercator = 1113194.908  # 10° at equator
 crs = 'EPSG:4326'
 
-with gzip.open(os.path.join(os.getcwd(), 'damast', 'reporting/map-data', 'features.geo.json.gz')) as f:
-    features = gpd.GeoSeries.from_file(f, crs=crs, driver='GeoJSON')
-    waterbodies_full = features[features.apply(lambda x: x.type in ('Polygon', 'MultiPolygon'))]
-    rivers_full = features[features.apply(lambda x: x.type in ('Line', 'LineString', 'MultiLineString'))]
+_to_mercator = Transformer.from_crs('EPSG:4326', 'EPSG:3857', always_xy=True)
+_from_mercator = Transformer.from_crs('EPSG:3857', 'EPSG:4326', always_xy=True)
 
-    logging.getLogger('flask.error').info(F'Loaded map data from {f.name}.')
+_projection = gcrs.WebMercator().load(None, dict())
+
+basemap = load_basemap()
 
 
 def _parse(p):
@@ -41,10 +42,8 @@ def _parse(p):
 
 def optimal_extent(extent):
     # go into image space
-    gdf = gpd.GeoSeries([Point(*extent[:2]), Point(*extent[2:])])
-    gdf.set_crs(epsg=4326, inplace=True)
-    gdf = gdf.to_crs(epsg=3857)  # to WebMercator
-    extent = [ gdf[0].x, gdf[0].y, gdf[1].x, gdf[1].y ]
+    xs, ys = _to_mercator.transform([extent[0], extent[2]], [extent[1], extent[3]])  # to WebMercator
+    extent = [ xs[0], ys[0], xs[1], ys[1] ]
 
     # grow by at least a 5% boundary
     dx = extent[2] - extent[0]
@@ -87,10 +86,8 @@ def optimal_extent(extent):
             y + dy/2 * factor,
             ]
 
-    gdf = gpd.GeoSeries([Point(*extent[:2]), Point(*extent[2:])])
-    gdf.set_crs(epsg=3857, inplace=True)
-    gdf = gdf.to_crs(epsg=4326)
-    return [ gdf[0].x, gdf[0].y, gdf[1].x, gdf[1].y ]
+    lngs, lats = _from_mercator.transform([extent[0], extent[2]], [extent[1], extent[3]])
+    return [ lngs[0], lats[0], lngs[1], lats[1] ]
 
 
 PlaceSymbol = namedtuple('PlaceSymbol', ['geoloc', 'religions'])
@@ -154,21 +151,38 @@ _symbols = [
     ('p', 1),
         ]
 
-def _place_symbols(places, evidences, religions, graticulecolor):
+@lru_cache(maxsize=None)
+def _color(color):
+    m = _hsl.fullmatch(color)
+    if m:
+        h = float(m['h']) / 360
+        s = float(m['s']) / 100
+        l = float(m['l']) / 100
+
+        rgb = hls_to_rgb(h, l, s)
+
+        color = '#' + ''.join(map(lambda v: '%02x'%int(255*v), rgb))
+
+    return color
+
+
+def _place_symbols(places, evidences, religions):
     relmap = { r['id']: r for r in religions }
     relidx = { r['id']: i for i, r in enumerate(religions) }
     rids = set()
-    relcolors = dict()
     relsyms = { r['id']: sym for r, sym in zip(religions, cycle(_symbols)) }
 
+    place_relids = defaultdict(set)
+    for e in evidences:
+        place_relids[e.evidence.place_id].add(e.evidence.religion_id)
+
     places_out = []
     for place in places:
         geoloc = _parse(place)
         if geoloc is None:
             continue
 
-        ev = filter(lambda e: e.evidence.place_id == place.place.id, evidences)
-        relids = sorted(set(map(lambda e: e.evidence.religion_id, ev)), key=lambda rid: relidx[rid])
+        relids = sorted(place_relids[place.place.id], key=lambda rid: relidx[rid])
 
         place_religions = []
 
@@ -179,56 +193,119 @@ def _place_symbols(places, evidences, religions, graticulecolor):
             dx = ( a + _sqrt8 / 2 * b ) * 2 * _symbol_radius
             dy = ( _sqrt8 * b ) * 2 * _symbol_radius
 
-            color = relmap[rid]['color']
-            m = _hsl.fullmatch(color)
-            if m:
-                h = float(m['h']) / 360
-                s = float(m['s']) / 100
-                l = float(m['l']) / 100
+            place_religions.append(Religion((dx, dy), _color(relmap[rid]['color']), relsyms[rid]))
 
-                rgb = hls_to_rgb(h, l, s)
-
-                color = '#' + ''.join(map(lambda v: '%02x'%int(255*v), rgb))
+        places_out.append(PlaceSymbol(geoloc, place_religions))
 
-            if rid not in relcolors:
-                relcolors[rid] = color
+    places_out.sort(key=lambda x: len(x.religions), reverse=True)
 
-            place_religions.append(Religion((dx, dy), color, relsyms[rid]))
+    legend = [ (relmap[rid]['name'], _color(relmap[rid]['color']), relsyms[rid])
+        for rid in sorted(rids, key=lambda rid: relidx[rid])
+        ]
 
-        places_out.append(PlaceSymbol(geoloc, place_religions))
+    return places_out, legend
 
-    places_out.sort(key=lambda x: len(x.religions), reverse=True)
 
-    legend_elements = [ Line2D([0], [0], color='none',
-        label=relmap[rid]['name'],
-        markerfacecolor=relcolors[rid],
+def _legend_elements(legend, graticulecolor):
+    return [ Line2D([0], [0], color='none',
+        label=name,
+        markerfacecolor=color,
         markeredgewidth=0.5,
         markeredgecolor=graticulecolor,
-        markersize=2 * _symbol_radius * relsyms[rid][1],
-        marker=relsyms[rid][0])
-        for rid in sorted(rids, key=lambda rid: relidx[rid])
+        markersize=2 * _symbol_radius * scale,
+        marker=marker)
+        for name, color, (marker, scale) in legend
         ]
 
-    return places_out, legend_elements
 
+def _marker_groups(markers):
+    '''
+    Group the religion symbols of all places by their offset, marker, and
+    color, so that each group can be drawn with a single scatter call. Places
+    are projected to WebMercator all at once. Places with more religions are
+    drawn below places with fewer religions.
+    '''
+    if len(markers) == 0:
+        return []
+
+    xs, ys = _to_mercator.transform(
+            np.fromiter((m.geoloc['lng'] for m in markers), dtype=float, count=len(markers)),
+            np.fromiter((m.geoloc['lat'] for m in markers), dtype=float, count=len(markers)))
+
+    groups = dict()
+    layer = -1
+    num_religions = None
+    for i, place in enumerate(markers):
+        if len(place.religions) != num_religions:
+            num_religions = len(place.religions)
+            layer += 1
+
+        for rel in place.religions:
+            groups.setdefault((layer, rel.offset, rel.marker, rel.color), []).append(i)
+
+    return [ (layer, offset, marker, color, xs[idx], ys[idx])
+            for (layer, offset, marker, color), idx in groups.items() ]
+
+
+def _graticules(extent):
+    '''
+    Get the graticule lines in WebMercator coordinates, and the labels with
+    their positions.
+    '''
+    lat_extent = abs(extent[1] - extent[3])
+    lng_extent = abs(extent[0] - extent[2])
+
+    lat_ticks = _numticks(lat_extent)
+    lng_ticks = _numticks(lng_extent)
+    minlat_round = math.ceil(min(extent[1], extent[3]) / lat_ticks) * lat_ticks
+    maxlat_round = math.floor(max(extent[1], extent[3]) / lat_ticks) * lat_ticks
+    minlng_round = math.ceil(min(extent[0], extent[2]) / lng_ticks) * lng_ticks
+    maxlng_round = math.floor(max(extent[0], extent[2]) / lng_ticks) * lng_ticks
+
+    lats = np.arange(minlat_round, maxlat_round+1, lat_ticks, dtype=float)
+    lngs = np.arange(minlng_round, maxlng_round+1, lng_ticks, dtype=float)
+
+    # parallels run from the left to the right edge of the map, meridians
+    # from the bottom to the top edge; both are straight in WebMercator
+    lat_x, lat_y = _to_mercator.transform(
+            np.concatenate((np.full_like(lats, extent[0]), np.full_like(lats, extent[2]))),
+            np.concatenate((lats, lats)))
+    lng_x, lng_y = _to_mercator.transform(
+            np.concatenate((lngs, lngs)),
+            np.concatenate((np.full_like(lngs, extent[1]), np.full_like(lngs, extent[3]))))
+
+    n = len(lats)
+    m = len(lngs)
+    segments = [ ((lat_x[i], lat_y[i]), (lat_x[n+i], lat_y[n+i])) for i in range(n) ] \
+            + [ ((lng_x[i], lng_y[i]), (lng_x[m+i], lng_y[m+i])) for i in range(m) ]
+
+    labels = [ (lat_x[n+i] - 3, lat_y[n+i] + 3, F'{"N" if lat >= 0 else "S"} {abs(lat):g}°', 'horizontal')
+            for i, lat in enumerate(lats) ] \
+            + [ (lng_x[i] - 3, lng_y[i] + 3, F'{"E" if lng >= 0 else "W"} {abs(lng):g}°', 'vertical')
+            for i, lng in enumerate(lngs) ]
+
+    return segments, labels
 
-def create_map(places, evidences, religions, all_religions):
-    global waterbodies_full, rivers_full
 
+def create_map(places, evidences, religions, all_religions):
     geolocs = list(filter(lambda x: x is not None, map(_parse, places)))
 
-    points = gpd.GeoSeries([Point(g['lng'], g['lat']) for g in geolocs])
     if len(geolocs) == 1:
         extent = [ geolocs[0]['lng'] - 10, geolocs[0]['lat'] - 7.5, geolocs[0]['lng'] + 10, geolocs[0]['lat'] + 7.5 ]
     else:
-        extent = points.total_bounds
+        lngs = [ g['lng'] for g in geolocs ]
+        lats = [ g['lat'] for g in geolocs ]
+        extent = [ min(lngs), min(lats), max(lngs), max(lats) ]
 
     extent = optimal_extent(extent)
+    xs, ys = _to_mercator.transform([extent[0], extent[2]], [extent[1], extent[3]])
+    extent_mercator = [ xs[0], ys[0], xs[1], ys[1] ]
 
-    bbox = box(*extent)
-
-    waterbodies = gpd.clip(waterbodies_full, bbox, keep_geom_type=True)
-    rivers = gpd.clip(rivers_full, bbox, keep_geom_type=True)
+    # the basemap, symbol layout, projection, and graticules are the same for both formats
+    features = basemap_features(basemap, extent_mercator)
+    markers, legend_entries = _place_symbols(places, evidences, all_religions)
+    marker_groups = _marker_groups(markers)
+    graticule_segments, graticule_labels = _graticules(extent)
 
     svg = StringIO()
     pdf = BytesIO()
@@ -238,103 +315,52 @@ def create_map(places, evidences, religions, all_religions):
             ]
 
     for outfile, fmt, water_edgecolor, water_facecolor, rivercolor, pointcolor, graticulecolor in plotformats:
-        markers, legend_elements = _place_symbols(places, evidences, all_religions, graticulecolor)
+        legend_elements = _legend_elements(legend_entries, graticulecolor)
+
+        fig = plt.figure(figsize=(8, 6))
+        ax = plt.subplot(111, projection=_projection)
+        ax.set_extent((extent_mercator[0], extent_mercator[2], extent_mercator[1], extent_mercator[3]), crs=_projection)
+        ax.spines['geo'].set_visible(False)
 
-        plt.clf()
-        ax = gplt.polyplot(
-                waterbodies,
-                projection=gcrs.WebMercator(),
-                extent=extent,
+        # the basemap is already projected. The water is split into tiles, so
+        # its outline is drawn from the coast lines; the tile edges are hidden
+        # by stroking the water pieces in their fill color.
+        ax.add_geometries(features['water'], crs=_projection,
                 linewidth=0.5,
-                edgecolor=water_edgecolor,
+                edgecolor=water_facecolor,
                 facecolor=water_facecolor,
                 zorder=-5)
-
-        gplt.polyplot(
-                rivers,
-                ax=ax,
-                projection=gcrs.WebMercator(),
-                extent=extent,
+        ax.add_geometries(features['coast'], crs=_projection,
+                linewidth=0.5,
+                edgecolor=water_edgecolor,
+                facecolor='none',
+                zorder=-5)
+        ax.add_geometries(features['rivers'], crs=_projection,
                 linewidth=0.5,
                 edgecolor=rivercolor,
                 facecolor='none',
                 zorder=-4)
 
-        for i, place in enumerate(markers):
-            pt = gpd.GeoSeries([Point(place.geoloc['lng'], place.geoloc['lat'])])
-            pt.set_crs(epsg=4326, inplace=True)
-            pt2 = pt.to_crs(epsg=3857)  # to WebMercator
-            px, py = pt2[0].x, pt2[0].y
-
-            for rel in place.religions:
-                marker, scale = rel.marker
-
-                ax.scatter([px], [py],
-                        color=rel.color,
-                        linewidths=0.5,
-                        edgecolor=graticulecolor,
-                        transform=ax.transData + Affine2D.from_values(1, 0, 0, 1, *rel.offset),
-                        s=(2*_symbol_radius*scale)**2,
-                        marker=marker,
-                        zorder=10+i)
-
-
-        _textstyle = dict(color=graticulecolor, fontsize='xx-small', va='bottom')
-        lat_extent = abs(extent[1] - extent[3])
-        lng_extent = abs(extent[0] - extent[2])
-
-        lat_ticks = _numticks(lat_extent)
-        lng_ticks = _numticks(lng_extent)
-        minlat_round = math.ceil(min(extent[1], extent[3]) / lat_ticks) * lat_ticks
-        maxlat_round = math.floor(max(extent[1], extent[3]) / lat_ticks) * lat_ticks
-        minlng_round = math.ceil(min(extent[0], extent[2]) / lng_ticks) * lng_ticks
-        maxlng_round = math.floor(max(extent[0], extent[2]) / lng_ticks) * lng_ticks
-
-        for lat in range(minlat_round, maxlat_round+1, lat_ticks):
-            line = gpd.GeoSeries([LineString([
-                Point(extent[0], lat),
-                Point(extent[2], lat),
-                ])])
-            gplt.polyplot(line,
-                    ax=ax,
-                    projection=gcrs.WebMercator(),
-                    extent=extent,
-                    linewidth=0.5,
-                    edgecolor=graticulecolor,
-                    facecolor='none',
-                    zorder=-3)
-
-            ns = 'N' if lat >= 0 else 'S'
-            lbl = F'{ns} {abs(lat):g}°'
-
-            # go into image space
-            gdf = gpd.GeoSeries([Point(extent[2], lat)])
-            gdf.set_crs(epsg=4326, inplace=True)
-            gdf = gdf.to_crs(epsg=3857)  # to WebMercator
-            ax.text(gdf[0].x - 3, gdf[0].y + 3, lbl, ha='right', in_layout=False, **_textstyle)
-
-        for lng in range(minlng_round, maxlng_round+1, lng_ticks):
-            line = gpd.GeoSeries([LineString([
-                Point(lng, extent[1]),
-                Point(lng, extent[3]),
-                ])])
-            gplt.polyplot(line,
-                    ax=ax,
-                    projection=gcrs.WebMercator(),
-                    extent=extent,
-                    linewidth=0.5,
+        for layer, offset, (marker, scale), color, xs, ys in marker_groups:
+            ax.scatter(xs, ys,
+                    color=color,
+                    linewidths=0.5,
                     edgecolor=graticulecolor,
-                    facecolor='none',
-                    zorder=-3)
+                    transform=ax.transData + Affine2D.from_values(1, 0, 0, 1, *offset),
+                    s=(2*_symbol_radius*scale)**2,
+                    marker=marker,
+                    zorder=10+layer)
+
+        ax.add_collection(LineCollection(graticule_segments,
+                    transform=ax.transData,
+                    linewidths=0.5,
+                    colors=graticulecolor,
+                    zorder=-3),
+                autolim=False)
 
-            ew = 'E' if lng >= 0 else 'W'
-            lbl = F'{ew} {abs(lng):g}°'
-
-            # go into image space
-            gdf = gpd.GeoSeries([Point(lng, extent[1])])
-            gdf.set_crs(epsg=4326, inplace=True)
-            gdf = gdf.to_crs(epsg=3857)  # to WebMercator
-            ax.text(gdf[0].x - 3, gdf[0].y + 3, lbl, ha='right', rotation='vertical', in_layout=False, **_textstyle)
+        _textstyle = dict(color=graticulecolor, fontsize='xx-small', va='bottom')
+        for x, y, lbl, rotation in graticule_labels:
+            ax.text(x, y, lbl, ha='right', rotation=rotation, in_layout=False, **_textstyle)
 
         plt.gcf().set_size_inches(1.5 * plt.gcf().get_size_inches())
 
@@ -356,11 +382,14 @@ def create_map(places, evidences, religions, all_religions):
 
         plt.savefig(outfile,
                 format=fmt,
+                # no creation date in the PDF, so that identical maps are stored only once
+                metadata=dict(CreationDate=None) if fmt == 'pdf' else None,
 
                 transparent=False,
                 bbox_inches='tight',
                 pad_inches=0,
                 )
+        plt.close(fig)
 
     return svg.getvalue(), pdf.getvalue()
 
@@ -19,10 +19,13 @@ from functools import lru_cache, namedtuple
 import subprocess
 import re
 import tempfile
+import time
+from contextlib import contextmanager
 
 from .create_map import create_map
-from .report_database import ReportTuple, get_report_database, start_report
+from .report_database import get_report_database, set_report_artifacts, start_report
 from .datatypes import Evidence, Place
+from .tex_format import get_preamble_format, disable_preamble_format
 from .verbalize_filters import verbalize, get_filter_description
 from .verbalize_filters_tex import get_filter_description as get_filter_description_tex
 from .filters import blueprint as filter_blueprint
@@ -41,7 +44,7 @@ from .tex import render_tex_report
 from .html import render_html_report
 from .place_sort import sort_placenames, sort_alternative_placenames, sort_evidence
 from .eviction import does_evict
-from .collect_report_data import collect_report_data, create_filter_list
+from .report_data_cache import get_report_data
 
 from ..config import get_config
 
@@ -82,14 +85,25 @@ def get_database_version_info(report_uuid):
 
 
 
+@contextmanager
+def _stage(durations, name):
+    '''
+    Measure the wall time of a stage of the report generation.
+    '''
+    t0 = time.perf_counter()
+    yield
+    durations[name] = time.perf_counter() - t0
+
+
 def create_report(pg, filter_json, current_user, started, report_uuid, report_url, map_url, directory):
+    durations = dict()
     try:
         with pg.get_cursor(readonly=True) as cursor:
             filters = filter_json['filters']
-            q_filters = create_filter_list(cursor, filters)
 
             evidence_ids = []
-            evidence_data = collect_report_data(cursor, q_filters, filters['religion'])
+            with _stage(durations, 'data'):
+                evidence_data = get_report_data(cursor, filters)
 
 
             all_religions = evidence_data['all_religions']
@@ -99,7 +113,8 @@ def create_report(pg, filter_json, current_user, started, report_uuid, report_ur
             evidence_ids = evidence_data['evidence_ids']
 
 
-            place_map, map_pdf = create_map(places, evidences, religions, all_religions)
+            with _stage(durations, 'map'):
+                place_map, map_pdf = create_map(places, evidences, religions, all_religions)
 
             # metadata
             _fmt = '%A, %B %-d, %Y, at %H:%M %Z'
@@ -142,13 +157,17 @@ def create_report(pg, filter_json, current_user, started, report_uuid, report_ur
                     dbversiondata=dbversiondata,
                     )
 
-            content = render_html_report(context)
+            with _stage(durations, 'html'):
+                content = render_html_report(context)
             context.update(dict(filter_desc=filter_desc_tex))
-            tex_content = render_tex_report(context)
-            pdf_report = generate_pdf(tex_content, map_pdf, directory)
+            with _stage(durations, 'tex'):
+                tex_content = render_tex_report(context)
+            with _stage(durations, 'pdf'):
+                pdf_report = generate_pdf(tex_content, map_pdf, directory, durations)
 
-            pdfmap = gzip.compress(map_pdf)
-            reportpdf = gzip.compress(pdf_report)
+            # without timestamp, so that identical artifacts are stored only once
+            pdfmap = gzip.compress(map_pdf, mtime=0)
+            reportpdf = gzip.compress(pdf_report, mtime=0)
 
             report_state = 'completed'
 
@@ -161,20 +180,15 @@ def create_report(pg, filter_json, current_user, started, report_uuid, report_ur
 
     finally:
         now = datetime.now().replace(microsecond=0).astimezone().isoformat()
-        content = gzip.compress(content.encode('utf-8'))
+        content = gzip.compress(content.encode('utf-8'), mtime=0)
 
         with get_report_database() as db:
+            set_report_artifacts(db, report_uuid, content=content, pdf_map=pdfmap, pdf_report=reportpdf)
             db.execute('''UPDATE reports
-                    SET content = :content,
-                        pdf_map = :pdf_map,
-                        pdf_report = :pdf_report,
-                        completed = :completed,
+                    SET completed = :completed,
                         evidence_count = :evidence_count,
                         report_state = :report_state
                     WHERE uuid = :uuid AND user = :user;''', dict(
-                        content = content,
-                        pdf_map = pdfmap,
-                        pdf_report = reportpdf,
                         completed = now,
                         evidence_count = len(evidence_ids),
                         uuid = report_uuid,
@@ -182,24 +196,93 @@ def create_report(pg, filter_json, current_user, started, report_uuid, report_ur
                         report_state = report_state,
                         ))
 
+            db.executemany('''INSERT OR REPLACE INTO report_stage_duration (uuid, stage, finished, duration)
+                    VALUES (:uuid, :stage, :finished, :duration);''',
+                    [ dict(uuid=report_uuid, stage=stage, finished=now, duration=duration) for stage, duration in durations.items() ])
+
+
+# log messages of LaTeX and packages that ask for another pass
+_latex_rerun = re.compile(r'Rerun to get|Rerun LaTeX|Label\(s\) may have changed')
+_latex_max_passes = 3
 
-def generate_pdf(tex_content, map_pdf, directory):
-    with open(os.path.join(directory, 'report.tex'), 'w') as f:
-        f.write(tex_content)
-    with open(os.path.join(directory, 'map.pdf'), 'wb') as f:
-        f.write(map_pdf)
 
-    for i in (1,2):
-        proc = subprocess.run(['xelatex', '-interaction=nonstopmode', 'report.tex'],
+def _latex_aux_state(directory):
+    state = dict()
+    for ext in ('aux', 'toc', 'out'):
+        path = os.path.join(directory, F'report.{ext}')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                state[ext] = f.read()
+    return state
+
+
+def _run_latex(directory, fmt, durations):
+    '''
+    Compile report.tex in `directory` until the auxiliary files do not change
+    anymore and LaTeX does not ask for another pass, but at most
+    `_latex_max_passes` times. Returns False if a pass failed.
+    '''
+    command = ['xelatex', '-interaction=nonstopmode']
+    if fmt is not None:
+        os.symlink(fmt, os.path.join(directory, os.path.basename(fmt)))
+        command.append(F'-fmt={os.path.splitext(os.path.basename(fmt))[0]}')
+    command.append('report.tex')
+
+    for i in range(1, _latex_max_passes + 1):
+        before = _latex_aux_state(directory)
+
+        t0 = time.perf_counter()
+        proc = subprocess.run(command,
                     cwd=directory,
                     stdout=subprocess.PIPE,
                     stderr=subprocess.DEVNULL,
-                    encoding='utf-8')
+                    encoding='utf-8',
+                    errors='replace')
+        duration = time.perf_counter() - t0
+        if durations is not None:
+            durations[F'pdf_pass_{i}'] = duration
 
         if proc.returncode != 0:
-            logging.getLogger('flask.error').error('Error compiling LaTeX:\n%s', proc.stdout)
+            if fmt is not None:
+                logging.getLogger('flask.error').warning('Error compiling LaTeX with preamble format after %.1fs:\n%s', duration, proc.stdout)
+            else:
+                logging.getLogger('flask.error').error('Error compiling LaTeX:\n%s', proc.stdout)
+            return False
+
+        logging.getLogger('flask.error').info('LaTeX pass %d took %.1fs%s.', i, duration, '' if fmt is None else ' (with preamble format)')
+
+        with open(os.path.join(directory, 'report.log'), encoding='utf-8', errors='replace') as f:
+            rerun = _latex_rerun.search(f.read()) is not None
+
+        if not rerun and _latex_aux_state(directory) == before:
+            return True
+
+    logging.getLogger('flask.error').warning('LaTeX references still not stable after %d passes.', _latex_max_passes)
+    return True
+
+
+def generate_pdf(tex_content, map_pdf, directory, durations=None):
+    with open(os.path.join(directory, 'report.tex'), 'w') as f:
+        f.write(tex_content)
+    with open(os.path.join(directory, 'map.pdf'), 'wb') as f:
+        f.write(map_pdf)
+
+    fmt = get_preamble_format()
+    if not _run_latex(directory, fmt, durations):
+        if fmt is None:
             raise ChildProcessError('Error compiling LaTeX document.')
 
+        # retry without the format, starting over; only if the document
+        # compiles without it, the format is at fault
+        for name in os.listdir(directory):
+            if name not in ('report.tex', 'map.pdf'):
+                os.remove(os.path.join(directory, name))
+
+        if not _run_latex(directory, None, durations):
+            raise ChildProcessError('Error compiling LaTeX document.')
+
+        disable_preamble_format(fmt)
+
     with open(os.path.join(directory, 'report.pdf'), 'rb') as f:
         report = f.read()
         return report
@@ -210,6 +293,37 @@ def fail(msg):
     sys.exit(1)
 
 
+def generate_report(report_uuid, report_url, map_url):
+    '''
+    Generate the report with UUID `report_uuid`, which must already exist in
+    the report database in the `started` state. On errors, the report is
+    marked as failed and the exception is re-raised.
+    '''
+    directory = tempfile.mkdtemp()
+
+    try:
+        with get_report_database() as db:
+            db.execute('SELECT user, filter, started FROM reports WHERE uuid = :u;', dict(u=report_uuid))
+            username, filter_gzip, started = db.fetchone()
+            filters = json.loads(gzip.decompress(filter_gzip))
+
+        pg = postgres_database('damast-report')
+        create_report(pg, filters, username, started, report_uuid, report_url, map_url, directory)
+
+    except Exception as err:
+        now = datetime.now().replace(microsecond=0).astimezone().isoformat()
+        content = Template('<p class="error-message"><i class="fa fa-fw fa-exclamation-triangle fa-lg"></i> {{ msg }}</p>').render(msg=str(err))
+        content = gzip.compress(content.encode('utf-8'), mtime=0)
+        with get_report_database() as db:
+            set_report_artifacts(db, report_uuid, content=content)
+            db.execute('UPDATE reports SET completed = :now, report_state = :state WHERE uuid = :uuid;', dict(now=now, state='failed', uuid=report_uuid))
+
+        raise
+
+    finally:
+        shutil.rmtree(directory)
+
+
 if __name__ == '__main__':
     error_logger = logging.getLogger('flask.error')
     _err_handler = TimedRotatingFileHandler(
@@ -225,30 +339,12 @@ if __name__ == '__main__':
     if len(sys.argv) != 4:
         fail('Not the appropriate number of arguments: ' + ' '.join(sys.argv))
 
-    directory = tempfile.mkdtemp()
-
     report_uuid = sys.argv[1]
     report_url = sys.argv[2]
     map_url = sys.argv[3]
 
     try:
-        with get_report_database() as db:
-            db.execute('SELECT user, filter, started FROM reports WHERE uuid = :u;', dict(u=report_uuid))
-            username, filter_gzip, started = db.fetchone()
-            filters = json.loads(gzip.decompress(filter_gzip))
-
-            pg = postgres_database()
-            create_report(pg, filters, username, started, report_uuid, report_url, map_url, directory)
+        generate_report(report_uuid, report_url, map_url)
 
     except Exception as err:
-        now = datetime.now().replace(microsecond=0).astimezone().isoformat()
-        content = Template('<p class="error-message"><i class="fa fa-fw fa-exclamation-triangle fa-lg"></i> {{ msg }}</p>').render(msg=str(err))
-        content = gzip.compress(content.encode('utf-8'))
-        with get_report_database() as db:
-            db.execute('UPDATE reports SET content = :content, completed = :now, report_state = :state WHERE uuid = :uuid;', dict(content=content, now=now, state='failed', uuid=report_uuid))
-
         fail(F'Error occurred during report generation: {err}')
-
-    finally:
-        shutil.rmtree(directory)
-
@@ -93,10 +93,13 @@ def render_geoloc(context, value):
 
 @jinja2.pass_context
 def bytesize(context, value):
+    '''
+    Format a size in bytes, given either as a number or as the data itself.
+    '''
     if value is None:
         return '0&thinsp;B'
 
-    l = len(value)
+    l = value if isinstance(value, int) else len(value)
     prefixes = ['', 'k', 'M', 'G', 'T']
     log = 0
     while l >= 1000:
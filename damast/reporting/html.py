@@ -21,7 +21,7 @@ import subprocess
 import re
 
 from .create_map import create_map
-from .report_database import ReportTuple, get_report_database, start_report
+from .report_database import get_report_database, start_report
 from .datatypes import Evidence, Place
 from .verbalize_filters import verbalize, get_filter_description
 from .filters import blueprint as filter_blueprint
@@ -36,7 +36,8 @@ from jinja2 import Template, Environment, FileSystemLoader, pass_context
 from .filters import render_int4range, render_geoloc, sort_int4range
 
 
-def render_html_report(context):
+@lru_cache(maxsize=None)
+def html_environment():
     environment = Environment(
             loader=FileSystemLoader(os.path.join(pathlib.Path(__file__).parent.absolute(), 'templates')),
             )
@@ -45,6 +46,10 @@ def render_html_report(context):
     environment.filters['render_geoloc'] = render_geoloc
     environment.filters['sort_int4range'] = sort_int4range
 
-    template = environment.get_template('reporting/report_content.html')
+    return environment
+
+
+def render_html_report(context):
+    template = html_environment().get_template('reporting/report_content.html')
     content = template.render(**context)
     return content
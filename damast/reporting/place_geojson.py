@@ -13,8 +13,7 @@ import os.path
 
 from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparator
 from .init_post import init_post
-from .collect_report_data import collect_report_data, create_filter_list
-from ..postgres_database import postgres_database
+from .report_data_cache import get_report_data
 from ..postgres_rest_api.place import parse_geoloc
 from ..config import get_config
 
@@ -28,11 +27,9 @@ def get_geojson():
 
     details = 'details' in flask.request.args
 
-    pg = postgres_database()
     try:
-        with pg.get_cursor(readonly=True) as cursor:
-            q_filters = create_filter_list(cursor, filter_json['filters'])
-            evidence_data = collect_report_data(cursor, q_filters, filter_json['filters']['religion'])
+        with flask.current_app.pg.get_cursor(readonly=True) as cursor:
+            evidence_data = get_report_data(cursor, filter_json['filters'])
 
             geojson_places = []
             geojson_place_properties = dict()
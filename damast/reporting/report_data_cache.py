@@ -0,0 +1,156 @@
+import sys
+import json
+import gzip
+import pickle
+import hashlib
+import logging
+from io import BytesIO
+from datetime import datetime
+from functools import lru_cache, namedtuple
+
+from .report_database import get_report_database
+from .collect_report_data import collect_report_data, create_filter_list
+from ..postgres_database import get_data_version
+from ..config import get_config
+
+
+def _normalize_filters(filters):
+    '''
+    Bring the filters into a canonical form. The order of entries in lists
+    that are semantically sets (religions, sources, places, tags, confidence
+    values) does not matter for the result, so they are sorted.
+    '''
+    def _sorted(lst):
+        return sorted(set(lst), key=lambda x: (x is None, x))
+
+    f = dict(filters)
+
+    if f['religion'] is not True:
+        religion = dict(f['religion'])
+        if religion['type'] == 'complex':
+            religion['filter'] = sorted(set(tuple(_sorted(v)) for v in religion['filter']))
+        else:
+            religion['filter'] = _sorted(religion['filter'])
+        f['religion'] = religion
+
+    f['confidence'] = { k: _sorted(v) for k, v in f['confidence'].items() }
+
+    if type(f['tags']) is list:
+        f['tags'] = _sorted(f['tags'])
+
+    for key in ('sources', 'places'):
+        if f[key] is not None:
+            f[key] = _sorted(f[key])
+
+    return f
+
+
+def filter_hash(filters):
+    '''
+    Get a hash of the filters, which is identical for semantically identical
+    filters.
+    '''
+    normalized = json.dumps(_normalize_filters(filters), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _record_type(fields):
+    return namedtuple('Record', fields)
+
+
+def _rebuild_record(fields, values):
+    return _record_type(fields)(*values)
+
+
+class _Pickler(pickle.Pickler):
+    '''
+    Pickler that can also serialize the named tuples created dynamically by
+    the database cursor, which cannot be looked up by their name.
+    '''
+    def reducer_override(self, obj):
+        cls = type(obj)
+        if isinstance(obj, tuple) and hasattr(cls, '_fields'):
+            if getattr(sys.modules.get(cls.__module__), cls.__qualname__, None) is not cls:
+                return _rebuild_record, (cls._fields, tuple(obj))
+
+        return NotImplemented
+
+
+def _serialize(data):
+    buf = BytesIO()
+    _Pickler(buf, protocol=pickle.HIGHEST_PROTOCOL).dump(data)
+    return gzip.compress(buf.getvalue())
+
+
+def _deserialize(blob):
+    return pickle.loads(gzip.decompress(blob))
+
+
+def _lookup(key, version):
+    now = datetime.now().replace(microsecond=0).astimezone().isoformat()
+    with get_report_database() as db:
+        db.execute('SELECT data FROM report_data_cache WHERE filter_hash = :key AND data_version = :version;', dict(key=key, version=version))
+        row = db.fetchone()
+        if row is None:
+            return None
+
+        db.execute('''UPDATE report_data_cache
+            SET last_access = :now, access_count = access_count + 1
+            WHERE filter_hash = :key AND data_version = :version;''', dict(key=key, version=version, now=now))
+
+        return _deserialize(row[0])
+
+
+def _store(key, version, data, maxsize):
+    now = datetime.now().replace(microsecond=0).astimezone().isoformat()
+    blob = _serialize(data)
+
+    with get_report_database() as db:
+
+        # entries for older versions of the data can never be hit again
+        db.execute('DELETE FROM report_data_cache WHERE data_version <> :version;', dict(version=version))
+
+        db.execute('''INSERT OR REPLACE INTO report_data_cache (filter_hash, data_version, created, last_access, access_count, size, data)
+            VALUES (:key, :version, :now, :now, 0, :size, :data);''',
+            dict(key=key, version=version, now=now, size=len(blob), data=blob))
+
+        # evict least-recently used entries above the size limit
+        db.execute('''DELETE FROM report_data_cache
+            WHERE rowid IN (
+                SELECT rowid FROM (
+                    SELECT rowid, sum(size) OVER (ORDER BY last_access DESC, rowid DESC) AS cumulative_size
+                    FROM report_data_cache
+                ) WHERE cumulative_size > :maxsize
+            );''', dict(maxsize=maxsize))
+
+        if db.rowcount > 0:
+            logging.getLogger('flask.error').info('Evicted %d entr%s from the report data cache.', db.rowcount, 'y' if db.rowcount == 1 else 'ies')
+
+
+def get_report_data(cursor, filters):
+    '''
+    Get the collected report data for the filters (see `collect_report_data`).
+
+    The data is cached in the report database, keyed by a hash of the
+    normalized filters and the data version counter of the PostgreSQL
+    database. If the database does not provide the counter, or the cache is
+    disabled, the data is always collected anew.
+    '''
+    maxsize = get_config().report_data_cache_maxsize * 1000000
+    version = get_data_version(cursor) if maxsize > 0 else None
+
+    if version is not None:
+        key = filter_hash(filters)
+        data = _lookup(key, version)
+        if data is not None:
+            logging.getLogger('flask.error').info('Using cached report data for filter hash %s (data version %d).', key, version)
+            return data
+
+    q_filters = create_filter_list(cursor, filters)
+    data = collect_report_data(cursor, q_filters, filters['religion'])
+
+    if version is not None:
+        _store(key, version, data, maxsize)
+
+    return data
@@ -1,20 +1,27 @@
 import sqlite3
 import os
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 from datetime import datetime, date
 from functools import namedtuple
 import uuid
 import json
 import gzip
+import heapq
+import hashlib
 import subprocess
+import fcntl
 import logging
 import flask
+import atexit
+import threading
 import traceback
+from collections import defaultdict
 
 from .eviction import does_evict
 from ..config import get_config
 
 _database_schema = '''
+PRAGMA auto_vacuum = INCREMENTAL;
 PRAGMA foreign_keys = ON;
 
 CREATE TABLE database_version (
@@ -35,6 +42,7 @@ CREATE TABLE reports (
       server_version TEXT NOT NULL,
       database_version INTEGER DEFAULT NULL,
       filter BLOB DEFAULT NULL,
+      -- no longer used, the artifacts are stored in report_artifact since schema version 1
       content BLOB DEFAULT NULL,
       pdf_map BLOB DEFAULT NULL,
       pdf_report BLOB DEFAULT NULL,
@@ -43,6 +51,47 @@ CREATE TABLE reports (
   );
 '''
 
+# tables added after the initial schema, created on existing report databases as well
+_database_schema_additions = '''
+CREATE TABLE IF NOT EXISTS report_data_cache (
+      filter_hash TEXT NOT NULL,
+      data_version INTEGER NOT NULL,
+      created DATETIME NOT NULL,
+      last_access DATETIME NOT NULL,
+      access_count INTEGER NOT NULL DEFAULT 0,
+      size INTEGER NOT NULL,
+      data BLOB NOT NULL,
+      PRIMARY KEY (filter_hash, data_version)
+  );
+
+CREATE TABLE IF NOT EXISTS report_artifact (
+      hash TEXT NOT NULL PRIMARY KEY,  -- SHA-256 of data
+      size INTEGER NOT NULL,
+      data BLOB NOT NULL
+  );
+
+CREATE TABLE IF NOT EXISTS report_queue (
+      uuid TEXT NOT NULL PRIMARY KEY,
+      enqueued DATETIME NOT NULL,
+      claimed DATETIME DEFAULT NULL,
+      worker_pid INTEGER DEFAULT NULL,
+      rerun INTEGER NOT NULL DEFAULT 0,
+      filter_hash TEXT DEFAULT NULL,
+      report_url TEXT NOT NULL,
+      map_url TEXT NOT NULL,
+      FOREIGN KEY (uuid) REFERENCES reports(uuid) ON DELETE CASCADE
+  );
+
+CREATE TABLE IF NOT EXISTS report_stage_duration (
+      uuid TEXT NOT NULL,
+      stage TEXT NOT NULL,
+      finished DATETIME NOT NULL,
+      duration REAL NOT NULL,
+      PRIMARY KEY (uuid, stage),
+      FOREIGN KEY (uuid) REFERENCES reports(uuid) ON DELETE CASCADE
+  );
+'''
+
 def _convert_datetime(val):
     if type(val) is bytes:
         return datetime.fromisoformat(val.decode('utf-8'))
@@ -50,66 +99,421 @@ def _convert_datetime(val):
 sqlite3.register_converter('DATETIME', _convert_datetime)
 
 
-@contextmanager
-def get_report_database():
-    conf = get_config()
-    filepath = conf.report_file
-    if not os.path.exists(filepath):
+# version of the report database schema (PRAGMA user_version), see _migrate_database
+_schema_version = 1
+
+_artifact_columns = ('content', 'pdf_map', 'pdf_report')
+
+
+def _sha256(data):
+    return None if data is None else hashlib.sha256(data).hexdigest()
+
+
+def _migrate_database(con):
+    '''
+    Migrate the report database to the current schema version. New databases
+    are created with the initial schema and migrated as well.
+
+    Version 1: the artifacts of the reports (the gzip-compressed HTML content,
+    PDF map, and PDF report) are moved out of the `reports` table into the
+    `report_artifact` table, where identical artifacts are stored only once.
+    The reports refer to them by their hash and store their sizes.
+    '''
+    (version,) = con.execute('PRAGMA user_version;').fetchone()
+    if version >= _schema_version:
+        return
+
+    con.create_function('sha256', 1, _sha256, deterministic=True)
+    con.execute('BEGIN IMMEDIATE;')
+    try:
+        # another process might have migrated the database in the meantime
+        (version,) = con.execute('PRAGMA user_version;').fetchone()
+
+        if version < 1:
+            logging.getLogger('flask.error').info('Moving report artifacts to separate table.')
+            for column in _artifact_columns:
+                con.execute(F'ALTER TABLE reports ADD COLUMN {column}_hash TEXT DEFAULT NULL;')
+                con.execute(F'ALTER TABLE reports ADD COLUMN {column}_size INTEGER DEFAULT NULL;')
+                con.execute(F'CREATE INDEX reports_{column}_hash ON reports ({column}_hash);')
+                con.execute(F'''INSERT OR IGNORE INTO report_artifact (hash, size, data)
+                    SELECT sha256({column}), length({column}), {column} FROM reports WHERE {column} IS NOT NULL;''')
+                con.execute(F'''UPDATE reports
+                    SET {column}_hash = sha256({column}), {column}_size = length({column}), {column} = NULL
+                    WHERE {column} IS NOT NULL;''')
+
+        con.execute(F'PRAGMA user_version = {_schema_version};')
+        con.commit()
+
+    except:
+        con.rollback()
+        raise
+
+
+_schema_additions_applied = set()
+
+# connections to the report database are reused within a process, see get_report_database
+_pool = defaultdict(list)  # file path -> idle connections
+_pool_lock = threading.Lock()
+_pool_size = 8
+_busy_timeout = 30  # seconds to wait for locks held by other connections
+
+# connections inherited from the parent process after a fork, see _reset_pool_after_fork
+_inherited_connections = []
+
+
+def _reset_pool_after_fork():
+    # SQLite connections must not be used across a fork, and closing them in
+    # the child could release locks held by the parent. They are kept open,
+    # but unused.
+    global _pool_lock
+    _inherited_connections.extend(con for connections in _pool.values() for con in connections)
+    _pool.clear()
+    _pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+
+def _connect(filepath):
+    create = not os.path.exists(filepath)
+    if create:
         if does_evict():
             raise RuntimeError('Report eviction is enabled, but the report database does not yet exist. Please create the report database manually')
 
         logging.getLogger('flask.error').info('Report database at %s does not exist. Creating.', filepath)
-        con = sqlite3.connect(filepath, detect_types=sqlite3.PARSE_DECLTYPES)
+
+    # prepared statements are cached per connection
+    con = sqlite3.connect(filepath, detect_types=sqlite3.PARSE_DECLTYPES, timeout=_busy_timeout,
+            check_same_thread=False, cached_statements=256)
+
+    if create:
         con.executescript(_database_schema)
-        cur = con.cursor()
-        yield cur
-        con.commit()
-        con.close()
 
-    else:
-        con = sqlite3.connect(filepath, detect_types=sqlite3.PARSE_DECLTYPES)
-        cur = con.cursor()
+    # readers do not block the writer and vice versa. This is stored in the
+    # database file, but must be set after the schema, which sets auto_vacuum.
+    con.execute('PRAGMA journal_mode = WAL;')
+    con.execute('PRAGMA synchronous = NORMAL;')
+
+    if filepath not in _schema_additions_applied:
+        con.executescript(_database_schema_additions)
+        _migrate_database(con)
+        _schema_additions_applied.add(filepath)
+
+    return con
+
+
+@contextmanager
+def get_report_database():
+    '''
+    Get a cursor on a connection to the report database, which is committed
+    if the block succeeds and rolled back otherwise. The connections are
+    pooled per process.
+    '''
+    filepath = get_config().report_file
+
+    with _pool_lock:
+        con = _pool[filepath].pop() if len(_pool[filepath]) > 0 else None
+    if con is None:
+        con = _connect(filepath)
+
+    cur = con.cursor()
+    try:
         yield cur
         con.commit()
-        con.close()
 
+    except:
+        con.rollback()
+        raise
+
+    finally:
+        cur.close()
+        with _pool_lock:
+            if len(_pool[filepath]) < _pool_size:
+                _pool[filepath].append(con)
+                con = None
+        if con is not None:
+            con.close()
+
+
+# the columns of a report, without the artifacts themselves (see set_report_artifacts)
+ReportMetadata = namedtuple('ReportMetadata', ['uuid', 'user', 'server_version', 'database_version', 'report_state', 'started', 'completed', 'content_size', 'pdf_map_size', 'pdf_report_size', 'filter', 'evidence_count', 'last_access', 'access_count'])
+report_metadata_columns = ', '.join(ReportMetadata._fields)
 
-ReportTuple = namedtuple('ReportTuple', ['uuid', 'user', 'server_version', 'database_version', 'report_state', 'started', 'completed', 'content', 'pdf_map', 'pdf_report', 'filter', 'evidence_count', 'last_access', 'access_count'])
 DatabaseVersion = namedtuple('DatabaseVersion', ['version', 'date', 'url', 'description'])
 
 
-def _run_report_generation(report_id, rerun=False):
-    # run subprocess
-    sub_args = [
-        'python', '-m', 'damast.reporting.create_report',
-        report_id,
-        flask.url_for('reporting.get_report', report_id=report_id, _external=True),  # absolute URL to report
-        flask.url_for('reporting.get_map', report_id=report_id),  # relative URL to map
-            ]
-    p = subprocess.Popen(sub_args)
+def _delete_unused_artifacts(db, hashes):
+    '''
+    Delete the artifacts with the given hashes that no report refers to
+    anymore. Returns the number of bytes freed.
+    '''
+    freed = 0
+    for artifact_hash in set(hashes) - {None}:
+        db.execute('''SELECT size FROM report_artifact
+            WHERE hash = :hash
+              AND NOT EXISTS (SELECT 1 FROM reports WHERE content_hash = :hash OR pdf_map_hash = :hash OR pdf_report_hash = :hash);''',
+            dict(hash=artifact_hash))
+        row = db.fetchone()
+        if row is not None:
+            db.execute('DELETE FROM report_artifact WHERE hash = :hash;', dict(hash=artifact_hash))
+            freed += row[0]
+
+    return freed
+
+
+def set_report_artifacts(db, report_id, **artifacts):
+    '''
+    Store the gzip-compressed artifacts of a report, given as keyword
+    arguments `content`, `pdf_map`, and `pdf_report`, replacing the previous
+    ones. An artifact of None removes it. Identical artifacts (e.g., the maps
+    of reports with the same filters) are stored only once. Returns the
+    number of bytes freed by removing artifacts no longer used.
+    '''
+    for column in artifacts:
+        if column not in _artifact_columns:
+            raise ValueError(F'Not a report artifact: {column}')
+
+    db.execute(F'SELECT {", ".join(F"{c}_hash" for c in artifacts)} FROM reports WHERE uuid = ?;', (report_id,))
+    previous = db.fetchone() or []
+
+    values = dict(uuid=report_id)
+    for column, data in artifacts.items():
+        artifact_hash = _sha256(data)
+        if data is not None:
+            db.execute('INSERT OR IGNORE INTO report_artifact (hash, size, data) VALUES (?, ?, ?);', (artifact_hash, len(data), data))
+
+        values[F'{column}_hash'] = artifact_hash
+        values[F'{column}_size'] = None if data is None else len(data)
+
+    db.execute(F'UPDATE reports SET {", ".join(F"{c} = :{c}" for c in values if c != "uuid")} WHERE uuid = :uuid;', values)
+
+    return _delete_unused_artifacts(db, previous)
+
+
+_artifact_chunk_size = 64 * 1024
+
+
+class ReportArtifact:
+    '''
+    An artifact of a report (the gzip-compressed HTML content, PDF map, or PDF
+    report), opened for incremental reading with `open_report_artifact`.
+    Iterating over it yields chunks of the compressed BLOB. `close` closes the
+    BLOB and the database connection.
+    '''
+    def __init__(self, report_id, column, size, blob, stack):
+        self.report_id = report_id
+        self.column = column
+        self.size = size
+        self._blob = blob
+        self._stack = stack
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self._blob.read(_artifact_chunk_size)
+                if len(chunk) == 0:
+                    break
+                yield chunk
+
+        except sqlite3.Error as err:
+            # the row was changed (e.g., evicted) while reading, the response is incomplete
+            logging.getLogger('flask.error').warning('Reading %s of report %s failed after %d bytes: %s', self.column, self.report_id, self._blob.tell(), err)
+
+        finally:
+            self.close()
+
+    def close(self):
+        self._stack.close()
+
+
+def open_report_artifact(report_id, column):
+    '''
+    Open the artifact `column` (`content`, `pdf_map`, or `pdf_report`) of a
+    report for incremental reading with SQLite's incremental BLOB I/O, without
+    loading it into memory. Returns a `ReportArtifact`, or None if the report
+    does not have the artifact.
+    '''
+    if column not in _artifact_columns:
+        raise ValueError(F'Not a report artifact: {column}')
+
+    stack = ExitStack()
+    try:
+        db = stack.enter_context(get_report_database())
+        db.execute(F'''SELECT A.rowid, A.size
+            FROM reports R
+            JOIN report_artifact A ON A.hash = R.{column}_hash
+            WHERE R.uuid = ?;''', (report_id,))
+        row = db.fetchone()
+        if row is None:
+            stack.close()
+            return None
+
+        rowid, size = row
+        blob = stack.enter_context(db.connection.blobopen('report_artifact', 'data', rowid, readonly=True))
+        return ReportArtifact(report_id, column, size, blob, stack)
 
-    if rerun:
-        logging.getLogger('flask.error').info(F'Restarting report generation of {report_id} after eviction (PID {p.pid}).')
-    else:
-        logging.getLogger('flask.error').info(F'Starting report generation of {report_id} (PID {p.pid}).')
+    except:
+        stack.close()
+        raise
+
+
+def worker_lock_path():
+    '''
+    Path of the file the report worker service holds an exclusive lock on
+    while it runs.
+    '''
+    return F'{get_config().report_file}.worker.lock'
+
+
+def report_worker_running():
+    '''
+    Check whether a report worker service holds its lock, by trying to take
+    the lock and releasing it right away.
+    '''
+    with open(worker_lock_path(), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        return False
+
+
+_report_worker = None
+
+def ensure_report_worker():
+    '''
+    Start the report worker service (see `report_worker.py`) if this process
+    has not started it yet or if it has stopped, unless another process runs
+    the service.
+    '''
+    global _report_worker
+    if _report_worker is None or _report_worker.poll() is not None:
+        if not report_worker_running():
+            _report_worker = subprocess.Popen(['python', '-m', 'damast.reporting.report_worker'])
+
+
+class ReportQueueFull(Exception):
+    '''
+    Raised if a report cannot be generated because too many reports are
+    already waiting in the queue (see `DAMAST_REPORT_QUEUE_MAXSIZE`).
+    '''
+    def __init__(self, queue_depth, retry_after):
+        super().__init__(F'The report queue is full ({queue_depth} reports waiting).')
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+
+
+QueueStatus = namedtuple('QueueStatus', ['position', 'eta'])
+
+
+def _filter_hash(filter_json):
+    from .report_data_cache import filter_hash
+    return filter_hash(filter_json['filters'])
+
+
+def _mean_generation_time(db, limit=20):
+    '''
+    Get the mean generation time (from claiming the job to finishing it) of
+    the last `limit` reports in seconds, or None if there are no durations
+    recorded yet.
+    '''
+    db.execute('''SELECT avg(duration) FROM (
+            SELECT duration FROM report_stage_duration
+            WHERE stage = 'total'
+            ORDER BY finished DESC
+            LIMIT :limit);''', dict(limit=limit))
+    (mean,) = db.fetchone()
+    return mean
+
+
+def _check_admission(db):
+    maxsize = get_config().report_queue_maxsize
+    if maxsize <= 0:
+        return
+
+    db.execute('SELECT count(*) FROM report_queue WHERE claimed IS NULL;')
+    (queue_depth,) = db.fetchone()
+    if queue_depth >= maxsize:
+        mean = _mean_generation_time(db)
+        workers = max(1, get_config().report_workers)
+        retry_after = 30 if mean is None else max(5, int(mean / workers))
+
+        raise ReportQueueFull(queue_depth, retry_after)
+
+
+def _find_pending_report(db, username, filter_hash):
+    '''
+    Find a report of the same user with identical filters that is still
+    waiting for or in generation.
+    '''
+    db.execute('''SELECT R.uuid
+        FROM report_queue Q
+        JOIN reports R ON Q.uuid = R.uuid
+        WHERE Q.filter_hash = :filter_hash
+          AND R.user = :user
+          AND R.report_state = 'started'
+        ORDER BY Q.enqueued ASC
+        LIMIT 1;''', dict(filter_hash=filter_hash, user=username))
+    row = db.fetchone()
+    return None if row is None else row[0]
+
+
+def _enqueue_report(db, report_id, filter_hash, rerun=False):
+    now = datetime.now().replace(microsecond=0).astimezone().isoformat()
 
-    return report_id
+    db.execute('''INSERT OR REPLACE INTO report_queue (uuid, enqueued, rerun, filter_hash, report_url, map_url)
+        VALUES (:uuid, :enqueued, :rerun, :filter_hash, :report_url, :map_url);''', dict(
+            uuid=report_id,
+            enqueued=now,
+            rerun=1 if rerun else 0,
+            filter_hash=filter_hash,
+            report_url=flask.url_for('reporting.get_report', report_id=report_id, _external=True),  # absolute URL to report
+            map_url=flask.url_for('reporting.get_map', report_id=report_id),  # relative URL to map
+            ))
 
 
 def recreate_report_after_evict(report_id):
     with get_report_database() as db:
+        db.execute('BEGIN IMMEDIATE;')
+        db.execute('SELECT filter FROM reports WHERE uuid = :uuid AND report_state = :st;', dict(uuid=report_id, st='evicted'))
+        row = db.fetchone()
+        if row is None:
+            # already queued again by a concurrent request
+            return
+
+        _check_admission(db)
+
         db.execute('UPDATE reports SET report_state = :st WHERE uuid = :uuid;', dict(st='started', uuid=report_id))
+        _enqueue_report(db, report_id, _filter_hash(json.loads(gzip.decompress(row[0]))), rerun=True)
 
-    _run_report_generation(report_id, rerun=True)
+    ensure_report_worker()
+    logging.getLogger('flask.error').info(F'Queued report {report_id} for generation after eviction.')
 
 
 def start_report(username, server_version, filter_json):
+    '''
+    Queue a new report for generation and return its UUID. If the same user
+    already has a report with identical filters waiting for or in
+    generation, the UUID of that report is returned instead. Raises
+    `ReportQueueFull` if the queue is full.
+    '''
     u = str(uuid.uuid1())
     now = datetime.now().replace(microsecond=0).astimezone().isoformat()
 
     filter_content = gzip.compress(json.dumps(filter_json).encode('utf-8'))
+    filter_hash = _filter_hash(filter_json)
 
     with get_report_database() as db:
+        db.execute('BEGIN IMMEDIATE;')
+
+        pending = _find_pending_report(db, username, filter_hash)
+        if pending is not None:
+            logging.getLogger('flask.error').info(F'Report with identical filters is already queued as {pending}, not queueing a new one.')
+            return pending
+
+        _check_admission(db)
+
         dbversion = None
         if does_evict():
             # report eviction enabled: need current database version
@@ -135,63 +539,175 @@ def start_report(username, server_version, filter_json):
                 "database_version": dbversion,
                 })
 
-        _run_report_generation(u)
-        return u
+        _enqueue_report(db, u, filter_hash)
+
+    ensure_report_worker()
+    logging.getLogger('flask.error').info(F'Queued report {u} for generation.')
+
+    return u
+
+
+def estimate_completion(position, runtimes, workers, mean):
+    '''
+    Estimate the number of seconds until the report at (1-based) `position`
+    among the waiting reports is completed. `runtimes` are the seconds the
+    currently generated reports are already running, `mean` is the mean
+    generation time of a report. Jobs are assigned to the first worker that
+    becomes free, in FIFO order.
+    '''
+    workers = max(1, workers)
+    free = sorted(max(0.0, mean - r) for r in runtimes)[:workers]
+    free += [0.0] * (workers - len(free))
+    heapq.heapify(free)
+
+    for _ in range(position):
+        start = heapq.heappop(free)
+        heapq.heappush(free, start + mean)
+
+    return start + mean
+
+
+def get_queue_status(report_id):
+    '''
+    Get the position of the report in the generation queue (0 if it is being
+    generated right now) and the estimated number of seconds until it is
+    completed (None if no estimate is available yet). Returns None if the
+    report is not queued.
+    '''
+    now = datetime.now().astimezone()
+
+    with get_report_database() as db:
+        db.execute('SELECT enqueued, claimed, rowid FROM report_queue WHERE uuid = :uuid;', dict(uuid=report_id))
+        row = db.fetchone()
+        if row is None:
+            return None
+
+        enqueued, claimed, rowid = row
+        mean = _mean_generation_time(db)
+
+        if claimed is not None:
+            eta = None if mean is None else max(0.0, mean - (now - claimed).total_seconds())
+            return QueueStatus(0, eta)
+
+        db.execute('''SELECT count(*) FROM report_queue
+            WHERE claimed IS NULL
+              AND (enqueued < :enqueued OR (enqueued = :enqueued AND rowid <= :rowid));''',
+            dict(enqueued=enqueued.isoformat(), rowid=rowid))
+        (position,) = db.fetchone()
 
+        if mean is None:
+            return QueueStatus(position, None)
+
+        db.execute('SELECT claimed FROM report_queue WHERE claimed IS NOT NULL;')
+        runtimes = [ (now - c).total_seconds() for (c,) in db.fetchall() ]
+
+    return QueueStatus(position, estimate_completion(position, runtimes, get_config().report_workers, mean))
+
+
+
+# report accesses not yet written to the database: report UUID -> (count, last access)
+_pending_access = dict()
+_pending_access_lock = threading.Lock()
+_access_flush_interval = 30  # seconds
 
 
 def update_report_access(report_id):
+    '''
+    Record an access to a report. The accesses are written to the database
+    in batches by `flush_report_access`, so that viewing a report does not
+    need a write transaction.
+    '''
     now = datetime.now().replace(microsecond=0).astimezone().isoformat()
-    with get_report_database() as db:
-        db.execute('SELECT access_count FROM reports WHERE uuid = :uuid;', dict(uuid=report_id))
-        (access, ) = db.fetchone()
-        db.execute('UPDATE reports SET last_access = :now, access_count = :count WHERE uuid = :uuid;',
-                dict(uuid=report_id, now=now, count=access+1))
+    with _pending_access_lock:
+        count, _ = _pending_access.get(report_id, (0, None))
+        _pending_access[report_id] = (count + 1, now)
+
+
+def flush_report_access():
+    '''
+    Write the recorded report accesses to the database.
+    '''
+    global _pending_access
+    with _pending_access_lock:
+        pending = _pending_access
+        _pending_access = dict()
+
+    if len(pending) == 0:
+        return
+
+    try:
+        with get_report_database() as db:
+            db.executemany('''UPDATE reports
+                SET access_count = access_count + :count, last_access = :last_access
+                WHERE uuid = :uuid;''',
+                [ dict(uuid=uuid, count=count, last_access=last_access) for uuid, (count, last_access) in pending.items() ])
+
+    except:
+        logging.getLogger('flask.error').error('Could not write %d report accesses, retrying later: %s', len(pending), traceback.format_exc())
+
+        # keep them for the next attempt, merged with the accesses recorded in the meantime
+        with _pending_access_lock:
+            for uuid, (count, last_access) in pending.items():
+                newer_count, newer_access = _pending_access.get(uuid, (0, last_access))
+                _pending_access[uuid] = (count + newer_count, newer_access)
+
+atexit.register(flush_report_access)
+
+
+def register_scheduler(sched):
+    sched.add_job(flush_report_access, trigger='interval', seconds=_access_flush_interval)
 
 
 def evict_report(report_id):
     try:
         with get_report_database() as db:
-            db.execute('SELECT report_state, started, last_access, access_count, content, pdf_map, pdf_report FROM reports WHERE uuid = :uuid;', dict(uuid=report_id))
-            report_state, started, last_access, access_count, content, pdf_map, pdf_report = db.fetchone()
-            now = datetime.now().replace(microsecond=0).astimezone()
-
-            upd = dict(report_state='evicted', content=None, pdf_map=None, pdf_report=None, last_access=now.isoformat(), uuid=report_id)
-
-            size = ''
-            age = (now - started).days
-            age_accessed = (now - last_access).days
-
-            if report_state == 'started':
-                size = '0B'
-                logging.getLogger('flask.error').warning('Report %s is getting evicted but still in started state.', report_id)
-            elif report_state == 'evicted':
-                size = '0B'
-            elif report_state in ('completed', 'failed'):
-                size = 0
-                if content is not None:
-                    size += len(bytes(content))
-                if pdf_map is not None:
-                    size += len(bytes(pdf_map))
-                if pdf_report is not None:
-                    size += len(bytes(pdf_report))
-
-                if size > 1000000:
-                    sizes = F'{size // 1000000}MB'
-                elif size > 1000:
-                    sizes = F'{size // 1000}kB'
-                else:
-                    sizes = F'{size}B'
-                size = sizes
-            else:
-                logging.getLogger('flask.error').warning('Report %s is has unknown state: %s.', report_id, report_state)
-                size = '?'
-
-            db.execute('UPDATE reports SET report_state = :report_state, content = :content, pdf_report = :pdf_report, pdf_map = :pdf_map, last_access = :last_access WHERE uuid = :uuid;', upd)
-            logging.getLogger('flask.error').info('Evicted %s report with UUID %s (created %d days ago, last accessed %d days ago). Freed %s.', report_state, report_id, age, age_accessed, size)
+            _evict_report(db, report_id)
 
     except:
         tb = traceback.format_exc()
         logging.getLogger('flask.error').error('Something went wrong while evicting report %s: %s', report_id, tb)
 
 
+def evict_reports(report_ids):
+    '''
+    Evict several reports in one transaction.
+    '''
+    with get_report_database() as db:
+        db.execute('BEGIN IMMEDIATE;')
+        for report_id in report_ids:
+            _evict_report(db, report_id)
+
+
+def _evict_report(db, report_id):
+    db.execute('SELECT report_state, started, last_access FROM reports WHERE uuid = :uuid;', dict(uuid=report_id))
+    report_state, started, last_access = db.fetchone()
+    now = datetime.now().replace(microsecond=0).astimezone()
+
+    size = ''
+    age = (now - started).days
+    age_accessed = (now - last_access).days
+
+    # artifacts shared with other reports are kept
+    freed = set_report_artifacts(db, report_id, content=None, pdf_map=None, pdf_report=None)
+
+    if report_state == 'started':
+        size = '0B'
+        logging.getLogger('flask.error').warning('Report %s is getting evicted but still in started state.', report_id)
+    elif report_state == 'evicted':
+        size = '0B'
+    elif report_state in ('completed', 'failed'):
+        if freed > 1000000:
+            size = F'{freed // 1000000}MB'
+        elif freed > 1000:
+            size = F'{freed // 1000}kB'
+        else:
+            size = F'{freed}B'
+    else:
+        logging.getLogger('flask.error').warning('Report %s is has unknown state: %s.', report_id, report_state)
+        size = '?'
+
+    db.execute('UPDATE reports SET report_state = :report_state, last_access = :last_access WHERE uuid = :uuid;',
+            dict(report_state='evicted', last_access=now.isoformat(), uuid=report_id))
+    logging.getLogger('flask.error').info('Evicted %s report with UUID %s (created %d days ago, last accessed %d days ago). Freed %s.', report_state, report_id, age, age_accessed, size)
+
+
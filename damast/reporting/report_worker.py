@@ -0,0 +1,186 @@
+'''
+Long-lived report generation service.
+
+The server does not generate reports itself, but adds them to the
+`report_queue` table of the report database. This service takes the reports
+from the queue in FIFO order and generates them in forked child processes, at
+most `DAMAST_REPORT_WORKERS` at a time. Because the children are forked from
+this process, the map data, Jinja environments, and heavy imports (geopandas,
+matplotlib) are only loaded once, when the service starts.
+
+Only one instance of the service runs per report database, which is ensured
+by an exclusive lock on a file next to the report database. The server starts
+the service on demand (see `ensure_report_worker`) if no process holds the
+lock; if another instance took it in the meantime, the newly started process
+exits immediately.
+'''
+
+import os
+import sys
+import time
+import fcntl
+import signal
+import logging
+import traceback
+import multiprocessing
+from datetime import datetime
+from logging.handlers import TimedRotatingFileHandler
+
+from .report_database import get_report_database, worker_lock_path
+from ..config import get_config
+
+logger = logging.getLogger('flask.error')
+
+_poll_interval = 1  # seconds
+
+
+def _recover():
+    '''
+    Recover from a previous crash or restart: jobs that were claimed by a
+    previous (now dead) instance of the service are released again, and
+    reports that are stuck in the `started` state without a queue entry are
+    marked as evicted, so that they are generated again on the next access.
+    '''
+    with get_report_database() as db:
+        db.execute('UPDATE report_queue SET claimed = NULL, worker_pid = NULL WHERE claimed IS NOT NULL;')
+        released = db.rowcount
+
+        db.execute('''UPDATE reports SET report_state = 'evicted'
+            WHERE report_state = 'started'
+            AND uuid NOT IN (SELECT uuid FROM report_queue);''')
+        orphaned = db.rowcount
+
+    if released > 0 or orphaned > 0:
+        logger.warning('Report worker recovered %d interrupted job%s and %d report%s stuck in started state.',
+                released, '' if released == 1 else 's',
+                orphaned, '' if orphaned == 1 else 's')
+
+
+def _claim_next_job(worker_pid):
+    now = datetime.now().replace(microsecond=0).astimezone().isoformat()
+
+    with get_report_database() as db:
+        db.execute('BEGIN IMMEDIATE;')
+        db.execute('''SELECT uuid, enqueued, rerun, report_url, map_url
+            FROM report_queue
+            WHERE claimed IS NULL
+            ORDER BY enqueued ASC, rowid ASC
+            LIMIT 1;''')
+        job = db.fetchone()
+        if job is None:
+            return None
+
+        db.execute('UPDATE report_queue SET claimed = :now, worker_pid = :pid WHERE uuid = :uuid;', dict(now=now, pid=worker_pid, uuid=job[0]))
+
+        return job
+
+
+def _finish_job(uuid, enqueued, claimed, exitcode):
+    now = datetime.now().astimezone()
+
+    with get_report_database() as db:
+        db.execute('DELETE FROM report_queue WHERE uuid = :uuid;', dict(uuid=uuid))
+        db.execute('''INSERT OR REPLACE INTO report_stage_duration (uuid, stage, finished, duration)
+            VALUES (:uuid, 'queue', :now, :queue), (:uuid, 'total', :now, :total);''',
+            dict(uuid=uuid, now=now.replace(microsecond=0).isoformat(), queue=(claimed - enqueued).total_seconds(), total=(now - claimed).total_seconds()))
+
+        if exitcode != 0:
+            # the child process crashed without marking the report as failed
+            db.execute('''UPDATE reports SET report_state = 'failed', completed = :now
+                WHERE uuid = :uuid AND report_state = 'started';''', dict(uuid=uuid, now=now.replace(microsecond=0).isoformat()))
+            if db.rowcount > 0:
+                logger.error('Report generation process for %s exited with code %s, marked report as failed.', uuid, exitcode)
+
+
+def _run_job(uuid, report_url, map_url):
+    # runs in the forked child process
+    from .create_report import generate_report
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        generate_report(uuid, report_url, map_url)
+    except Exception as err:
+        logger.error('Error occurred during report generation of %s: %s', uuid, err)
+        sys.exit(1)
+
+
+def _preload():
+    '''
+    Load everything the report generation needs once, so that the forked
+    children do not have to.
+    '''
+    t0 = time.perf_counter()
+    from .create_report import generate_report
+    from .html import html_environment
+    from .tex import tex_environment
+    from .tex_format import get_preamble_format
+
+    html_environment().get_template('reporting/report_content.html')
+    tex_environment().get_template('reporting/tex/report_content.tex')
+    get_preamble_format()
+
+    logger.info('Report worker preloaded report generation in %.1fs.', time.perf_counter() - t0)
+
+
+def run():
+    conf = get_config()
+    concurrency = conf.report_workers
+    worker_pid = os.getpid()
+
+    lock = open(worker_lock_path(), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.info('Report worker is already running, exiting.')
+        return
+
+    _preload()
+    _recover()
+
+    logger.info('Report worker started (PID %d), generating up to %d report%s in parallel.', worker_pid, concurrency, '' if concurrency == 1 else 's')
+
+    context = multiprocessing.get_context('fork')
+    running = dict()
+
+    while True:
+        for uuid, (proc, enqueued, claimed) in list(running.items()):
+            if not proc.is_alive():
+                proc.join()
+                del running[uuid]
+                _finish_job(uuid, enqueued, claimed, proc.exitcode)
+
+        while len(running) < concurrency:
+            job = _claim_next_job(worker_pid)
+            if job is None:
+                break
+
+            uuid, enqueued, rerun, report_url, map_url = job
+            proc = context.Process(target=_run_job, args=(uuid, report_url, map_url), daemon=False)
+            proc.start()
+            running[uuid] = (proc, enqueued, datetime.now().astimezone())
+
+            if rerun:
+                logger.info('Restarting report generation of %s after eviction (PID %d).', uuid, proc.pid)
+            else:
+                logger.info('Starting report generation of %s (PID %d).', uuid, proc.pid)
+
+        time.sleep(_poll_interval)
+
+
+if __name__ == '__main__':
+    conf = get_config()
+    _err_handler = TimedRotatingFileHandler(
+        conf.error_log,
+        when='midnight',
+        interval=1,
+        backupCount=10)
+    _err_handler.setFormatter(logging.Formatter('[%(asctime)s] [%(levelname)s] [PID %(process)s] %(message)s',
+        datefmt='%Y-%m-%dT%H:%M:%S %z'))
+    logger.addHandler(_err_handler)
+    logger.setLevel(logging.INFO)
+
+    try:
+        run()
+    except:
+        logger.error('Report worker stopped unexpectedly: %s', traceback.format_exc())
+        sys.exit(1)
@@ -21,7 +21,7 @@ import subprocess
 import re
 
 from .create_map import create_map
-from .report_database import ReportTuple, get_report_database, start_report
+from .report_database import get_report_database, start_report
 from .datatypes import Evidence, Place
 from .verbalize_filters import verbalize, get_filter_description
 from .filters import blueprint as filter_blueprint
@@ -145,8 +145,9 @@ def placename(value):
 
 
 
-def render_tex_report(context):
-    tex_environment = Environment(
+@lru_cache(maxsize=None)
+def tex_environment():
+    environment = Environment(
             block_start_string='<%',
             block_end_string='%>',
             variable_start_string='<<',
@@ -155,12 +156,16 @@ def render_tex_report(context):
             loader=FileSystemLoader(os.path.join(pathlib.Path(__file__).parent.absolute(), 'templates')),
             )
 
-    tex_environment.filters['render_int4range'] = render_int4range
-    tex_environment.filters['render_geoloc'] = render_geoloc
-    tex_environment.filters['sort_int4range'] = sort_int4range
-    tex_environment.filters['texsafe'] = texsafe
-    tex_environment.filters['placename'] = placename
+    environment.filters['render_int4range'] = render_int4range
+    environment.filters['render_geoloc'] = render_geoloc
+    environment.filters['sort_int4range'] = sort_int4range
+    environment.filters['texsafe'] = texsafe
+    environment.filters['placename'] = placename
+
+    return environment
 
-    tex_template = tex_environment.get_template('reporting/tex/report_content.tex')
+
+def render_tex_report(context):
+    tex_template = tex_environment().get_template('reporting/tex/report_content.tex')
     tex_content = tex_template.render(**context)
     return tex_content
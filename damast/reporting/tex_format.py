@@ -0,0 +1,170 @@
+'''
+Precompiled XeLaTeX format for the static part of the report preamble.
+
+Loading the document class and packages of the report preamble takes a large
+part of each `xelatex` run. These are dumped into a format once, which the
+report compilation then loads instead of the `xelatex` format. The fonts
+(`fontspec`, `polyglossia`) cannot be dumped by XeTeX and are still loaded in
+each run. The report template only loads the static preamble if it is not
+preloaded, so the same document compiles with and without the format.
+
+The format is stored in a directory next to the report database, which only
+the server's user may write to, keyed by the preamble and the XeTeX version,
+and rebuilt if either changes. If building the format fails, or a report that
+fails to compile with it compiles without it, reports are compiled without it
+for a day. The latter is recorded in a marker file next to the format, so that
+all processes see it; after a day, the format is built again.
+'''
+
+import os
+import os.path
+import stat
+import time
+import shutil
+import hashlib
+import logging
+import pathlib
+import tempfile
+import contextlib
+import subprocess
+
+from ..config import get_config
+
+preamble_file = os.path.join(pathlib.Path(__file__).parent.absolute(), 'templates', 'reporting', 'tex', 'preamble.tex')
+
+# seconds until a format that failed is tried again
+_retry_interval = 24 * 3600
+
+_format_path = None
+# time.monotonic() of the last failure of the format in this process
+_format_failed = None
+
+
+def _format_directory():
+    directory = F'{get_config().report_file}.formats'
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    # the format is loaded into every report, so nobody else may replace it
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise OSError(F'{directory} is not a directory that only this user may write to.')
+
+    return directory
+
+
+def _format_name():
+    with open(preamble_file, 'rb') as f:
+        preamble = f.read()
+
+    version = subprocess.run(['xelatex', '--version'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL).stdout
+
+    key = hashlib.sha256(preamble + version).hexdigest()[:16]
+    return F'damast-preamble-{key}'
+
+
+def _build_format(name, target):
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, 'preamble.tex'), 'w') as f:
+            f.write(F'\\input{{{preamble_file}}}\n\\def\\damastpreamblepreloaded{{}}\n\\dump\n')
+
+        t0 = time.perf_counter()
+        proc = subprocess.run(['xelatex', '-ini', '-interaction=nonstopmode', F'-jobname={name}', '&xelatex', 'preamble.tex'],
+                cwd=directory,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding='utf-8',
+                errors='replace')
+
+        fmt = os.path.join(directory, F'{name}.fmt')
+        if proc.returncode != 0 or not os.path.exists(fmt):
+            logging.getLogger('flask.error').warning('Could not build LaTeX preamble format, compiling reports without it:\n%s', proc.stdout)
+            return False
+
+        # atomic, in case another process builds the format at the same time
+        shutil.copyfile(fmt, F'{target}.tmp{os.getpid()}')
+        os.replace(F'{target}.tmp{os.getpid()}', target)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(_failed_marker(target))
+        logging.getLogger('flask.error').info('Built LaTeX preamble format %s in %.1fs.', target, time.perf_counter() - t0)
+        return True
+
+    finally:
+        shutil.rmtree(directory)
+
+
+def get_preamble_format():
+    '''
+    Get the path of the preamble format file, building it if necessary.
+    Returns None if the format cannot be used.
+    '''
+    global _format_path, _format_failed
+
+    if _format_failed is not None and time.monotonic() - _format_failed < _retry_interval:
+        return None
+    if _format_path is not None and not _disabled(_format_path) and os.path.exists(_format_path):
+        return _format_path
+
+    try:
+        name = _format_name()
+        target = os.path.join(_format_directory(), F'{name}.fmt')
+        if _disabled(target):
+            _format_failed = time.monotonic()
+            return None
+
+        if not os.path.exists(target) and not _build_format(name, target):
+            _format_failed = time.monotonic()
+            return None
+
+        _format_failed = None
+        _format_path = target
+        return _format_path
+
+    except OSError as err:
+        logging.getLogger('flask.error').warning('Could not build LaTeX preamble format, compiling reports without it: %s', err)
+        _format_failed = time.monotonic()
+        return None
+
+
+def _failed_marker(fmt):
+    return F'{fmt}.failed'
+
+
+def _disabled(fmt):
+    '''
+    Check if the format file `fmt` was disabled less than `_retry_interval`
+    seconds ago. An older marker is removed, together with the format, so that
+    the format is built again.
+    '''
+    marker = _failed_marker(fmt)
+    try:
+        age = time.time() - os.stat(marker).st_mtime
+    except FileNotFoundError:
+        return False
+
+    if age < _retry_interval:
+        return True
+
+    for path in (fmt, marker):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+    return False
+
+
+def disable_preamble_format(fmt):
+    '''
+    Do not use the format file `fmt` for `_retry_interval` seconds, in any
+    process, e.g., after a report failed to compile with it, but compiled
+    without it.
+    '''
+    global _format_failed
+    _format_failed = time.monotonic()
+
+    logging.getLogger('flask.error').warning('LaTeX preamble format %s does not work, compiling reports without it.', fmt)
+    try:
+        with open(_failed_marker(fmt), 'w'):
+            pass
+    except OSError as err:
+        logging.getLogger('flask.error').warning('Could not mark LaTeX preamble format as broken: %s', err)
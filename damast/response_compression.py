@@ -1,8 +1,11 @@
 import flask
+import zlib
 import gzip
 import brotli
+import hashlib
+import threading
 import werkzeug.exceptions
-from io import BytesIO as IO
+from collections import OrderedDict
 
 compress = flask.Blueprint('compress-response', __name__)
 
@@ -18,6 +21,122 @@ _brotli_mimetypes = (
         'application/xml',
         )
 
+
+def _compress_fast(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _compress_best(data, encoding):
+    # brotli quality 10 and 11 take tens of seconds for bodies of several megabytes
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=9)
+    return gzip.compress(data, compresslevel=9)
+
+
+def _compress_stream(chunks, encoding):
+    '''
+    Compress a streamed response body chunk by chunk. The compressor is flushed
+    after each chunk, so that the client can decode what it received so far.
+    '''
+    if encoding == 'br':
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=5)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    for chunk in chunks:
+        compressed = process(chunk) + flush()
+        if len(compressed) > 0:
+            yield compressed
+
+    yield finish()
+
+
+class CompressionCache:
+    '''
+    Cache of compressed response bodies, keyed by the hash of the body and the
+    encoding. Bodies that were seen before (by hash) are compressed once at a
+    high level and then served from the cache, which is bounded in size and
+    evicts the least-recently used entries. Other bodies are compressed at a
+    fast level and not cached, so that unique responses do not fill the cache.
+    '''
+    def __init__(self, maxsize, min_size=16*1024, seen_entries=4096):
+        self.maxsize = maxsize
+        self.min_size = min_size
+        self.seen_entries = seen_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (hash, encoding) -> compressed body
+        self._seen = OrderedDict()  # hashes of bodies seen once, in LRU order
+        self._lock = threading.Lock()
+
+    def compress(self, data, encoding):
+        if self.maxsize <= 0 or len(data) < self.min_size:
+            return _compress_fast(data, encoding)
+
+        key = (hashlib.sha1(data).digest(), encoding)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compressed
+
+            self.misses += 1
+            seen = key in self._seen
+            if not seen:
+                self._seen[key] = True
+                if len(self._seen) > self.seen_entries:
+                    self._seen.popitem(last=False)
+
+        if not seen:
+            return _compress_fast(data, encoding)
+
+        compressed = _compress_best(data, encoding)
+        with self._lock:
+            self._seen.pop(key, None)
+            if key not in self._entries and len(compressed) <= self.maxsize:
+                self._entries[key] = compressed
+                self.size += len(compressed)
+
+                while self.size > self.maxsize:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+
+        return compressed
+
+    def stats(self):
+        with self._lock:
+            return dict(entries=len(self._entries), size=self.size, maxsize=self.maxsize, hits=self.hits, misses=self.misses)
+
+
+_cache = None
+
+def get_compression_cache():
+    global _cache
+    if _cache is None:
+        _cache = CompressionCache(flask.current_app.damast_config.compression_cache_maxsize * 1000000)
+    return _cache
+
+
+def _compress_response(response, encoding):
+    if response.is_streamed and not response.direct_passthrough:
+        # generated responses are compressed as they are sent, not cached
+        response.response = _compress_stream(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.direct_passthrough = False
+        response.data = get_compression_cache().compress(response.data, encoding)
+        response.headers['Content-Length'] = len(response.data)
+
+    response.headers['Content-Encoding'] = encoding
+    response.headers.extend(dict(Vary='Accept-Encoding'))
+
+
 @compress.after_app_request
 def _maybe_compress(response):
     '''
@@ -33,32 +152,11 @@ def _maybe_compress(response):
                 response.headers['Content-Encoding'] = 'identity'
 
     elif 'br' in flask.request.accept_encodings \
-            and response.mimetype in _brotli_mimetypes:
-                response.direct_passthrough = False
-
-                compressed = brotli.compress(response.data,
-                        mode=brotli.MODE_TEXT,
-                        quality=5)
-
-                response.data = compressed
-                response.headers['Content-Encoding'] = 'br'
-                response.headers.extend(dict(Vary='Accept-Encoding'))
-                response.headers['Content-Length'] = len(response.data)
+            and (response.mimetype in _brotli_mimetypes or response.is_json):
+                _compress_response(response, 'br')
 
     elif 'gzip' in flask.request.accept_encodings:
-        response.direct_passthrough = False
-
-        gzip_buffer = IO()
-        gzip_file = gzip.GzipFile(mode='wb',
-                                  fileobj=gzip_buffer,
-                                  compresslevel=6)
-        gzip_file.write(response.data)
-        gzip_file.close()
-
-        response.data = gzip_buffer.getvalue()
-        response.headers['Content-Encoding'] = 'gzip'
-        response.headers.extend(dict(Vary='Accept-Encoding'))
-        response.headers['Content-Length'] = len(response.data)
+        _compress_response(response, 'gzip')
 
     elif 'identity' in flask.request.accept_encodings \
             and flask.request.accept_encodings.quality('identity') == 0:
@@ -2,6 +2,11 @@
 
 import flask
 from ..authenticated_blueprint_preparator import AuthenticatedBlueprintPreparator
+from ..response_compression import get_compression_cache
+from ..document_fragment import get_offset_index_cache
+from ..postgres_rest_api.streaming import get_stream_slots
+from ..postgres_database import get_refresh_status
+from ..scheduler import get_job_runs
 
 auth = flask.current_app.config['auth']
 
@@ -24,7 +29,8 @@ def impressum():
 def datenschutz():
     return flask.render_template('root/datenschutz.html')
 
-@app.route('/static/public/<path:filename>', optional=True)
+# public files are served without verifying the session token
+@app.route('/static/public/<path:filename>')
 def static_public(filename):
     return flask.current_app.serve_static_file(__path__[0] + '/static', F'public/{filename}')
 
@@ -47,6 +53,30 @@ def whoami():
     return flask.jsonify(data)
 
 
+@app.route('/stats', role=['admin'])
+def stats():
+    '''
+    Get statistics of the server process's caches (compressed responses,
+    users, document offset indices), PostgreSQL connection pool, and streamed
+    responses, the refresh status of the materialized view
+    `place_religion_overview`, and the last run of each scheduled job, as
+    JSON.
+    '''
+    with flask.current_app.pg.get_cursor(readonly=True) as c:
+        overview = get_refresh_status(c, 'place_religion_overview')
+        jobs = get_job_runs(c)
+
+    return flask.jsonify(dict(
+        compression_cache=get_compression_cache().stats(),
+        user_cache=flask.current_app.user_cache.stats(),
+        document_fragment_cache=get_offset_index_cache().stats(),
+        postgres_pool=flask.current_app.pg.pool.stats(),
+        streamed_responses=get_stream_slots().stats(),
+        place_religion_overview=overview,
+        scheduler_jobs=jobs,
+        ))
+
+
 @app.route('/cookie-preferences', optional=True)
 def cookie_preferences():
     return flask.render_template('root/cookies.html')
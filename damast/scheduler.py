@@ -0,0 +1,146 @@
+'''
+Leadership of the periodic jobs across server processes.
+
+Each server process runs a scheduler, but the jobs wrapped with `leader_job`
+only run in the process that holds a PostgreSQL advisory lock, the leader, so
+that they run once per deployment even with several workers. The lock is held
+by a dedicated connection of the leader, and is released by the database when
+the leader exits or loses its connection; another process then takes over at
+its next job. Jobs that concern the process itself (for example, writing its
+buffered report accesses) are registered without the wrapper.
+
+Each run of a leader job is recorded in the table `scheduler_job_run`, if the
+database has it (see `util/postgres/scheduler-job-run.sql`), with its start,
+duration, and error, if any, for 30 days.
+'''
+
+import os
+import time
+import socket
+import logging
+import threading
+import traceback
+from functools import wraps
+
+import psycopg2
+
+from .postgres_database import postgres_url
+
+_lock_name = 'damast-scheduler-leader'
+_history_days = 30
+
+_connection = None
+_is_leader = False
+_connection_lock = threading.Lock()
+
+# connections inherited from the parent process, which must not be closed
+_inherited_connections = []
+
+
+def _reset_after_fork():
+    global _connection, _is_leader, _connection_lock
+    if _connection is not None:
+        _inherited_connections.append(_connection)
+    _connection = None
+    _is_leader = False
+    _connection_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _connect():
+    connection = psycopg2.connect(postgres_url('damast-scheduler'))
+    connection.autocommit = True
+    return connection
+
+
+def _check_leadership():
+    '''
+    Check if this process is the leader, trying to become it otherwise.
+    '''
+    global _connection, _is_leader
+
+    try:
+        if _connection is None or _connection.closed:
+            _connection = _connect()
+            _is_leader = False
+
+        with _connection.cursor() as c:
+            if _is_leader:
+                # the lock is gone with the connection
+                c.execute('SELECT 1;')
+            else:
+                c.execute('SELECT pg_try_advisory_lock(hashtext(%s));', (_lock_name,))
+                _is_leader = c.fetchone()[0]
+                if _is_leader:
+                    logging.getLogger('flask.error').info('Process %d is the leader for scheduled jobs.', os.getpid())
+
+    except psycopg2.Error as err:
+        logging.getLogger('flask.error').warning('Could not check leadership for scheduled jobs: %s', err)
+        if _connection is not None:
+            _connection.close()
+        _connection = None
+        _is_leader = False
+
+    return _is_leader
+
+
+def _record_run(job, started, duration, error):
+    try:
+        with _connection.cursor() as c:
+            c.execute("SELECT to_regclass('public.scheduler_job_run');")
+            if c.fetchone()[0] is None:
+                return
+
+            c.execute('''INSERT INTO scheduler_job_run (job, host, pid, started, duration, error)
+                VALUES (%(job)s, %(host)s, %(pid)s, to_timestamp(%(started)s), %(duration)s, %(error)s);''',
+                dict(job=job, host=socket.gethostname(), pid=os.getpid(), started=started, duration=duration, error=error))
+            c.execute(F"DELETE FROM scheduler_job_run WHERE started < now() - interval '{_history_days} days';")
+
+    except psycopg2.Error as err:
+        logging.getLogger('flask.error').warning('Could not record run of scheduled job %s: %s', job, err)
+
+
+def leader_job(name, func):
+    '''
+    Wrap the job function `func` so that it only runs in the leader process,
+    and record its runs under `name`.
+    '''
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with _connection_lock:
+            if not _check_leadership():
+                return None
+
+        started = time.time()
+        t0 = time.perf_counter()
+        error = None
+        try:
+            return func(*args, **kwargs)
+
+        except:
+            error = traceback.format_exc()
+            logging.getLogger('flask.error').error('Scheduled job %s failed: %s', name, error)
+
+        finally:
+            duration = time.perf_counter() - t0
+            with _connection_lock:
+                if _connection is not None:
+                    _record_run(name, started, duration, error)
+
+    return wrapper
+
+
+def get_job_runs(cursor):
+    '''
+    Get the last run of each scheduled job, or None if the runs are not
+    recorded in the database.
+    '''
+    if cursor.one("SELECT to_regclass('public.scheduler_job_run');") is None:
+        return None
+
+    runs = cursor.all('''SELECT DISTINCT ON (job) job, host, pid, started, duration, error IS NULL AS succeeded
+        FROM scheduler_job_run
+        ORDER BY job, started DESC;''')
+
+    return { r.job: dict(host=r.host, pid=r.pid, started=r.started.isoformat(), duration=r.duration, succeeded=r.succeeded) for r in runs }
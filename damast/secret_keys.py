@@ -0,0 +1,50 @@
+'''
+Secret keys of the server: the Flask secret key and the JWT secret.
+
+The keys are read from the secret file, if one is configured. Otherwise, they
+are generated at startup, so that sessions do not outlive the server. With
+several worker processes, the gunicorn master generates the keys once and
+hands them to each worker after the fork (see `gunicorn.conf.py`), so that
+all workers accept the same sessions and tokens.
+'''
+
+import json
+import logging
+
+from passlib.pwd import genword
+
+_shared_secrets = None
+
+
+def generate_secrets():
+    return dict(
+            secret_key=genword(entropy='secure', charset='ascii_72'),
+            jwt_secret=genword(entropy='secure', charset='ascii_72'),
+            )
+
+
+def share_secrets(secrets):
+    '''
+    Use `secrets` instead of generating them in this process.
+    '''
+    global _shared_secrets
+    _shared_secrets = secrets
+
+
+def load_secrets(secret_file, is_testing):
+    '''
+    Get the secret keys as a dict with `secret_key` and `jwt_secret`. Keys
+    that are not in the secret file are generated.
+    '''
+    secrets = dict(_shared_secrets) if _shared_secrets is not None else generate_secrets()
+
+    if secret_file is not None:
+        with open(secret_file) as f:
+            if is_testing:
+                logging.getLogger('flask.error').info('Loading secrets from file %s.', f.name)
+            else:
+                logging.getLogger('flask.error').warning('Loading secrets from file %s. This should not happen on a production server.', f.name)
+
+            secrets.update(json.load(f))
+
+    return secrets
@@ -1,7 +1,10 @@
 from dataclasses import dataclass
 from typing import List
+from collections import OrderedDict
 import os
+import time
 import logging
+import threading
 
 from .config import get_config
 
@@ -43,3 +46,70 @@ def visitor(roles):
         return None
 
     return User(name='visitor', roles=roles, visitor=True)
+
+
+class UserCache:
+    '''
+    Cache of the users' entries in the user database, keyed by user ID, so
+    that verifying the session token does not query the database on each
+    request. Entries expire after `ttl` seconds, at most `maxsize` entries are
+    kept in LRU order, and all entries are dropped when the user database file
+    or its write-ahead log changes (by modification time, size, or inode).
+    '''
+    def __init__(self, user_file, maxsize=256, ttl=60):
+        self.user_file = user_file
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user ID -> (expiry, entry)
+        self._file_state = None
+        self._lock = threading.Lock()
+
+    def _current_file_state(self):
+        # in WAL mode, changes are written to the -wal file first
+        state = []
+        for path in (self.user_file, F'{self.user_file}-wal'):
+            try:
+                st = os.stat(path)
+                state.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except OSError:
+                state.append(None)
+
+        return tuple(state)
+
+    def get(self, user_id, load):
+        '''
+        Get the entry of `user_id`, calling `load(user_id)` to read it from the
+        database if it is not cached. Users that do not exist (`None`) are
+        cached as well.
+        '''
+        file_state = self._current_file_state()
+        now = time.monotonic()
+        with self._lock:
+            if file_state != self._file_state:
+                self._entries.clear()
+                self._file_state = file_state
+
+            cached = self._entries.get(user_id)
+            if cached is not None and cached[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return cached[1]
+
+            self.misses += 1
+
+        entry = load(user_id)
+        with self._lock:
+            # not cached if the file changed meanwhile, the entry might be stale
+            if file_state == self._file_state:
+                self._entries[user_id] = (now + self.ttl, entry)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return dict(entries=len(self._entries), maxsize=self.maxsize, ttl=self.ttl, hits=self.hits, misses=self.misses)
@@ -0,0 +1,69 @@
+import * as T from './datatypes';
+
+// media type of the column-oriented variant of /rest/evidence-list
+export const evidence_columns_mimetype = 'application/vnd.damast.evidence-columns+json';
+
+interface DictionaryColumn<V> {
+  dictionary: V[];
+  codes: number[];
+};
+
+interface ListColumn<C> {
+  lengths: number[];  // -1 for null
+  values: C;
+};
+
+export interface EvidenceColumns {
+  tuple_id: number[];
+  place_id: number[];
+  religion_id: number[];
+  time_span: { start: (number | null)[], end: (number | null)[] };
+  source_ids: ListColumn<number[]>;
+  time_confidence: DictionaryColumn<T.Confidence>;
+  location_confidence: DictionaryColumn<T.Confidence>;
+  place_attribution_confidence: DictionaryColumn<T.Confidence>;
+  source_confidences: ListColumn<DictionaryColumn<T.Confidence>>;
+  interpretation_confidence: DictionaryColumn<T.Confidence>;
+  religion_confidence: DictionaryColumn<T.Confidence>;
+};
+
+function decodeDictionary<V>(column: DictionaryColumn<V>): V[] {
+  return column.codes.map(code => column.dictionary[code]);
+}
+
+function decodeList<V>(lengths: number[], values: V[]): (V[] | null)[] {
+  let offset = 0;
+  return lengths.map(length => {
+    if (length === -1) return null;
+
+    offset += length;
+    return values.slice(offset - length, offset);
+  });
+}
+
+// convert the columns back to one object per evidence tuple
+export function decodeEvidenceColumns(columns: EvidenceColumns): T.RawEvidenceListTuple[] {
+  const time_confidence = decodeDictionary(columns.time_confidence);
+  const location_confidence = decodeDictionary(columns.location_confidence);
+  const place_attribution_confidence = decodeDictionary(columns.place_attribution_confidence);
+  const interpretation_confidence = decodeDictionary(columns.interpretation_confidence);
+  const religion_confidence = decodeDictionary(columns.religion_confidence);
+  const source_ids = decodeList(columns.source_ids.lengths, columns.source_ids.values);
+  const source_confidences = decodeList(columns.source_confidences.lengths, decodeDictionary(columns.source_confidences.values));
+
+  return columns.tuple_id.map((tuple_id, i) => {
+    return {
+      tuple_id,
+      place_id: columns.place_id[i],
+      religion_id: columns.religion_id[i],
+      source_ids: source_ids[i],
+      time_span: { start: columns.time_span.start[i], end: columns.time_span.end[i] },
+      time_confidence: time_confidence[i],
+      location_confidence: location_confidence[i],
+      place_attribution_confidence: place_attribution_confidence[i],
+      source_confidences: source_confidences[i],
+      interpretation_confidence: interpretation_confidence[i],
+      religion_confidence: religion_confidence[i],
+    };
+  });
+}
@@ -5,6 +5,9 @@ import yaml
 import subprocess
 import flask
 import sqlite3
+import psycopg2
+from types import SimpleNamespace
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from passlib.hash import bcrypt
 from client_fixture import create_client
 
@@ -266,6 +269,75 @@ def user_db_content():
     return dump
 
 
+@pytest.fixture
+def report_file(tmp_path, monkeypatch):
+    '''
+    Configure an empty report database in a temporary directory, with the
+    default eviction settings, and return its path.
+    '''
+    monkeypatch.setenv('PGPASSWORD', 'docker')
+    monkeypatch.setenv('DAMAST_REPORT_FILE', str(tmp_path / 'reports.db'))
+    monkeypatch.delenv('DAMAST_REPORT_EVICTION_DEFERRAL', raising=False)
+    monkeypatch.delenv('DAMAST_REPORT_EVICTION_MAXSIZE', raising=False)
+    return tmp_path / 'reports.db'
+
+
+class FakeConnection:
+    '''
+    Stand-in for a `psycopg2` connection to a `FakeServer`, which creates its
+    cursors.
+    '''
+    def __init__(self, server):
+        self.server = server
+        self.info = SimpleNamespace(transaction_status=TRANSACTION_STATUS_IDLE)
+        self.closed = False
+        self.broken = False
+
+    def cursor(self, *args, **kwargs):
+        return self.server.cursor(self, *args, **kwargs)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeServer:
+    '''
+    Stand-in for the database server, to which `psycopg2.connect` connects in
+    tests with the `pg_server` fixture. The connections have no cursors,
+    unless a subclass creates them.
+    '''
+    def __init__(self):
+        self.connections = []
+
+    def connect(self, *args, **kwargs):
+        self.connections.append(FakeConnection(self))
+        return self.connections[-1]
+
+    def cursor(self, connection, *args, **kwargs):
+        raise NotImplementedError('The fake server does not run queries.')
+
+
+@pytest.fixture
+def pg_server_class():
+    '''
+    Class of the `pg_server`, which a test module can override with a subclass
+    of `FakeServer`.
+    '''
+    return FakeServer
+
+
+@pytest.fixture
+def pg_server(pg_server_class, monkeypatch):
+    '''
+    Let `psycopg2.connect` open `FakeConnection`s to a fake server, which is
+    returned.
+    '''
+    monkeypatch.setenv('PGPASSWORD', 'docker')
+    server = pg_server_class()
+    monkeypatch.setattr(psycopg2, 'connect', server.connect)
+    return server
+
+
 def pytest_configure(config):
     config.addinivalue_line(
             "markers", "slow: marks tests as  slow (deselect with '-m \"not slow\"')"
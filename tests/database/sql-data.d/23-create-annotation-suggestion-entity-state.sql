@@ -0,0 +1,16 @@
+--
+-- Fingerprints of the search terms of each entity for the annotation
+-- suggestions of each document.
+--
+-- See also: util/postgres/annotation-suggestion-entity-state.sql
+--
+
+CREATE TABLE public.annotation_suggestion_entity_state (
+    document_id integer NOT NULL,
+    type text NOT NULL,
+    entity_id integer NOT NULL,
+    fingerprint text NOT NULL,
+    PRIMARY KEY (document_id, type, entity_id)
+);
+
+ALTER TABLE public.annotation_suggestion_entity_state OWNER TO docker;
@@ -0,0 +1,15 @@
+--
+-- Index of the text of each document.
+--
+-- See also: util/postgres/document-index.sql
+--
+
+CREATE TABLE public.document_index (
+    document_id integer NOT NULL,
+    document_version integer NOT NULL,
+    inner_text text NOT NULL,
+    token_offsets bytea NOT NULL,
+    PRIMARY KEY (document_id, document_version)
+);
+
+ALTER TABLE public.document_index OWNER TO docker;
@@ -387,6 +387,12 @@ ALTER TABLE ONLY public.annotation_suggestion
 ALTER TABLE ONLY public.annotation_suggestion_document_state
     ADD CONSTRAINT annotation_suggestion_document_state_document_id_fkey FOREIGN KEY (document_id) REFERENCES public.document(id) ON UPDATE CASCADE ON DELETE CASCADE;
 
+ALTER TABLE ONLY public.annotation_suggestion_entity_state
+    ADD CONSTRAINT annotation_suggestion_entity_state_document_id_fkey FOREIGN KEY (document_id) REFERENCES public.document(id) ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE ONLY public.document_index
+    ADD CONSTRAINT document_index_document_id_fkey FOREIGN KEY (document_id) REFERENCES public.document(id) ON UPDATE CASCADE ON DELETE CASCADE;
+
 --
 -- Name: bishopric bishopric_bishopric_type_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: docker
 --
@@ -191,6 +191,10 @@ def test_document(client_ro, minimal_testuser, document):
 
                     assert inner_text_expected == inner_text, (start, end, doc.content_length, len(inner_text_expected))
 
+                    # cut out of the offset index as if the document was parsed
+                    if rv.status_code == 206:
+                        assert rv.data == damast.document_fragment.extract_fragment(doc.content, start, end+1).encode('utf-8')
+
 
     else:
         assert rv.status_code == 403
@@ -0,0 +1,27 @@
+'''
+Reference matching of annotation suggestions, as before the fragment index:
+every fragment is compared with every term. The tests and
+`util/benchmark/annotation_suggestions.py` check that the indexed search finds
+the same matches.
+'''
+
+from Levenshtein import ratio
+
+
+def search_all_pairs(frags, search_term):
+    '''
+    Find the fragments in `frags` with a ratio of at least 0.9 to a term of
+    `search_term`, like `search_with_term`.
+    '''
+    # the configuration is read on import, which needs PGPASSWORD
+    from damast.annotator.suggestions import Result
+
+    key = (type(search_term.data).__name__, search_term.data.id)
+    vals = []
+    for term in search_term.terms:
+        for token in frags:
+            rat = ratio(token.text, term)
+            if rat >= 0.9:
+                vals.append(Result(rat, set([search_term.source]), token.start, token.end))
+
+    return key, vals
@@ -0,0 +1,111 @@
+import pytest
+import random
+from suggestions_reference import search_all_pairs
+
+
+def _misspelled(rng, name):
+    chars = list(name)
+    for _ in range(rng.choice((0, 0, 1, 2))):
+        position = rng.randrange(len(chars))
+        if rng.random() < 0.5:
+            chars.pop(position)
+        else:
+            chars.insert(position, rng.choice('aeiou'))
+    return ''.join(chars)
+
+
+def test_indexed_search_same_as_all_pairs(ro_cursor):
+    '''check that the indexed search finds the same suggestions as comparing all fragments'''
+    from damast.annotator import suggestions
+    from damast.annotator.fragment_index import FragmentIndex
+    from damast.document_index import DocumentIndex
+
+    search_terms = suggestions.get_all_places(ro_cursor)
+    search_terms.extend(suggestions.get_all_persons(ro_cursor))
+    search_terms.extend(suggestions.get_all_religions(ro_cursor))
+
+    ro_cursor.execute("SELECT * FROM document WHERE content_type LIKE 'text/%';")
+    documents = [ (d.id, bytes(d.content).decode('utf-8'), d.content_type) for d in ro_cursor.fetchall() ]
+
+    # a document with the (partly misspelled) names of the database, so that there are matches
+    rng = random.Random(0)
+    names = [ _misspelled(rng, name) for st in search_terms for name in st.terms if len(name) > 0 ]
+    documents.append((None, '<p>' + ' and '.join(names) + '</p>', 'text/html'))
+
+    matches = 0
+    for document_id, content, content_type in documents:
+        terms = list(search_terms)
+        if document_id is not None:
+            text = DocumentIndex.build(content, content_type).text
+            annotations, _ = suggestions.get_other_annotation_content_data(ro_cursor, text, document_id)
+            terms.extend(annotations)
+
+        frags = suggestions.tokenize_text(content, content_type, ngrams=3)
+        index = FragmentIndex(frags)
+        for search_term in terms:
+            key, vals = suggestions.search_with_term(index, search_term)
+            assert (key, vals) == search_all_pairs(frags, search_term)
+            matches += len(vals)
+
+    assert matches > 0
+
+
+def _place_suggestions(cursor, place_id):
+    return cursor.all("SELECT * FROM annotation_suggestion WHERE document_id = 4 AND type = 'place' AND entity_id = %s ORDER BY id;", (place_id,))
+
+
+def test_incremental_refresh(cursor):
+    '''check that a refresh only replaces the suggestions of entities whose search terms changed'''
+    from damast.annotator import suggestions
+
+    document = cursor.one('SELECT * FROM document WHERE id = 4;')
+    first, second = cursor.all('SELECT id FROM place ORDER BY id LIMIT 2;')
+
+    cursor.execute("UPDATE place SET name = 'Foo' WHERE id = %s;", (first,))
+    suggestions._refresh_for_document(cursor, document)
+    first_suggestions = _place_suggestions(cursor, first)
+    assert len(first_suggestions) > 0
+    states = dict(cursor.all('SELECT entity_id, fingerprint FROM annotation_suggestion_entity_state WHERE document_id = 4 AND type = %s;', ('place',)))
+
+    # the suggestions of the other entities are kept as they are
+    cursor.execute("UPDATE place SET name = 'bar' WHERE id = %s;", (second,))
+    suggestions._refresh_for_document(cursor, document)
+    assert _place_suggestions(cursor, first) == first_suggestions
+    assert len(_place_suggestions(cursor, second)) > 0
+
+    new_states = dict(cursor.all('SELECT entity_id, fingerprint FROM annotation_suggestion_entity_state WHERE document_id = 4 AND type = %s;', ('place',)))
+    assert new_states[first] == states[first]
+    assert new_states[second] != states[second]
+    assert { k: v for k, v in new_states.items() if k != second } == { k: v for k, v in states.items() if k != second }
+
+    # the suggestions of changed entities are replaced
+    second_suggestions = _place_suggestions(cursor, second)
+    cursor.execute("UPDATE place SET name = 'Xyzzy' WHERE id = %s;", (first,))
+    suggestions._refresh_for_document(cursor, document)
+    assert _place_suggestions(cursor, first) == []
+    assert _place_suggestions(cursor, second) == second_suggestions
+
+    # nothing changed
+    suggestions._refresh_for_document(cursor, document)
+    assert _place_suggestions(cursor, second) == second_suggestions
+
+
+def test_document_index_stored(cursor):
+    '''check that the refresh stores the index of a document, and uses it'''
+    from damast.annotator import suggestions
+    from damast.document_index import DocumentIndex, load_document_index
+
+    document = cursor.one('SELECT * FROM document WHERE id = 4;')
+    cursor.execute('DELETE FROM document_index WHERE document_id = 4;')
+    cursor.execute('DELETE FROM annotation_suggestion_document_state WHERE document_id = 4;')
+
+    suggestions._refresh_for_document(cursor, document)
+    index = load_document_index(cursor, document.id, document.version)
+    assert index == DocumentIndex.build(bytes(document.content).decode('utf-8'), document.content_type)
+    assert load_document_index(cursor, document.id, document.version + 1) is None
+
+    first_suggestions = cursor.all('SELECT span, type, entity_id FROM annotation_suggestion WHERE document_id = 4 ORDER BY id;')
+    cursor.execute('DELETE FROM annotation_suggestion_document_state WHERE document_id = 4;')
+    cursor.execute('DELETE FROM annotation_suggestion_entity_state WHERE document_id = 4;')
+    suggestions._refresh_for_document(cursor, document)
+    assert cursor.all('SELECT span, type, entity_id FROM annotation_suggestion WHERE document_id = 4 ORDER BY id;') == first_suggestions
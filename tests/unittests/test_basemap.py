@@ -0,0 +1,48 @@
+from damast.reporting.basemap import build_basemap, load_basemap, save_basemap, basemap_features, select_level
+from shapely.geometry import Polygon, LineString, box
+from shapely.ops import unary_union
+import geopandas as gpd
+import pytest
+
+
+# a lake with an island
+_lake = Polygon([(30, 25), (60, 25), (60, 45), (30, 45)], [[(40, 30), (50, 30), (50, 40), (40, 40)]])
+
+
+@pytest.fixture(scope='module')
+def basemap(tmp_path_factory):
+    features = gpd.GeoSeries([ _lake, LineString([(20, 20), (70, 50)]) ], crs='EPSG:4326')
+
+    path = tmp_path_factory.mktemp('basemap') / 'basemap.pickle.gz'
+    save_basemap(build_basemap(features), path)
+    return load_basemap(path)
+
+
+_extents = [
+    (3000000, 3000000, 5000000, 5000000),
+    (4000000, 3500000, 6500000, 5000000),
+    (-20000000, -20000000, 20000000, 20000000),
+    ]
+
+@pytest.mark.parametrize('extent', _extents)
+def test_features_in_extent(basemap, extent):
+    features = basemap_features(basemap, extent)
+    bbox = box(*extent)
+
+    for name in ('water', 'coast', 'rivers'):
+        assert len(features[name]) > 0
+        for geom in features[name]:
+            assert bbox.buffer(1).contains(geom)
+
+    # tiles are split without gaps
+    water = unary_union(features['water'])
+    level = select_level(basemap, extent)
+    lake = gpd.GeoSeries([_lake], crs='EPSG:4326').to_crs(epsg=3857)[0]
+    assert water.symmetric_difference(lake.intersection(bbox)).area < level.tolerance * bbox.length
+
+
+def test_level_selection(basemap):
+    tolerances = [ select_level(basemap, (0, 0, width, width)).tolerance for width in (1000000, 3000000, 10000000, 40000000) ]
+    assert tolerances == sorted(tolerances)
+    assert tolerances[0] == basemap[0].tolerance
+    assert tolerances[-1] == basemap[-1].tolerance
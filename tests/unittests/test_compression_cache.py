@@ -0,0 +1,57 @@
+from damast.response_compression import CompressionCache
+import brotli
+import gzip
+import json
+import pytest
+
+
+def _body(i, size=20000):
+    return json.dumps([ dict(id=i, value=j) for j in range(size // 20) ]).encode('utf-8')
+
+
+@pytest.mark.parametrize('encoding,decompress', [('br', brotli.decompress), ('gzip', gzip.decompress)])
+def test_cached_after_second_request(encoding, decompress):
+    cache = CompressionCache(maxsize=10**6)
+    body = _body(0)
+
+    first = cache.compress(body, encoding)
+    second = cache.compress(body, encoding)
+    third = cache.compress(body, encoding)
+
+    for compressed in (first, second, third):
+        assert decompress(compressed) == body
+
+    # compressed better once, then served from the cache
+    assert len(second) <= len(first)
+    assert third is second
+    assert cache.stats() == dict(entries=1, size=len(second), maxsize=10**6, hits=1, misses=2)
+
+
+def test_small_and_disabled():
+    cache = CompressionCache(maxsize=10**6)
+    for _ in range(3):
+        cache.compress(b'{}', 'br')
+    assert cache.stats()['entries'] == 0
+
+    disabled = CompressionCache(maxsize=0)
+    for _ in range(3):
+        disabled.compress(_body(0), 'br')
+    assert disabled.stats()['entries'] == 0
+
+
+def test_lru_eviction():
+    bodies = [ _body(i) for i in range(4) ]
+    size = len(brotli.compress(bodies[0], quality=9))
+    cache = CompressionCache(maxsize=int(2.5 * size))
+
+    for body in bodies[:3]:
+        cache.compress(body, 'br')
+        cache.compress(body, 'br')
+    assert cache.stats()['entries'] == 2
+
+    # the least-recently used body was evicted
+    cache.compress(bodies[0], 'br')
+    assert cache.stats()['hits'] == 0
+
+    cache.compress(bodies[2], 'br')
+    assert cache.stats()['hits'] == 1
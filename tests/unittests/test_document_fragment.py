@@ -1,5 +1,6 @@
-from damast.document_fragment import extract_fragment
+from damast.document_fragment import extract_fragment, OffsetIndex, OffsetIndexCache
 from functools import namedtuple
+import random
 import pytest
 import html5lib
 from xml.dom.minidom import Text
@@ -60,3 +61,90 @@ def test(testcase):
 
     assert expected == testcase.expected
     assert text == testcase.expected, (out, testcase.expected)
+
+
+_words = [ 'Nisibis', 'Edessa', 'ܢܨܝܒܝܢ', 'Ḥdayab', ' ', '\n  ', '&amp;', '&lt;', '<', '>', '&', '"', '&nbsp;', '\xa0' ]
+_tags = [ 'p', 'b', 'i', 'em', 'span', 'div', 'h2', 'a', 'table', 'tr', 'td', 'ul', 'li', 'svg', 'script', 'style', 'noscript', 'textarea', 'title', 'pre' ]
+_void = [ '<br>', '<hr>', '<img src="x.png" alt="a &quot;b&quot;">', '<input disabled>', '<!-- comment -->', '<!DOCTYPE html>' ]
+
+
+def _random_html(rng):
+    parts = []
+    for _ in range(rng.randint(0, 60)):
+        r = rng.random()
+        if r < 0.2:
+            tag = rng.choice(_tags)
+            attributes = rng.choice(('', ' class="foo"', " title='x y'", ' id=bar', ' data-x="1 &amp; 2"'))
+            parts.append(F'<{tag}{attributes}>')
+        elif r < 0.35:
+            parts.append(F'</{rng.choice(_tags)}>')
+        elif r < 0.42:
+            parts.append(rng.choice(_void))
+        else:
+            parts.append(rng.choice(_words))
+    return ''.join(parts)
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_offset_index(seed):
+    rng = random.Random(seed)
+    content = _random_html(rng)
+    index = OffsetIndex.build(content)
+    if index is None:
+        return
+
+    length = len(inner_text(html5lib.parse(content, treebuilder='dom')))
+    for _ in range(20):
+        start = rng.randint(0, length)
+        end = rng.randint(start, length + 1)
+        assert index.extract(start, end) == extract_fragment(content, start, end).encode('utf-8'), (content, start, end)
+
+
+def test_offset_index_complex_document():
+    index = OffsetIndex.build(_complex_document)
+    for i in range(len(alltext) + 1):
+        for j in range(i, len(alltext) + 1):
+            assert index.extract(i, j) == extract_fragment(_complex_document, i, j).encode('utf-8')
+
+
+def test_offset_index_bytes():
+    content = ('<html><head><meta charset="utf-8"></head><body>' + _complex_document + '<p>ܢܨܝܒܝܢ &amp; Ḥdayab</p></body></html>').encode('utf-8')
+    index = OffsetIndex.build(content)
+    length = len(inner_text(html5lib.parse(content, treebuilder='dom')))
+    for i in range(0, length, 7):
+        for j in range(i, length + 1, 5):
+            assert index.extract(i, j) == extract_fragment(content, i, j).encode('utf-8')
+
+
+def test_offset_index_nested_cdata():
+    # the text after the closed `style` is escaped in the document, but not
+    # in fragments starting within it
+    content = '<p><noscript><style>x</style>a&amp;b</noscript></p>'
+    assert extract_fragment(content, 1, 4) == '<html><body><p><noscript>a&b</noscript></p></body></html>'
+    assert OffsetIndex.build(content) is None
+
+
+def test_offset_index_cache():
+    cache = OffsetIndexCache(maxsize=10**6)
+    calls = []
+
+    def content(c):
+        return lambda: calls.append(c) or c
+
+    first = cache.get((1, 1), content(_complex_document))
+    assert cache.get((1, 1), content(_complex_document)) is first
+    assert cache.get((2, 1), content('<p><noscript><style>x</style>a&amp;b</noscript></p>')) is None
+    assert cache.get((2, 1), content('')) is None
+    assert len(calls) == 2
+    assert cache.stats() == dict(entries=2, size=first.size, maxsize=10**6, hits=2, misses=2)
+
+    # the least-recently used index is evicted
+    small = OffsetIndexCache(maxsize=first.size + 10)
+    small.get((1, 1), content(_complex_document))
+    small.get((3, 1), content('<p>Hello</p>'))
+    assert small.stats()['entries'] == 1
+    assert small.get((3, 1), content('<p>Hello</p>')) is not None
+    assert small.stats()['misses'] == 2
+
+    disabled = OffsetIndexCache(maxsize=0)
+    assert disabled.get((1, 1), content(_complex_document)) is None
@@ -0,0 +1,72 @@
+from damast.document_index import DocumentIndex
+from damast.document_fragment import tokenize_html_document, tokenize_text_document, inner_text, extract_fragment
+import random
+import pytest
+
+_words = [ 'Nisibis', 'Edessa', 'Mar', 'Behnam', 'ܢܨܝܒܝܢ', 'Ḥdayab', '1234', 'a', '&amp;', '&lt;', ',', '.', ' ', '\n' ]
+_tags = [ 'p', 'b', 'i', 'span', 'div', 'h2' ]
+
+
+def _html(rng):
+    parts = []
+    open_tags = []
+    for _ in range(rng.randint(0, 80)):
+        r = rng.random()
+        if r < 0.15:
+            tag = rng.choice(_tags)
+            parts.append(F'<{tag}>')
+            open_tags.append(tag)
+        elif r < 0.3 and open_tags:
+            parts.append(F'</{open_tags.pop()}>')
+        elif r < 0.35:
+            parts.append('<br>')
+        else:
+            parts.append(rng.choice(_words))
+    parts.extend(F'</{tag}>' for tag in reversed(open_tags))
+    return ''.join(parts)
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_same_as_parsing(seed):
+    content = _html(random.Random(seed))
+    index = DocumentIndex.build(content, 'text/html;charset=UTF-8')
+    assert index.text == inner_text(content)
+    assert index.tokens() == tokenize_html_document(content)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_text_of_range(seed):
+    rng = random.Random(seed)
+    content = _html(rng)
+    index = DocumentIndex.build(content, 'text/html;charset=UTF-8')
+    for _ in range(10):
+        start = rng.randint(0, len(index.text))
+        end = rng.randint(start, len(index.text))
+        assert index.text[start:end] == inner_text(extract_fragment(content, start, end))
+
+
+def test_plain_text():
+    content = 'Nisibis <b>and</b> Edessa\nܢܨܝܒܝܢ'
+    index = DocumentIndex.build(content, 'text/plain;charset=UTF-8')
+    assert index.text == content
+    assert index.tokens() == tokenize_text_document(content)
+
+
+def test_unknown_type():
+    with pytest.raises(ValueError):
+        DocumentIndex.build('%PDF-1.4', 'application/pdf')
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_serialization(seed):
+    content = _html(random.Random(seed))
+    index = DocumentIndex.build(content, 'text/html;charset=UTF-8')
+    data = index.offsets_to_bytes()
+    assert len(data) == 8 * len(index)
+    assert DocumentIndex.from_bytes(index.text, data) == index
+
+
+def test_serialization_little_endian():
+    index = DocumentIndex('a bc', [0, 2], [1, 4])
+    assert index.offsets_to_bytes() == bytes([0, 0, 0, 0, 1, 0, 0, 0, 2, 0, 0, 0, 4, 0, 0, 0])
+    assert DocumentIndex.from_bytes('', b'').tokens() == []
@@ -0,0 +1,55 @@
+from damast.postgres_rest_api.util import evidence_columns, parse_evidence
+from collections import namedtuple
+from psycopg2.extras import NumericRange
+import pytest
+
+Record = namedtuple('Record', ['tuple_id', 'place_id', 'time_span', 'religion_id', 'source_ids', 'time_confidence',
+    'location_confidence', 'place_attribution_confidence', 'source_confidences', 'interpretation_confidence', 'religion_confidence'])
+
+_records = [
+        Record(1, 10, NumericRange(800, 1201, '[)'), 4, [12], 'certain', None, 'probable', ['certain'], None, 'certain'),
+        Record(2, 10, None, 5, None, None, None, None, None, 'contested', None),
+        Record(3, 11, NumericRange(None, 700, '(]'), 4, [12, 13], 'certain', 'false', None, [None, 'uncertain'], None, 'certain'),
+        Record(4, 12, NumericRange(650, None, '(]'), 6, [], 'probable', None, 'probable', [], None, None),
+        ]
+
+
+def _decode(columns, i):
+    '''
+    Reference decoder of the row `i`, like the visualization does it.
+    '''
+    def value(column):
+        if isinstance(column, list):
+            return column[i]
+        if 'codes' in column:
+            return column['dictionary'][column['codes'][i]]
+
+        lengths = column['lengths']
+        if lengths[i] == -1:
+            return None
+        offset = sum(l for l in lengths[:i] if l > 0)
+        values = column['values']
+        if isinstance(values, dict):
+            values = [ values['dictionary'][c] for c in values['codes'] ]
+        return values[offset:offset+lengths[i]]
+
+    row = { k: value(v) for k, v in columns.items() if k != 'time_span' }
+    row['time_span'] = dict(start=columns['time_span']['start'][i], end=columns['time_span']['end'][i])
+    return row
+
+
+@pytest.mark.parametrize('count', [0, 1, len(_records)])
+def test_same_as_rows(count):
+    records = _records[:count]
+    columns = evidence_columns(records)
+
+    assert len(columns['tuple_id']) == count
+    assert [ _decode(columns, i) for i in range(count) ] == list(map(parse_evidence, records))
+
+
+def test_dictionary_encoding():
+    columns = evidence_columns(_records)
+
+    assert columns['religion_confidence'] == dict(dictionary=['certain', None], codes=[0, 1, 0, 1])
+    assert columns['source_ids'] == dict(lengths=[1, -1, 2, 0], values=[12, 12, 13])
+    assert columns['time_span'] == dict(start=[800, None, None, 651], end=[1200, None, 700, None])
@@ -0,0 +1,143 @@
+from damast.annotator.fragment_index import FragmentIndex, _partition
+from collections import namedtuple
+from Levenshtein import ratio
+from suggestions_reference import search_all_pairs
+import importlib
+import random
+import pytest
+
+TextFragment = namedtuple('TextFragment', ['text', 'start', 'end'])
+
+_alphabet = 'aabcdeé ܐ'
+
+
+def _mutate(rng, text, edits):
+    chars = list(text)
+    for _ in range(edits):
+        position = rng.randint(0, len(chars))
+        if rng.random() < 0.5 and chars:
+            chars.pop(min(position, len(chars) - 1))
+        elif rng.random() < 0.5 and chars:
+            chars[min(position, len(chars) - 1)] = rng.choice(_alphabet)
+        else:
+            chars.insert(position, rng.choice(_alphabet))
+    return ''.join(chars)
+
+
+@pytest.mark.parametrize('length', range(0, 60))
+def test_partition(length):
+    pieces = _partition(length)
+    assert sum(size for _, size in pieces) == length
+    assert all(offset + size == next_offset for (offset, size), (next_offset, _) in zip(pieces, pieces[1:]))
+    assert max(size for _, size in pieces) - min(size for _, size in pieces) <= 1
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_same_as_all_pairs(seed):
+    rng = random.Random(seed)
+    texts = [ ''.join(rng.choice(_alphabet) for _ in range(rng.randint(0, 40))) for _ in range(200) ]
+    index = FragmentIndex([ TextFragment(t, i, i + len(t)) for i, t in enumerate(texts) ])
+
+    for _ in range(50):
+        term = _mutate(rng, rng.choice(texts), rng.randint(0, 5))
+        expected = { i for i, text in enumerate(index.texts) if ratio(text, term) >= 0.9 }
+        found = { i for i in index.candidates(term) if ratio(index.texts[i], term) >= 0.9 }
+        assert found == expected, term
+
+
+def test_distinct_texts():
+    fragments = [ TextFragment(t, i, i) for i, t in enumerate(['Nisibis', 'Edessa', 'Nisibis', 'Nisibis']) ]
+    index = FragmentIndex(fragments)
+    assert index.texts == ['Nisibis', 'Edessa']
+    assert index.occurrences == [[0, 2, 3], [1]]
+    assert index.candidates('Nisibin') == {0}
+
+
+@pytest.fixture
+def suggestions(monkeypatch):
+    monkeypatch.setenv('PGPASSWORD', 'docker')
+    return importlib.import_module('damast.annotator.suggestions')
+
+
+def test_search_with_term(suggestions):
+    rng = random.Random(0)
+    names = [ 'Nisibis', 'Edessa', 'Mar Behnam', 'Ḥdayab', 'Ṭur ʿAbdin', 'Beth Garmai', 'Karka d-Beth Slokh', 'ܢܨܝܒܝܢ' ]
+    words = [ _mutate(rng, rng.choice(names), rng.choice((0, 0, 1, 2))) for _ in range(300) ]
+    document = '<p>' + ' and '.join(words) + '</p>'
+
+    frags = suggestions.tokenize_text(document, 'text/html', ngrams=3)
+    index = FragmentIndex(frags)
+    search_terms = [ suggestions.SearchTerm([name, name.upper()], 'Place', 'name', suggestions.Place(i, name)) for i, name in enumerate(names) ]
+
+    for search_term in search_terms:
+        assert suggestions.search_with_term(index, search_term) == search_all_pairs(frags, search_term)
+
+
+def test_match_search_terms(suggestions):
+    rng = random.Random(1)
+    names = [ 'Nisibis', 'Edessa', 'Mar Behnam', 'Ḥdayab', 'Ṭur ʿAbdin', 'Beth Garmai' ]
+    words = [ _mutate(rng, rng.choice(names), rng.choice((0, 0, 1, 2))) for _ in range(300) ]
+    frags = suggestions.tokenize_text('<p>' + ' and '.join(words) + '</p>', 'text/html', ngrams=3)
+    search_terms = [ suggestions.SearchTerm([name], 'Place', 'name', suggestions.Place(i % 4, name)) for i, name in enumerate(names) ]
+
+    expected = dict()
+    for search_term in search_terms:
+        key, vals = search_all_pairs(frags, search_term)
+        if len(vals) > 0:
+            expected.setdefault(key, []).extend(vals)
+
+    assert suggestions.match_search_terms(frags, search_terms, batch_size=4) == expected
+    assert suggestions._shared_index is None
+
+
+def test_entity_fingerprints(suggestions):
+    Place, SearchTerm = suggestions.Place, suggestions.SearchTerm
+    search_terms = [
+            SearchTerm(['Nisibis', 'Nṣibin'], 'Place', 'name', Place(1, 'Nisibis')),
+            SearchTerm(['Edessa'], 'Place', 'name', Place(2, 'Edessa')),
+            SearchTerm(['Nisibin'], 'Place', 'annotation', Place(1, 'Nisibis')),
+            ]
+    existing = { ('Place', 1): [(10, 16)] }
+    fingerprints = suggestions.entity_fingerprints('<p>Nisibin</p>', search_terms, existing)
+    assert set(fingerprints) == { ('Place', 1), ('Place', 2) }
+
+    # independent of the order of the terms
+    assert suggestions.entity_fingerprints('<p>Nisibin</p>', search_terms[::-1], existing) == fingerprints
+
+    # a changed name only changes the fingerprint of its entity
+    changed = [ search_terms[0], SearchTerm(['Urhay'], 'Place', 'name', Place(2, 'Edessa')), search_terms[2] ]
+    other = suggestions.entity_fingerprints('<p>Nisibin</p>', changed, existing)
+    assert other[('Place', 1)] == fingerprints[('Place', 1)]
+    assert other[('Place', 2)] != fingerprints[('Place', 2)]
+
+    # so do the entity's annotations
+    other = suggestions.entity_fingerprints('<p>Nisibin</p>', search_terms, { ('Place', 1): [(10, 17)] })
+    assert other[('Place', 1)] != fingerprints[('Place', 1)]
+    assert other[('Place', 2)] == fingerprints[('Place', 2)]
+
+    # the document content changes all fingerprints
+    other = suggestions.entity_fingerprints('<p>Nisibin.</p>', search_terms, existing)
+    assert all(other[key] != fingerprints[key] for key in fingerprints)
+
+
+def test_changed_entities(suggestions):
+    stored = { ('Place', 1): 'a', ('Place', 2): 'b', ('Person', 1): 'c' }
+    fingerprints = { ('Place', 1): 'a', ('Place', 2): 'x', ('Religion', 3): 'd' }
+
+    changed, removed = suggestions.changed_entities(fingerprints, stored)
+    assert changed == { ('Place', 2), ('Religion', 3) }
+    assert removed == { ('Person', 1) }
+
+
+def test_text_fragments(suggestions):
+    tokens = [ ('Mar', 0, 3), ('Behnam', 4, 10), ('and', 11, 14), ('Nisibis', 20, 27) ]
+    frags = suggestions.text_fragments(tokens, ngrams=3)
+    assert frags == [
+            *(suggestions.TextFragment(*t) for t in tokens),
+            suggestions.TextFragment('Mar Behnam', 0, 10),
+            suggestions.TextFragment('Behnam and', 4, 14),
+            suggestions.TextFragment('and Nisibis', 11, 27),
+            suggestions.TextFragment('Mar Behnam and', 0, 14),
+            suggestions.TextFragment('Behnam and Nisibis', 4, 27),
+            ]
+    assert suggestions.text_fragments(tokens[:1], ngrams=3) == [ suggestions.TextFragment('Mar', 0, 3) ]
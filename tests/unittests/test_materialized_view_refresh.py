@@ -0,0 +1,102 @@
+from damast.postgres_database import refresh_materialized_view, get_refresh_status, _refreshed
+from types import SimpleNamespace
+from datetime import datetime, timezone
+import pytest
+
+
+class _Cursor:
+    '''
+    Stand-in for a database with the materialized view `overview`.
+    '''
+    def __init__(self, tracked, unique_index=True):
+        self.data_version = 1
+        self.ispopulated = False
+        self.unique_index = unique_index
+        self.tracked = tracked
+        self.refresh = None
+        self.executed = []
+
+    def one(self, query, params=None):
+        if 'pg_matviews' in query:
+            return SimpleNamespace(ispopulated=self.ispopulated, unique_index=self.unique_index)
+        if "to_regclass('public.data_version')" in query:
+            return 'data_version' if self.data_version is not None else None
+        if "to_regclass('public.materialized_view_refresh')" in query:
+            return 'materialized_view_refresh' if self.tracked else None
+        if 'FROM data_version' in query:
+            return self.data_version
+        if 'SELECT data_version FROM materialized_view_refresh' in query:
+            return None if self.refresh is None else self.refresh['version']
+        if 'staleness' in query:
+            if self.refresh is None:
+                return None
+            return SimpleNamespace(refreshed=datetime(2024, 1, 1, tzinfo=timezone.utc), duration=self.refresh['duration'],
+                    staleness=0 if self.refresh['version'] == self.data_version else 60)
+        raise AssertionError(query)
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+        if query.startswith('REFRESH'):
+            self.ispopulated = True
+        elif 'INSERT INTO materialized_view_refresh' in query:
+            self.refresh = params
+
+
+@pytest.fixture(autouse=True)
+def clear_refreshes():
+    _refreshed.clear()
+
+
+def _refreshes(cursor):
+    return [ q for q in cursor.executed if q.startswith('REFRESH') ]
+
+
+@pytest.mark.parametrize('tracked', [True, False])
+def test_refresh_if_changed(tracked):
+    c = _Cursor(tracked)
+
+    assert refresh_materialized_view(c, 'overview') is not None
+    assert refresh_materialized_view(c, 'overview') is None
+
+    c.data_version = 2
+    assert refresh_materialized_view(c, 'overview') is not None
+    assert refresh_materialized_view(c, 'overview') is None
+
+    # only populated views can be refreshed concurrently
+    assert _refreshes(c) == [ 'REFRESH MATERIALIZED VIEW overview;', 'REFRESH MATERIALIZED VIEW CONCURRENTLY overview;' ]
+
+
+def test_without_unique_index():
+    c = _Cursor(True, unique_index=False)
+    refresh_materialized_view(c, 'overview')
+    c.data_version = 2
+    refresh_materialized_view(c, 'overview')
+    assert _refreshes(c) == [ 'REFRESH MATERIALIZED VIEW overview;' ] * 2
+
+
+def test_without_data_version(monkeypatch):
+    c = _Cursor(True)
+    c.data_version = None
+
+    refresh_materialized_view(c, 'overview')
+    assert refresh_materialized_view(c, 'overview') is None
+
+    monkeypatch.setattr('damast.postgres_database._fallback_refresh_interval', 0)
+    assert refresh_materialized_view(c, 'overview') is not None
+    assert c.refresh is None
+
+
+def test_status():
+    c = _Cursor(True)
+    assert get_refresh_status(c, 'overview') is None
+
+    refresh_materialized_view(c, 'overview')
+    status = get_refresh_status(c, 'overview')
+    assert status['staleness'] == 0
+    assert status['duration'] >= 0
+    assert status['refreshed'].startswith('2024-01-01')
+
+    c.data_version = 2
+    assert get_refresh_status(c, 'overview')['staleness'] > 0
+
+    assert get_refresh_status(_Cursor(False), 'overview') is None
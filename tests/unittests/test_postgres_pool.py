@@ -0,0 +1,72 @@
+from damast import postgres_database as pgdb
+from damast.postgres_database import InstrumentedConnectionPool, postgres_url
+from psycopg2.extensions import parse_dsn
+from psycopg2_pool import PoolError
+from types import SimpleNamespace
+import threading
+import time
+import pytest
+
+
+@pytest.fixture
+def pool(pg_server):
+    pool = InstrumentedConnectionPool(minconn=1, maxconn=2)
+    pool.wait_timeout = 0.5
+    return pool
+
+
+def test_stats(pool):
+    a = pool.getconn()
+    b = pool.getconn()
+    stats = pool.stats()
+    assert stats['in_use'] == 2
+    assert stats['idle'] == 0
+    assert stats['checkouts'] == 2
+    assert stats['waits'] == 0
+
+    pool.putconn(a)
+    pool.putconn(b)
+    stats = pool.stats()
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 2
+
+
+def test_wait_for_returned_connection(pool):
+    # the pool only holds weak references to the connections in use
+    a, b = pool.getconn(), pool.getconn()
+
+    returner = threading.Timer(0.1, pool.putconn, (a,))
+    returner.start()
+    assert pool.getconn() is a
+    returner.join()
+
+    stats = pool.stats()
+    assert stats['checkouts'] == 3
+    assert stats['waits'] == 1
+    assert 0.05 < stats['max_wait_time'] <= stats['wait_time'] < 0.5
+    assert stats['timeouts'] == 0
+
+
+def test_wait_timeout(pool):
+    connections = [ pool.getconn(), pool.getconn() ]
+
+    t0 = time.perf_counter()
+    with pytest.raises(PoolError):
+        pool.getconn()
+    assert time.perf_counter() - t0 >= 0.5
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_url_parameters(monkeypatch):
+    monkeypatch.setattr(pgdb, 'get_config', lambda: SimpleNamespace(pguser='api', pghost='db', pgport=5432,
+        environment='PRODUCTION', pgpassword='p@ss/word'))
+
+    dsn = parse_dsn(postgres_url('damast-report', 2.5))
+    assert dsn['application_name'] == 'damast-report'
+    assert dsn['options'] == '-c statement_timeout=2500'
+    assert dsn['password'] == 'p@ss/word'
+    assert dsn['dbname'] == 'ocn'
+
+    dsn = parse_dsn(postgres_url())
+    assert dsn['application_name'] == 'damast'
+    assert 'options' not in dsn
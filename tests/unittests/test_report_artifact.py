@@ -0,0 +1,101 @@
+from damast.reporting.report_database import get_report_database, open_report_artifact, set_report_artifacts, _database_schema
+import gzip
+import os
+import sqlite3
+import pytest
+
+
+def _insert_report(db, uuid):
+    db.execute('''INSERT INTO reports (uuid, user, started, last_access, server_version, report_state)
+        VALUES (:uuid, 'alice', '2024-01-01T00:00:00+00:00', '2024-01-01T00:00:00+00:00', 'test', 'completed');''', dict(uuid=uuid))
+
+
+@pytest.fixture
+def report_db(report_file):
+    # larger than one chunk, and not compressible
+    pdf = gzip.compress(os.urandom(200000))
+    with get_report_database() as db:
+        _insert_report(db, 'a')
+        set_report_artifacts(db, 'a', content=gzip.compress(b'<p>report</p>'), pdf_report=pdf)
+
+    return pdf
+
+
+def _artifact_count(db):
+    db.execute('SELECT count(*) FROM report_artifact;')
+    return db.fetchone()[0]
+
+
+def test_read_artifact(report_db):
+    artifact = open_report_artifact('a', 'pdf_report')
+    assert artifact.size == len(report_db)
+
+    chunks = list(artifact)
+    assert len(chunks) > 1
+    assert b''.join(chunks) == report_db
+
+    content = open_report_artifact('a', 'content')
+    assert gzip.decompress(b''.join(content)) == b'<p>report</p>'
+
+
+def test_missing_artifact(report_db):
+    assert open_report_artifact('a', 'pdf_map') is None
+    assert open_report_artifact('b', 'pdf_report') is None
+
+    with pytest.raises(ValueError):
+        open_report_artifact('a', 'filter')
+
+
+def test_close_unread_artifact(report_db):
+    artifact = open_report_artifact('a', 'pdf_report')
+    artifact.close()
+
+    # the connection is closed, so the report can be changed
+    with get_report_database() as db:
+        set_report_artifacts(db, 'a', pdf_report=None)
+    assert open_report_artifact('a', 'pdf_report') is None
+
+
+def test_deduplication(report_db):
+    with get_report_database() as db:
+        _insert_report(db, 'b')
+        assert set_report_artifacts(db, 'b', content=gzip.compress(b'<p>other</p>'), pdf_report=report_db) == 0
+        assert _artifact_count(db) == 3
+
+        db.execute('SELECT pdf_report_hash, pdf_report_size FROM reports;')
+        (hash_a, size_a), (hash_b, size_b) = db.fetchall()
+        assert hash_a == hash_b
+        assert size_a == size_b == len(report_db)
+
+        # the shared PDF is kept until no report refers to it anymore
+        freed = set_report_artifacts(db, 'a', content=None, pdf_map=None, pdf_report=None)
+        assert freed == len(gzip.compress(b'<p>report</p>'))
+        assert _artifact_count(db) == 2
+
+    assert b''.join(open_report_artifact('b', 'pdf_report')) == report_db
+
+    with get_report_database() as db:
+        assert set_report_artifacts(db, 'b', pdf_report=None) == len(report_db)
+        assert _artifact_count(db) == 1
+
+
+def test_migration(report_file):
+    pdf = gzip.compress(b'%PDF')
+
+    con = sqlite3.connect(report_file)
+    con.executescript(_database_schema)
+    for uuid in ('a', 'b'):
+        con.execute('''INSERT INTO reports (uuid, user, started, last_access, server_version, report_state, content, pdf_map)
+            VALUES (:uuid, 'alice', '2024-01-01T00:00:00+00:00', '2024-01-01T00:00:00+00:00', 'test', 'completed', :content, :pdf);''',
+            dict(uuid=uuid, content=gzip.compress(uuid.encode('utf-8')), pdf=pdf))
+    con.commit()
+    con.close()
+
+    with get_report_database() as db:
+        assert _artifact_count(db) == 3
+        db.execute('SELECT content, pdf_map, pdf_report, content_size, pdf_map_size, pdf_report_hash FROM reports;')
+        for row in db.fetchall():
+            assert row == (None, None, None, len(gzip.compress(b'a')), len(pdf), None)
+
+    assert gzip.decompress(b''.join(open_report_artifact('b', 'content'))) == b'b'
+    assert b''.join(open_report_artifact('a', 'pdf_map')) == pdf
@@ -0,0 +1,65 @@
+from damast.reporting.report_data_cache import filter_hash, _serialize, _deserialize
+from damast.reporting.datatypes import Evidence
+from functools import namedtuple
+from psycopg2.extras import NumericRange
+import pytest
+
+
+def _filters(**kwargs):
+    f = dict(
+        religion=True,
+        confidence=dict(
+            religion_confidence=[None, 'certain', 'probable'],
+            location_confidence=[None, 'certain'],
+            place_attribution_confidence=[None],
+            time_confidence=[None],
+            source_confidences=[None],
+            interpretation_confidence=[None],
+            ),
+        tags=True,
+        time=None,
+        sources=None,
+        location=None,
+        places=None,
+        )
+    f.update(kwargs)
+    return f
+
+
+_equivalent = [
+    (_filters(), _filters()),
+    (_filters(sources=[1, 2, 3]), _filters(sources=[3, 1, 2])),
+    (_filters(tags=[4, 2]), _filters(tags=[2, 4])),
+    (_filters(religion=dict(type='simple', filter=[1, 5])), _filters(religion=dict(type='simple', filter=[5, 1]))),
+    (_filters(religion=dict(type='complex', filter=[[1, 5], [2]])), _filters(religion=dict(type='complex', filter=[[2], [5, 1]]))),
+    ]
+
+_different = [
+    (_filters(), _filters(sources=[])),
+    (_filters(time=[600, 700]), _filters(time=[700, 600])),
+    (_filters(tags=1), _filters(tags=[1])),
+    (_filters(religion=dict(type='complex', filter=[[1, 5]])), _filters(religion=dict(type='complex', filter=[[1], [5]]))),
+    ]
+
+
+@pytest.mark.parametrize('a,b', _equivalent)
+def test_equivalent_filters(a, b):
+    assert filter_hash(a) == filter_hash(b)
+
+
+@pytest.mark.parametrize('a,b', _different)
+def test_different_filters(a, b):
+    assert filter_hash(a) != filter_hash(b)
+
+
+def test_serialize_cursor_records():
+    # named tuples as created by the database cursor cannot be pickled by name
+    Record = namedtuple('Record', ['id', 'span'])
+    Record.__qualname__ = 'DoesNotExist'
+
+    data = dict(evidences=[Evidence(Record(1, NumericRange(600, 700, '[]')), [Record(2, None)])])
+    restored = _deserialize(_serialize(data))
+
+    assert restored == data
+    assert restored['evidences'][0].evidence.span == NumericRange(600, 700, '[]')
+    assert restored['evidences'][0].source_instances[0]._asdict() == dict(id=2, span=None)
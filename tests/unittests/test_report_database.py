@@ -0,0 +1,59 @@
+from damast.reporting.report_database import get_report_database, update_report_access, flush_report_access
+import pytest
+
+
+@pytest.fixture
+def report_db(report_file):
+    with get_report_database() as db:
+        for uuid in ('a', 'b'):
+            db.execute('''INSERT INTO reports (uuid, user, started, last_access, server_version, report_state, access_count)
+                VALUES (:uuid, 'alice', '2024-01-01T00:00:00+00:00', '2024-01-01T00:00:00+00:00', 'test', 'completed', 3);''', dict(uuid=uuid))
+
+
+def _access(uuid):
+    with get_report_database() as db:
+        db.execute('SELECT access_count, last_access FROM reports WHERE uuid = ?;', (uuid,))
+        return db.fetchone()
+
+
+def test_connection_pool(report_db):
+    with get_report_database() as db:
+        con = db.connection
+        db.execute('PRAGMA journal_mode;')
+        assert db.fetchone() == ('wal',)
+
+    with get_report_database() as db:
+        assert db.connection is con
+
+        # a nested use gets another connection
+        with get_report_database() as nested:
+            assert nested.connection is not con
+
+
+def test_rollback(report_db):
+    with pytest.raises(RuntimeError):
+        with get_report_database() as db:
+            db.execute('''UPDATE reports SET report_state = 'failed';''')
+            raise RuntimeError()
+
+    with get_report_database() as db:
+        db.execute('''SELECT count(*) FROM reports WHERE report_state = 'failed';''')
+        assert db.fetchone() == (0,)
+
+
+def test_coalesced_access(report_db):
+    for _ in range(5):
+        update_report_access('a')
+    update_report_access('b')
+
+    # written in batches only
+    assert _access('a')[0] == 3
+
+    flush_report_access()
+    count, last_access = _access('a')
+    assert count == 8
+    assert last_access.year > 2024
+    assert _access('b')[0] == 4
+
+    flush_report_access()
+    assert _access('a')[0] == 8
@@ -0,0 +1,87 @@
+from damast.reporting.report_database import get_report_database, set_report_artifacts, evict_reports
+from damast.reporting.check_evict import plan_eviction, check_for_evictable
+from datetime import date, timedelta
+import random
+import pytest
+
+
+_today = date(2024, 6, 30)
+
+
+@pytest.fixture
+def report_db(report_file):
+    rng = random.Random(0)
+    reports = []
+    with get_report_database() as db:
+        for i in range(50):
+            uuid = F'report-{i:02d}'
+            last_access = _today - timedelta(days=rng.randrange(60))
+            state = rng.choice(('completed', 'completed', 'completed', 'failed', 'evicted'))
+            db.execute('''INSERT INTO reports (uuid, user, started, last_access, server_version, report_state)
+                VALUES (:uuid, 'alice', '2024-01-01T00:00:00+00:00', :last_access, 'test', :state);''',
+                dict(uuid=uuid, last_access=F'{last_access.isoformat()}T12:00:00+02:00', state=state))
+
+            if state != 'evicted':
+                content = rng.randbytes(rng.randrange(100, 1000))
+                pdf_map = rng.randbytes(rng.randrange(100, 1000)) if state == 'completed' else None
+                set_report_artifacts(db, uuid, content=content, pdf_map=pdf_map)
+                reports.append((uuid, last_access, len(content) + (0 if pdf_map is None else len(pdf_map))))
+
+    return sorted(reports, key=lambda r: (r[1], r[0]))
+
+
+def _reference_plan(reports, deferral, maxsize):
+    deferred = [ uuid for uuid, last_access, _ in reports if deferral is not None and (_today - last_access).days > deferral ]
+    candidates = [ (uuid, size) for uuid, _, size in reports if uuid not in deferred ]
+    exceed = sum(size for _, size in candidates) - maxsize
+
+    evicted = []
+    removed = 0
+    for uuid, size in candidates:
+        if exceed - removed <= 0:
+            break
+        removed += size
+        evicted.append(uuid)
+
+    return deferred, evicted, removed
+
+
+@pytest.mark.parametrize('deferral,maxsize', [
+    (30, 0),
+    (30, 5000),
+    (None, 10000),
+    (45, 10**9),
+    (None, 10**9),
+    ])
+def test_plan_eviction(report_db, deferral, maxsize):
+    with get_report_database() as db:
+        deferred, evicted, removed = plan_eviction(db, deferral, maxsize, _today)
+
+    expected_deferred, expected_evicted, expected_removed = _reference_plan(report_db, deferral, maxsize)
+    assert sorted(deferred) == sorted(expected_deferred)
+    assert evicted == expected_evicted
+    assert removed == expected_removed
+
+
+def test_plan_deferral_only(report_db):
+    with get_report_database() as db:
+        deferred, evicted, removed = plan_eviction(db, 30, None, _today)
+
+    assert sorted(deferred) == sorted(_reference_plan(report_db, 30, 0)[0])
+    assert evicted == []
+    assert removed == 0
+
+
+def test_check_for_evictable(report_db, monkeypatch):
+    monkeypatch.setenv('DAMAST_REPORT_EVICTION_MAXSIZE', '0')
+    check_for_evictable()
+
+    with get_report_database() as db:
+        db.execute('''SELECT count(*) FROM reports WHERE report_state <> 'evicted';''')
+        assert db.fetchone() == (0,)
+        db.execute('SELECT count(*) FROM report_artifact;')
+        assert db.fetchone() == (0,)
+        db.execute('PRAGMA auto_vacuum;')
+        assert db.fetchone() == (2,)
+        db.execute('PRAGMA freelist_count;')
+        assert db.fetchone() == (0,)
@@ -0,0 +1,107 @@
+from damast.reporting.report_database import estimate_completion, get_queue_status, get_report_database, _check_admission, _find_pending_report, ReportQueueFull
+from datetime import datetime, timedelta
+import pytest
+
+
+@pytest.mark.parametrize('position,runtimes,workers,mean,expected', [
+    (1, [], 2, 10.0, 10.0),                 # idle worker
+    (1, [4.0, 8.0], 2, 10.0, 12.0),         # starts when the older job is done
+    (2, [4.0, 8.0], 2, 10.0, 16.0),         # starts when the second job is done
+    (3, [4.0, 8.0], 2, 10.0, 22.0),
+    (3, [4.0], 1, 10.0, 36.0),
+    (1, [30.0, 30.0], 2, 10.0, 10.0),       # running longer than the mean
+    (2, [], 0, 10.0, 20.0),                 # at least one worker
+    ])
+def test_estimate_completion(position, runtimes, workers, mean, expected):
+    assert estimate_completion(position, runtimes, workers, mean) == pytest.approx(expected)
+
+
+@pytest.fixture
+def report_db(report_file, monkeypatch):
+    monkeypatch.setenv('DAMAST_REPORT_WORKERS', '1')
+    monkeypatch.setenv('DAMAST_REPORT_QUEUE_MAXSIZE', '2')
+
+    now = datetime.now().replace(microsecond=0).astimezone()
+    reports = [
+            # uuid, user, filter hash, enqueued, claimed
+            ('a', 'alice', 'h1', now - timedelta(seconds=30), now - timedelta(seconds=4)),
+            ('b', 'bob', 'h1', now - timedelta(seconds=20), None),
+            ('c', 'alice', 'h2', now - timedelta(seconds=10), None),
+            ]
+
+    with get_report_database() as db:
+        for uuid, user, filter_hash, enqueued, claimed in reports:
+            db.execute('''INSERT INTO reports (uuid, user, started, last_access, server_version)
+                VALUES (:uuid, :user, :started, :started, 'test');''', dict(uuid=uuid, user=user, started=enqueued.isoformat()))
+            db.execute('''INSERT INTO report_queue (uuid, enqueued, claimed, filter_hash, report_url, map_url)
+                VALUES (:uuid, :enqueued, :claimed, :filter_hash, '', '');''',
+                dict(uuid=uuid, enqueued=enqueued.isoformat(), claimed=None if claimed is None else claimed.isoformat(), filter_hash=filter_hash))
+
+        db.execute('''INSERT INTO report_stage_duration (uuid, stage, finished, duration)
+            VALUES ('a', 'total', :now, 10.0);''', dict(now=now.isoformat()))
+
+
+def test_queue_status(report_db):
+    running = get_queue_status('a')
+    assert running.position == 0
+    assert 5.0 < running.eta <= 6.0
+
+    first = get_queue_status('b')
+    assert first.position == 1
+    assert 15.0 < first.eta <= 16.0
+
+    second = get_queue_status('c')
+    assert second.position == 2
+    assert 25.0 < second.eta <= 26.0
+
+    assert get_queue_status('d') is None
+
+
+def test_pending_report_deduplication(report_db):
+    with get_report_database() as db:
+        assert _find_pending_report(db, 'alice', 'h1') == 'a'
+        assert _find_pending_report(db, 'alice', 'h2') == 'c'
+        assert _find_pending_report(db, 'bob', 'h1') == 'b'
+        assert _find_pending_report(db, 'bob', 'h2') is None
+
+
+def test_admission(report_db, monkeypatch):
+    with get_report_database() as db:
+        with pytest.raises(ReportQueueFull) as err:
+            _check_admission(db)
+        assert err.value.queue_depth == 2
+
+    monkeypatch.setenv('DAMAST_REPORT_QUEUE_MAXSIZE', '3')
+    with get_report_database() as db:
+        _check_admission(db)
+
+    monkeypatch.setenv('DAMAST_REPORT_QUEUE_MAXSIZE', '0')
+    with get_report_database() as db:
+        _check_admission(db)
+
+
+def test_worker_only_started_without_lock(report_db, monkeypatch):
+    from damast.reporting import report_database
+    import fcntl
+
+    started = []
+    class _Worker:
+        def __init__(self, args):
+            started.append(args)
+        def poll(self):
+            return 0  # exited, like a worker that found the lock held
+
+    monkeypatch.setattr(report_database.subprocess, 'Popen', _Worker)
+    monkeypatch.setattr(report_database, '_report_worker', None)
+
+    # another process runs the worker
+    with open(report_database.worker_lock_path(), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        for _ in range(3):
+            report_database.ensure_report_worker()
+        assert report_database.report_worker_running()
+        assert started == []
+
+    assert not report_database.report_worker_running()
+    report_database.ensure_report_worker()
+    assert len(started) == 1
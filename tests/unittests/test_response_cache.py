@@ -0,0 +1,117 @@
+from damast.postgres_rest_api.response_cache import versioned_response, clear_response_cache
+from types import SimpleNamespace
+from datetime import datetime
+import flask
+import pytest
+
+
+class _Cursor:
+    def __init__(self):
+        self.data_version = 1
+        self.filenode = 100
+        self.refreshed = None
+
+    def one(self, query, params=None):
+        if 'materialized_view_refresh' in query:
+            if 'to_regclass' in query:
+                return None if self.refreshed is None else 'materialized_view_refresh'
+            return self.refreshed
+        if 'to_regclass' in query and 'data_version' in query:
+            return 'data_version'
+        if 'relfilenode' in query:
+            return self.filenode
+        return self.data_version
+
+
+@pytest.fixture
+def client():
+    clear_response_cache()
+
+    app = flask.Flask(__name__)
+    app.version = 'test'
+    app.damast_config = SimpleNamespace(rest_cache_maxsize=1)
+    app.calls = 0
+    app.cursor = _Cursor()
+
+    @versioned_response
+    def _data(cursor):
+        app.calls += 1
+        return flask.jsonify(dict(calls=app.calls, arg=flask.request.args.get('x')))
+
+    @versioned_response(materialized_view='place_religion_overview')
+    def _view(cursor):
+        app.calls += 1
+        return flask.jsonify(dict(calls=app.calls))
+
+    @versioned_response(media_types=('application/json', 'text/csv'))
+    def _negotiated(cursor):
+        app.calls += 1
+        return flask.Response(str(app.calls), mimetype=flask.request.accept_mimetypes.best_match(('application/json', 'text/csv'), 'application/json'))
+
+    app.add_url_rule('/data', view_func=lambda: _data(app.cursor), endpoint='data')
+    app.add_url_rule('/negotiated', view_func=lambda: _negotiated(app.cursor), endpoint='negotiated')
+    app.add_url_rule('/view', view_func=lambda: _view(app.cursor), endpoint='view')
+
+    client = app.test_client()
+    client.app = app
+    return client
+
+
+def test_cached_until_data_changes(client):
+    first = client.get('/data')
+    assert first.json['calls'] == 1
+    assert client.get('/data').json['calls'] == 1
+    assert client.get('/data?x=1').json == dict(calls=2, arg='1')
+
+    client.app.cursor.data_version = 2
+    second = client.get('/data')
+    assert second.json['calls'] == 3
+    assert second.headers['ETag'] != first.headers['ETag']
+
+
+def test_revalidation(client):
+    etag = client.get('/data').headers['ETag']
+    assert etag.startswith('W/')
+
+    response = client.get('/data', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+    client.app.cursor.data_version = 2
+    assert client.get('/data', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_materialized_view(client):
+    etag = client.get('/view').headers['ETag']
+
+    # only a refresh of the view changes its data
+    client.app.cursor.data_version = 2
+    assert client.get('/view', headers={'If-None-Match': etag}).status_code == 304
+
+    client.app.cursor.filenode = 101
+    response = client.get('/view', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['calls'] == 2
+
+    # a concurrent refresh keeps the file of the view
+    etag = response.headers['ETag']
+    client.app.cursor.refreshed = datetime(2024, 1, 1, 12, 0)
+    assert client.get('/view', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_media_types(client):
+    json = client.get('/negotiated')
+    csv = client.get('/negotiated', headers={'Accept': 'text/csv'})
+    assert (json.mimetype, json.data) == ('application/json', b'1')
+    assert (csv.mimetype, csv.data) == ('text/csv', b'2')
+    assert json.headers['ETag'] != csv.headers['ETag']
+    assert 'Accept' in csv.vary
+
+    assert client.get('/negotiated', headers={'Accept': 'text/csv, application/json;q=0.5'}).data == b'2'
+    assert client.get('/negotiated', headers={'Accept': '*/*'}).data == b'1'
+
+
+def test_disabled(client):
+    client.app.damast_config.rest_cache_maxsize = 0
+    assert client.get('/data').json['calls'] == 1
+    assert client.get('/data').json['calls'] == 2
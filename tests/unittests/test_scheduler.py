@@ -0,0 +1,121 @@
+from damast import scheduler
+from conftest import FakeServer
+import psycopg2
+import pytest
+
+
+class _Server(FakeServer):
+    '''
+    Fake database server with the advisory lock and the run history.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.lock_holder = None
+        self.runs = []
+        self.history = True
+
+    def cursor(self, connection):
+        return _Cursor(connection)
+
+
+class _Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, query, params=None):
+        if self.connection.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+        server = self.connection.server
+        if 'pg_try_advisory_lock' in query:
+            # the lock is released with the connection
+            if server.lock_holder is None or server.lock_holder.closed:
+                server.lock_holder = self.connection
+            self.result = (server.lock_holder is self.connection,)
+        elif 'to_regclass' in query:
+            self.result = ('scheduler_job_run' if server.history else None,)
+        elif 'INSERT INTO scheduler_job_run' in query:
+            server.runs.append(params)
+
+    def fetchone(self):
+        return self.result
+
+
+@pytest.fixture
+def pg_server_class():
+    return _Server
+
+
+@pytest.fixture
+def server(pg_server):
+    scheduler._reset_after_fork()
+    yield pg_server
+    scheduler._reset_after_fork()
+
+
+def _process(server):
+    '''
+    Switch to the state of another process.
+    '''
+    state = (scheduler._connection, scheduler._is_leader)
+    scheduler._reset_after_fork()
+    return state
+
+
+def _switch(state):
+    scheduler._connection, scheduler._is_leader = state
+
+
+def test_runs_once(server):
+    calls = []
+    job = scheduler.leader_job('test', lambda: calls.append(1) or 'done')
+
+    assert job() == 'done'
+    first = _process(server)
+
+    # a second process does not run the job, until the leader is gone
+    assert job() is None
+    assert calls == [1]
+
+    second = _process(server)
+    _switch(first)
+    assert job() == 'done'
+    scheduler._connection.close()
+
+    _switch(second)
+    assert job() == 'done'
+    assert calls == [1, 1, 1]
+
+    assert [ r['job'] for r in server.runs ] == ['test'] * 3
+    assert all(r['error'] is None and r['duration'] >= 0 for r in server.runs)
+
+
+def test_lost_connection(server):
+    job = scheduler.leader_job('test', lambda: 'done')
+    assert job() == 'done'
+
+    scheduler._connection.broken = True
+    server.lock_holder = None
+    assert job() is None
+
+    # reconnects at the next run
+    assert job() == 'done'
+
+
+def test_failed_job(server):
+    def _fail():
+        raise ValueError('failed')
+
+    assert scheduler.leader_job('failing', _fail)() is None
+    assert len(server.runs) == 1
+    assert 'ValueError: failed' in server.runs[0]['error']
+
+    server.history = False
+    scheduler.leader_job('test', lambda: 'done')()
+    assert len(server.runs) == 1
@@ -0,0 +1,38 @@
+from damast import secret_keys
+import json
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_shared_secrets():
+    secret_keys.share_secrets(None)
+    yield
+    secret_keys.share_secrets(None)
+
+
+def test_generated():
+    first = secret_keys.load_secrets(None, False)
+    second = secret_keys.load_secrets(None, False)
+
+    assert set(first) == { 'secret_key', 'jwt_secret' }
+    assert first['secret_key'] != first['jwt_secret']
+    assert first != second
+
+
+def test_shared():
+    secrets = secret_keys.generate_secrets()
+    secret_keys.share_secrets(secrets)
+
+    assert secret_keys.load_secrets(None, False) == secrets
+    assert secret_keys.load_secrets(None, False) == secrets
+
+
+def test_secret_file(tmp_path):
+    path = tmp_path / 'secrets.json'
+    path.write_text(json.dumps(dict(jwt_secret='jwt')))
+
+    secrets = secret_keys.generate_secrets()
+    secret_keys.share_secrets(secrets)
+
+    # keys from the file take precedence
+    assert secret_keys.load_secrets(str(path), True) == dict(secret_key=secrets['secret_key'], jwt_secret='jwt')
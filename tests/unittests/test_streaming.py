@@ -0,0 +1,244 @@
+from damast.postgres_rest_api import streaming
+from damast.postgres_rest_api.streaming import stream_json_list
+from damast.postgres_database import InstrumentedConnectionPool
+from damast.customjsonprovider import CustomJSONProvider
+from damast.postgres_rest_api.response_cache import versioned_response, clear_response_cache
+from damast.postgres_rest_api.util import NumericRangeEncoder
+from damast.response_compression import compress
+from collections import namedtuple
+from types import SimpleNamespace
+from psycopg2.extras import NumericRange
+import contextlib
+import threading
+import brotli
+import gzip
+import json
+import flask
+import pytest
+
+Row = namedtuple('Row', ['id', 'name', 'time_span'])
+
+
+class _Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches = 0
+        self.closed = False
+
+    def execute(self, query, params=None):
+        self.position = 0
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        batch = self.rows[self.position:self.position+size]
+        self.position += size
+        return batch
+
+    def fetchall(self):
+        self.fetches += 1
+        return self.rows
+
+    def one(self, query, params=None):
+        return 1
+
+    def close(self):
+        self.closed = True
+
+
+class _Postgres:
+    def __init__(self, rows):
+        self.rows = rows
+        self.open_connections = 0
+        self.cursors = []
+
+    @contextlib.contextmanager
+    def get_connection(self, readonly=False):
+        self.open_connections += 1
+        try:
+            yield SimpleNamespace(cursor=self._cursor)
+        finally:
+            self.open_connections -= 1
+
+    def _cursor(self, name=None):
+        self.cursors.append(_Cursor(self.rows))
+        return self.cursors[-1]
+
+    @contextlib.contextmanager
+    def get_cursor(self, readonly=False):
+        '''Cursor of `rest_endpoint`, on a connection of its own.'''
+        with self.get_connection(readonly=readonly):
+            self.endpoint_cursor = _Cursor(self.rows)
+            yield self.endpoint_cursor
+
+
+def _rows(n):
+    return [ Row(i, F'Place {i} ܐ', NumericRange(800 + i, 1200, '[)') if i % 3 else None) for i in range(n) ]
+
+
+@pytest.fixture
+def app(monkeypatch):
+    clear_response_cache()
+    monkeypatch.setattr(streaming, '_slots', None)
+
+    app = flask.Flask(__name__)
+    app.version = 'test'
+    app.json = CustomJSONProvider(app)
+    app.damast_config = SimpleNamespace(rest_cache_maxsize=1, compression_cache_maxsize=1, pg_pool_maxstreams=4, pg_pool_maxconn=10)
+    app.pg = _Postgres(_rows(25))
+    app.register_blueprint(compress)
+
+    def _list():
+        with app.pg.get_cursor() as cursor:
+            return stream_json_list(cursor, 'SELECT', itersize=10)
+
+    @versioned_response
+    def _versioned(cursor):
+        return stream_json_list(cursor, 'SELECT', itersize=10)
+
+    def _cached():
+        with app.pg.get_cursor() as cursor:
+            return _versioned(cursor)
+
+    app.add_url_rule('/list', view_func=_list, endpoint='list')
+    app.add_url_rule('/cached', view_func=_cached, endpoint='cached')
+    return app
+
+
+@pytest.mark.parametrize('n', [0, 1, 10, 25])
+def test_same_as_jsonify(app, n):
+    app.pg.rows = _rows(n)
+    response = app.test_client().get('/list', headers={'Accept-Encoding': 'identity'})
+
+    assert response.data == json.dumps([ r._asdict() for r in app.pg.rows ], cls=NumericRangeEncoder).encode('utf-8')
+    assert app.pg.cursors[-1].fetches == (n + 9) // 10 + 1
+
+    response.close()
+    assert app.pg.cursors[-1].closed
+    assert app.pg.open_connections == 0
+
+
+@pytest.mark.parametrize('encoding,decompress', [('br', brotli.decompress), ('gzip', gzip.decompress)])
+def test_compressed_stream(app, encoding, decompress):
+    response = app.test_client().get('/list', headers={'Accept-Encoding': encoding})
+
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Content-Length' not in response.headers
+    assert json.loads(decompress(response.data)) == json.loads(json.dumps([ r._asdict() for r in app.pg.rows ], cls=NumericRangeEncoder))
+
+
+def test_cached_when_complete(app):
+    client = app.test_client()
+    first = client.get('/cached', headers={'Accept-Encoding': 'identity'})
+    assert len(app.pg.cursors) == 1
+    data = first.data
+
+    second = client.get('/cached', headers={'Accept-Encoding': 'identity'})
+    assert second.data == data
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert len(app.pg.cursors) == 1
+
+
+def test_error_releases_connection(app):
+    def _fail(query, params=None):
+        raise RuntimeError('query failed')
+    app.pg._cursor = lambda name=None: SimpleNamespace(execute=_fail, close=lambda: None)
+
+    with app.test_request_context('/list'):
+        with pytest.raises(RuntimeError):
+            stream_json_list(_Cursor([]), 'SELECT')
+    assert app.pg.open_connections == 0
+
+
+def _expected(rows):
+    return json.dumps([ r._asdict() for r in rows ], cls=NumericRangeEncoder).encode('utf-8')
+
+
+def test_buffered_when_streams_exhausted(app):
+    app.damast_config.pg_pool_maxstreams = 1
+    client = app.test_client()
+
+    first = client.get('/list', headers={'Accept-Encoding': 'identity'}, buffered=False)
+    assert app.pg.open_connections == 1
+
+    # read completely on the cursor of the endpoint, without another connection
+    second = client.get('/list', headers={'Accept-Encoding': 'identity'}, buffered=False)
+    assert app.pg.open_connections == 1
+    assert len(app.pg.cursors) == 1
+    assert second.get_data() == _expected(app.pg.rows)
+    assert streaming.get_stream_slots().stats() == dict(maxstreams=1, streaming=1, streamed=1, buffered=1)
+
+    assert first.get_data() == _expected(app.pg.rows)
+    first.close()
+    assert app.pg.open_connections == 0
+    assert streaming.get_stream_slots().stats()['streaming'] == 0
+
+
+class _PooledPostgres(_Postgres):
+    '''Connections from an `InstrumentedConnectionPool`.'''
+    def __init__(self, rows, pool, barrier=None):
+        super().__init__(rows)
+        self.pool = pool
+        self.barrier = barrier
+
+    @contextlib.contextmanager
+    def get_cursor(self, readonly=False):
+        with super().get_cursor(readonly=readonly) as cursor:
+            # all requests hold the connection of their endpoint at once
+            if self.barrier is not None:
+                self.barrier.wait()
+            yield cursor
+
+    @contextlib.contextmanager
+    def get_connection(self, readonly=False):
+        connection = self.pool.getconn()
+        try:
+            yield SimpleNamespace(cursor=self._cursor)
+        finally:
+            self.pool.putconn(connection)
+
+
+def test_open_streams_do_not_exhaust_pool(app, pg_server):
+    pool = InstrumentedConnectionPool(minconn=0, maxconn=4)
+    pool.wait_timeout = 0.2
+    app.pg = _PooledPostgres(_rows(25), pool)
+    app.damast_config.pg_pool_maxconn = 4
+    client = app.test_client()
+
+    # slow clients, which do not read their responses
+    responses = [ client.get('/list', headers={'Accept-Encoding': 'identity'}, buffered=False) for _ in range(6) ]
+    assert pool.stats()['in_use'] == 1
+
+    # other requests still get a connection without waiting
+    connections = [ pool.getconn(), pool.getconn(), pool.getconn() ]
+    assert pool.stats()['waits'] == 0
+    for connection in connections:
+        pool.putconn(connection)
+
+    for response in responses:
+        assert response.get_data() == _expected(app.pg.rows)
+        response.close()
+    assert pool.stats()['in_use'] == 0
+
+
+def test_concurrent_streams_do_not_wait_for_each_other(app, pg_server):
+    pool = InstrumentedConnectionPool(minconn=0, maxconn=4)
+    pool.wait_timeout = 5
+    app.pg = _PooledPostgres(_rows(25), pool, threading.Barrier(4, timeout=5))
+    app.damast_config.pg_pool_maxconn = 4
+
+    # as many list requests as connections, each holding the one of its endpoint
+    responses = [None] * 4
+    def _request(i):
+        responses[i] = app.test_client().get('/list', headers={'Accept-Encoding': 'identity'}, buffered=False)
+    threads = [ threading.Thread(target=_request, args=(i,)) for i in range(4) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pool.stats()['timeouts'] == 0
+    assert streaming.get_stream_slots().stats() == dict(maxstreams=1, streaming=1, streamed=1, buffered=3)
+    for response in responses:
+        assert response.get_data() == _expected(app.pg.rows)
+        response.close()
+    assert pool.stats()['in_use'] == 0
@@ -0,0 +1,81 @@
+from damast.reporting import tex_format
+import multiprocessing
+import os
+import time
+import pytest
+
+
+@pytest.fixture
+def fmt(report_file, monkeypatch):
+    monkeypatch.setattr(tex_format, '_format_name', lambda: 'damast-preamble-test')
+    monkeypatch.setattr(tex_format, '_format_path', None)
+    monkeypatch.setattr(tex_format, '_format_failed', None)
+    return F'{report_file}.formats/damast-preamble-test.fmt'
+
+
+@pytest.fixture
+def builds(fmt, monkeypatch):
+    builds = []
+    def _build_format(name, target):
+        builds.append(target)
+        with open(target, 'wb') as f:
+            f.write(b'format')
+        return True
+
+    monkeypatch.setattr(tex_format, '_build_format', _build_format)
+    return builds
+
+
+def _disable(fmt):
+    tex_format.disable_preamble_format(fmt)
+
+
+def _new_process():
+    tex_format._format_path = None
+    tex_format._format_failed = None
+
+
+def test_disabled_in_all_processes(fmt, builds):
+    # the long-lived worker has loaded the format before
+    assert tex_format.get_preamble_format() == fmt
+
+    # a report fails with the format in a forked child
+    child = multiprocessing.get_context('fork').Process(target=_disable, args=(fmt,))
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+
+    # the worker and later children do not use the format anymore
+    assert tex_format.get_preamble_format() is None
+
+    _new_process()
+    assert tex_format.get_preamble_format() is None
+
+
+def test_used_until_disabled(fmt, builds):
+    assert tex_format.get_preamble_format() == fmt
+    assert tex_format.get_preamble_format() == fmt
+    assert builds == [fmt]
+
+
+def test_rebuilt_after_retry_interval(fmt, builds):
+    assert tex_format.get_preamble_format() == fmt
+    tex_format.disable_preamble_format(fmt)
+    assert tex_format.get_preamble_format() is None
+
+    old = time.time() - tex_format._retry_interval - 1
+    os.utime(tex_format._failed_marker(fmt), (old, old))
+    tex_format._format_failed -= tex_format._retry_interval + 1
+
+    assert tex_format.get_preamble_format() == fmt
+    assert builds == [fmt, fmt]
+    assert not os.path.exists(tex_format._failed_marker(fmt))
+
+
+def test_directory_writable_by_others(fmt, builds):
+    directory = os.path.dirname(fmt)
+    os.makedirs(directory)
+    os.chmod(directory, 0o777)
+
+    assert tex_format.get_preamble_format() is None
+    assert builds == []
@@ -0,0 +1,98 @@
+from damast.user import UserCache
+import sqlite3
+import time
+import pytest
+
+
+@pytest.fixture
+def user_file(tmp_path):
+    path = str(tmp_path / 'users.db')
+    with sqlite3.connect(path) as db:
+        db.execute('CREATE TABLE users (id TEXT PRIMARY KEY, roles TEXT);')
+        db.execute("INSERT INTO users VALUES ('alice', 'user,vis');")
+    return path
+
+
+class _Loader:
+    def __init__(self, user_file):
+        self.user_file = user_file
+        self.calls = 0
+
+    def __call__(self, user_id):
+        self.calls += 1
+        with sqlite3.connect(self.user_file) as db:
+            return db.execute('SELECT id, roles FROM users WHERE id = ?;', (user_id,)).fetchone()
+
+
+def _update(user_file, query):
+    # make sure the modification time differs on coarse file systems
+    time.sleep(0.01)
+    with sqlite3.connect(user_file) as db:
+        db.execute(query)
+
+
+def test_cached(user_file):
+    cache = UserCache(user_file)
+    load = _Loader(user_file)
+
+    assert cache.get('alice', load) == ('alice', 'user,vis')
+    assert cache.get('alice', load) == ('alice', 'user,vis')
+    assert cache.get('bob', load) is None
+    assert cache.get('bob', load) is None
+    assert load.calls == 2
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 2
+
+
+def test_invalidated_on_change(user_file):
+    cache = UserCache(user_file)
+    load = _Loader(user_file)
+    cache.get('alice', load)
+    cache.get('bob', load)
+
+    _update(user_file, "UPDATE users SET roles = 'user' WHERE id = 'alice';")
+    assert cache.get('alice', load) == ('alice', 'user')
+
+    _update(user_file, "INSERT INTO users VALUES ('bob', 'user');")
+    assert cache.get('bob', load) == ('bob', 'user')
+    assert load.calls == 4
+
+
+def test_invalidated_on_change_in_wal_mode(user_file):
+    with sqlite3.connect(user_file) as db:
+        db.execute('PRAGMA journal_mode = WAL;')
+
+    cache = UserCache(user_file)
+    load = _Loader(user_file)
+    cache.get('alice', load)
+
+    _update(user_file, "UPDATE users SET roles = 'user' WHERE id = 'alice';")
+    assert cache.get('alice', load) == ('alice', 'user')
+
+
+def test_ttl(user_file):
+    cache = UserCache(user_file, ttl=0.05)
+    load = _Loader(user_file)
+    cache.get('alice', load)
+    cache.get('alice', load)
+    assert load.calls == 1
+
+    time.sleep(0.06)
+    cache.get('alice', load)
+    assert load.calls == 2
+
+
+def test_lru(user_file):
+    cache = UserCache(user_file, maxsize=2)
+    load = _Loader(user_file)
+    for user_id in ('a', 'b', 'a', 'c'):
+        cache.get(user_id, load)
+    assert load.calls == 3
+
+    # 'b' was the least recently used one
+    cache.get('a', load)
+    cache.get('c', load)
+    assert load.calls == 3
+    cache.get('b', load)
+    assert load.calls == 4
+    assert cache.stats()['entries'] == 2
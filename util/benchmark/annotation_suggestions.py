@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+'''
+Benchmark the matching of search terms against the n-gram fragments of a
+document for annotation suggestions (`search_with_term`), with the fragment
+index, and by comparing every fragment with every term as before the index.
+The document and the names are generated randomly with a fixed seed; a part
+of the words of the document are (misspelled) names. Comparing all pairs is
+only timed for the first `--all-pairs-terms` terms and extrapolated. Both
+must find the same matches. The time of matching in worker processes
+(`match_search_terms`, including the index) and their peak RSS are printed
+as well.
+
+Comparing all pairs is the reference implementation of the tests, in
+`tests/suggestions_reference.py`. `PGPASSWORD` must be set (to anything),
+because the configuration is read when the module is imported.
+'''
+
+import argparse
+import random
+import resource
+import sys
+import time
+
+from damast.annotator.fragment_index import FragmentIndex
+from damast.annotator.suggestions import Place, SearchTerm, search_with_term, match_search_terms, tokenize_text
+from tests.suggestions_reference import search_all_pairs
+
+_letters = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def _word(rng):
+    return ''.join(rng.choice(_letters) for _ in range(rng.choice((2, 3, 4, 5, 5, 6, 7, 8, 10))))
+
+
+def _misspelled(rng, name):
+    chars = list(name)
+    position = rng.randrange(len(chars))
+    chars.insert(position, rng.choice(_letters))
+    return ''.join(chars)
+
+
+def generate_data(num_words, num_names, seed):
+    rng = random.Random(seed)
+
+    names = [ ' '.join(_word(rng).capitalize() for _ in range(rng.choice((1, 1, 1, 2, 2, 3)))) for _ in range(num_names) ]
+    vocabulary = [ _word(rng) for _ in range(20000) ]
+
+    words = []
+    for _ in range(num_words):
+        r = rng.random()
+        if r < 0.02:
+            words.append(rng.choice(names))
+        elif r < 0.03:
+            words.append(_misspelled(rng, rng.choice(names)))
+        else:
+            words.append(rng.choice(vocabulary))
+
+    document = '<p>' + ' '.join(words) + '</p>'
+    search_terms = [ SearchTerm([name], Place.__name__, 'name', Place(i, name)) for i, name in enumerate(names) ]
+    return document, search_terms
+
+
+def benchmark(num_words, num_names, all_pairs_terms, seed):
+    document, search_terms = generate_data(num_words, num_names, seed)
+    frags = tokenize_text(document, 'text/html', ngrams=3)
+
+    t0 = time.perf_counter()
+    index = FragmentIndex(frags)
+    t_index = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    results = [ search_with_term(index, st) for st in search_terms ]
+    t_search = time.perf_counter() - t0
+
+    sample = search_terms[:all_pairs_terms]
+    t0 = time.perf_counter()
+    expected = [ search_all_pairs(frags, st) for st in sample ]
+    t_all_pairs = (time.perf_counter() - t0) * len(search_terms) / max(1, len(sample))
+
+    if expected != results[:len(sample)]:
+        raise AssertionError('Indexed search and comparing all pairs found different matches.')
+
+    t0 = time.perf_counter()
+    match_search_terms(frags, search_terms)
+    t_pool = time.perf_counter() - t0
+
+    matches = sum(len(vals) for _, vals in results)
+    return len(frags), len(index.texts), matches, t_index, t_search, t_all_pairs, t_pool
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the matching of annotation suggestions')
+    parser.add_argument('-n', '--words', type=int, nargs='+', default=[10000, 100000], help='Document sizes (number of words)')
+    parser.add_argument('-t', '--terms', type=int, default=2000, help='Number of search terms (names)')
+    parser.add_argument('-a', '--all-pairs-terms', type=int, default=20, help='Number of terms to time comparing all pairs with')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed')
+    parsed = parser.parse_args(sys.argv[1:])
+
+    print(F'{"WORDS":>7s}  {"FRAGMENTS":>9s}  {"DISTINCT":>8s}  {"MATCHES":>7s}  {"INDEX":>8s}  {"SEARCH":>8s}  {"ALL PAIRS (EST.)":>16s}  {"SPEEDUP":>7s}  {"POOL":>8s}')
+    for size in parsed.words:
+        frags, texts, matches, t_index, t_search, t_all_pairs, t_pool = benchmark(size, parsed.terms, parsed.all_pairs_terms, parsed.seed)
+        speedup = t_all_pairs / (t_index + t_search)
+        print(F'{size:7d}  {frags:9d}  {texts:8d}  {matches:7d}  {t_index:7.2f}s  {t_search:7.2f}s  {t_all_pairs:15.1f}s  {speedup:6.0f}x  {t_pool:7.2f}s')
+
+    print(F'Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024} MB (main process), {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // 1024} MB (worker processes)')
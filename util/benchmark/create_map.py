@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+'''
+Benchmark the rendering of report maps (`create_map`) for different numbers of
+places. The places, religions, and evidences are generated randomly within the
+area covered by the map data, with a fixed seed. The wall time and the sizes
+of the SVG and PDF maps are printed.
+
+This must be run from the repository root, because the map data is loaded
+relative to the working directory.
+'''
+
+import argparse
+import random
+import sys
+import time
+from collections import namedtuple
+
+from damast.reporting.create_map import create_map
+from damast.reporting.datatypes import Evidence, Place
+
+_Place = namedtuple('Place', ['id', 'geoloc'])
+_Evidence = namedtuple('Evidence', ['place_id', 'religion_id'])
+
+
+def generate_data(num_places, num_religions, seed):
+    rng = random.Random(seed)
+
+    religions = [ dict(id=i, name=F'Religion {i}', color=F'hsl({(i * 47) % 360}, 60%, 50%)')
+            for i in range(num_religions) ]
+
+    places = []
+    evidences = []
+    for place_id in range(num_places):
+        lat = rng.uniform(25, 42)
+        lng = rng.uniform(28, 62)
+        places.append(Place(_Place(place_id, F'({lat},{lng})'), [], []))
+
+        for religion in rng.sample(religions, rng.choice((1, 1, 1, 2, 2, 3, 5))):
+            evidences.append(Evidence(_Evidence(place_id, religion['id']), []))
+
+    return places, evidences, religions
+
+
+def benchmark(size, num_religions, repetitions, seed):
+    places, evidences, religions = generate_data(size, num_religions, seed)
+
+    times = []
+    for _ in range(repetitions):
+        t0 = time.perf_counter()
+        svg, pdf = create_map(places, evidences, religions, religions)
+        times.append(time.perf_counter() - t0)
+
+    return len(evidences), len(svg), len(pdf), min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark report map rendering')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[10, 500, 5000], help='Map sizes (number of places)')
+    parser.add_argument('-R', '--religions', type=int, default=12, help='Number of religions')
+    parser.add_argument('-r', '--repetitions', type=int, default=3, help='Repetitions per size (best time is reported)')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Seed for the random data')
+    parsed = parser.parse_args(sys.argv[1:])
+
+    print(F'{"PLACES":>6s}  {"EVIDENCES":>9s}  {"SVG SIZE":>9s}  {"PDF SIZE":>9s}  {"TIME":>9s}')
+    for size in parsed.sizes:
+        evidences, svg_size, pdf_size, duration = benchmark(size, parsed.religions, parsed.repetitions, parsed.seed)
+        print(F'{size:6d}  {evidences:9d}  {svg_size:9d}  {pdf_size:9d}  {duration:8.3f}s')
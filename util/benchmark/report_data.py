@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+'''
+Benchmark the collection of report data (`collect_report_data`) for reports of
+different sizes. For each report size, the first N visible evidences of the
+database are used. The number of queries issued and the wall time are printed.
+
+The database connection is configured the same way as for the server (`PGHOST`,
+`PGPORT`, `PGUSER`, `PGPASSWORD`, `DAMAST_ENVIRONMENT`, or `DAMAST_CONFIG`).
+'''
+
+import argparse
+import sys
+import time
+
+from damast.postgres_database import postgres_database
+from damast.reporting.collect_report_data import collect_report_data
+
+
+class CountingCursor:
+    '''
+    Wrapper around a database cursor that counts the executed queries.
+    '''
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.query_count = 0
+
+    def execute(self, *args, **kwargs):
+        self.query_count += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def benchmark(pg, size, repetitions):
+    with pg.get_cursor(readonly=True) as cursor:
+        cursor.execute('SELECT id FROM evidence WHERE visible ORDER BY id ASC LIMIT %s;', (size,))
+        evidence_ids = list(map(lambda x: x.id, cursor.fetchall()))
+
+        filters = [
+            cursor.mogrify('E.visible', tuple()),
+            cursor.mogrify('E.id = ANY(%s)', (evidence_ids,)),
+                ]
+
+        times = []
+        for _ in range(repetitions):
+            c = CountingCursor(cursor)
+            t0 = time.perf_counter()
+            data = collect_report_data(c, filters, True)
+            times.append(time.perf_counter() - t0)
+
+        return len(data['evidence_ids']), len(data['places']), c.query_count, min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark report data collection')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000], help='Report sizes (number of evidences)')
+    parser.add_argument('-r', '--repetitions', type=int, default=3, help='Repetitions per size (best time is reported)')
+    parsed = parser.parse_args(sys.argv[1:])
+
+    pg = postgres_database()
+
+    print(F'{"REQUESTED":>9s}  {"EVIDENCES":>9s}  {"PLACES":>6s}  {"QUERIES":>7s}  {"TIME":>9s}')
+    for size in parsed.sizes:
+        evidences, places, queries, duration = benchmark(pg, size, parsed.repetitions)
+        print(F'{size:9d}  {evidences:9d}  {places:6d}  {queries:7d}  {duration:8.3f}s')
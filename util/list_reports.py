@@ -42,7 +42,7 @@ def _convert_datetime(val):
     return None
 sqlite3.register_converter('DATETIME', _convert_datetime)
 
-ReportTuple = namedtuple('ReportTuple', ['uuid', 'user', 'server_version', 'report_state', 'started', 'completed', 'content', 'pdf_map', 'pdf_report', 'filter', 'evidence_count'])
+ReportTuple = namedtuple('ReportTuple', ['uuid', 'user', 'server_version', 'report_state', 'started', 'completed', 'content_size', 'pdf_map_size', 'pdf_report_size', 'filter', 'evidence_count'])
 
 
 def list_users(parsed, args, c):
@@ -57,11 +57,10 @@ def list_users(parsed, args, c):
         print(F'{username:30s}  {_tls}  {roles:40s}  {comment:20s}')
 
 
-def fsize(b):
-    if b is None:
+def fsize(sz):
+    if sz is None:
         return ''
 
-    sz = len(gzip.decompress(b))
     return _fsize(sz)
 
 def _fsize(sz):
@@ -82,9 +81,9 @@ def list_reports(parsed, cursor, replist):
 
     for r in records:
         d = r._asdict()
-        html_size = fsize(r.content)
-        pdf_size = fsize(r.pdf_report)
-        map_size = fsize(r.pdf_map)
+        html_size = fsize(r.content_size)
+        pdf_size = fsize(r.pdf_report_size)
+        map_size = fsize(r.pdf_map_size)
         started = r.started.strftime('%Y-%m-%d %H:%M')
 
         if r.completed is None:
@@ -109,14 +108,21 @@ def list_reports(parsed, cursor, replist):
             count=count))
         print(tbl.format(**d))
 
+_delete_unused_artifacts = '''DELETE FROM report_artifact
+    WHERE NOT EXISTS (SELECT 1 FROM reports R
+        WHERE R.content_hash = report_artifact.hash
+           OR R.pdf_map_hash = report_artifact.hash
+           OR R.pdf_report_hash = report_artifact.hash);'''
+
+
 def delete_reports(parsed, cursor, replist):
     total = 0
     count = 0
     for r in replist:
         sz = 0
-        for field in ('content', 'pdf_report', 'pdf_map'):
+        for field in ('content_size', 'pdf_report_size', 'pdf_map_size'):
             if getattr(r, field) is not None:
-                sz += len(gzip.decompress(getattr(r, field)))
+                sz += getattr(r, field)
 
         total += sz
         count += 1
@@ -125,6 +131,9 @@ def delete_reports(parsed, cursor, replist):
         cursor.execute('DELETE FROM reports WHERE uuid = :uuid;', dict(uuid=r.uuid))
         print(F'Delete report {r.uuid} ({sz}).')
 
+    # artifacts can be shared between reports
+    cursor.execute(_delete_unused_artifacts)
+
     if count > 0:
         print()
     print(F'Deleted {count} reports ({_fsize(total)}).')
@@ -137,14 +146,20 @@ def backup_reports(parsed, cursor, replist):
     cu = conn.cursor()
     cu.execute("ATTACH DATABASE '" + parsed.database.name + "' AS attached_db;")
 
-    cu.execute('SELECT sql FROM attached_db.sqlite_master WHERE type=? and name=?;', ('table', 'reports'))
-    sql_create_table = cu.fetchone()[0]
-    cu.execute(sql_create_table)
+    for table in ('reports', 'report_artifact'):
+        cu.execute('SELECT sql FROM attached_db.sqlite_master WHERE type=? and name=?;', ('table', table))
+        sql_create_table = cu.fetchone()[0]
+        cu.execute(sql_create_table)
 
     if len(replist) > 0:
         cu.execute(F'''INSERT INTO reports
                         SELECT * FROM attached_db.reports
                         WHERE uuid IN {uuids};''')
+        cu.execute('''INSERT INTO report_artifact
+                        SELECT * FROM attached_db.report_artifact A
+                        WHERE A.hash IN (SELECT content_hash FROM reports
+                            UNION SELECT pdf_map_hash FROM reports
+                            UNION SELECT pdf_report_hash FROM reports);''')
 
     conn.commit()
     cu.execute("DETACH DATABASE attached_db;")
@@ -202,6 +217,11 @@ if __name__ == '__main__':
         conn = sqlite3.connect(parsed.database.name, detect_types=sqlite3.PARSE_DECLTYPES)
         c = conn.cursor()
 
+        c.execute('PRAGMA user_version;')
+        if c.fetchone()[0] < 1:
+            print('The report database has an old schema. Start the server once to migrate it.', file=sys.stderr)
+            sys.exit(1)
+
         c.execute(query, dict(user=parsed.user, state=parsed.state))
 
         records = [ ReportTuple(*v) for v in c.fetchall() ]
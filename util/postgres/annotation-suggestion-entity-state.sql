@@ -0,0 +1,31 @@
+--
+-- Fingerprints of the search terms of each entity for the annotation
+-- suggestions of each document.
+--
+-- The annotation suggestion refresh stores, per document and entity (place,
+-- person, or religion), a fingerprint of the entity's names, of the texts of
+-- its annotations in the document, and of the document content. On the next
+-- refresh, only the entities whose fingerprint changed are matched against
+-- the document again, and only the suggestions of changed or removed
+-- entities are replaced. Without this table, all suggestions of a document
+-- are recomputed if any search term changed.
+--
+-- This file can be run on an existing database; the first refresh afterwards
+-- recomputes all suggestions once.
+--
+
+CREATE TABLE public.annotation_suggestion_entity_state (
+    document_id integer NOT NULL,
+    type text NOT NULL,
+    entity_id integer NOT NULL,
+    fingerprint text NOT NULL,
+    PRIMARY KEY (document_id, type, entity_id)
+);
+
+ALTER TABLE ONLY public.annotation_suggestion_entity_state
+    ADD CONSTRAINT annotation_suggestion_entity_state_document_id_fkey FOREIGN KEY (document_id) REFERENCES public.document(id) ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE public.annotation_suggestion_entity_state OWNER TO postgres;
+GRANT SELECT ON TABLE public.annotation_suggestion_entity_state TO ro_dump;
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.annotation_suggestion_entity_state TO api;
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.annotation_suggestion_entity_state TO users;
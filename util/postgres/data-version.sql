@@ -0,0 +1,74 @@
+--
+-- Data version counter.
+--
+-- The `data_version` table contains a single row with a counter that is
+-- incremented on each change to the historical data. The server uses the
+-- counter to decide whether cached, derived data (for example, report data)
+-- is still valid. The counter is maintained by statement-level triggers on all
+-- tables the visualization, the reports, and the REST API read from.
+--
+-- This file can be run on an existing database to add the counter.
+--
+
+CREATE TABLE public.data_version (
+    id boolean DEFAULT true NOT NULL PRIMARY KEY CHECK (id),
+    version bigint DEFAULT 0 NOT NULL,
+    changed timestamp with time zone DEFAULT now() NOT NULL
+);
+
+INSERT INTO public.data_version DEFAULT VALUES;
+
+ALTER TABLE public.data_version OWNER TO postgres;
+GRANT SELECT ON TABLE public.data_version TO ro_dump;
+GRANT SELECT ON TABLE public.data_version TO api;
+GRANT SELECT ON TABLE public.data_version TO users;
+
+
+CREATE FUNCTION public.increment_data_version() RETURNS trigger
+    LANGUAGE plpgsql SECURITY DEFINER
+    SET search_path = public
+    AS $$
+BEGIN
+  UPDATE data_version SET version = version + 1, changed = now();
+  RETURN NULL;
+END;
+$$;
+
+ALTER FUNCTION public.increment_data_version() OWNER TO postgres;
+
+
+DO $$
+DECLARE
+  tbl text;
+BEGIN
+  FOREACH tbl IN ARRAY ARRAY[
+    'evidence',
+    'external_database',
+    'external_person_uri',
+    'external_place_uri',
+    'language',
+    'name_var',
+    'person',
+    'person_instance',
+    'person_type',
+    'place',
+    'place_instance',
+    'place_type',
+    'religion',
+    'religion_instance',
+    'source',
+    'source_instance',
+    'source_type',
+    'tag',
+    'tag_evidence',
+    'time_group',
+    'time_instance',
+    'uri_namespace'
+  ]
+  LOOP
+    EXECUTE format('CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.%I FOR EACH STATEMENT EXECUTE PROCEDURE public.increment_data_version();',
+      tbl || '_increment_data_version',
+      tbl);
+  END LOOP;
+END;
+$$;
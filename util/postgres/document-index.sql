@@ -0,0 +1,30 @@
+--
+-- Index of the text of each document.
+--
+-- The server stores, per document and version, the inner text of the
+-- document (the concatenated text nodes of an HTML document) and the
+-- character offsets of its word tokens as little-endian 32 bit integers, start
+-- and end of each token in turn. The index is created when a document is
+-- added, or by the annotation suggestion refresh for existing documents. The
+-- refresh and the JSON-LD export of annotations then do not need to parse the
+-- HTML of the document again. Without this table, the documents are parsed
+-- each time.
+--
+-- This file can be run on an existing database.
+--
+
+CREATE TABLE public.document_index (
+    document_id integer NOT NULL,
+    document_version integer NOT NULL,
+    inner_text text NOT NULL,
+    token_offsets bytea NOT NULL,
+    PRIMARY KEY (document_id, document_version)
+);
+
+ALTER TABLE ONLY public.document_index
+    ADD CONSTRAINT document_index_document_id_fkey FOREIGN KEY (document_id) REFERENCES public.document(id) ON UPDATE CASCADE ON DELETE CASCADE;
+
+ALTER TABLE public.document_index OWNER TO postgres;
+GRANT SELECT ON TABLE public.document_index TO ro_dump;
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.document_index TO api;
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.document_index TO users;
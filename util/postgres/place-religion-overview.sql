@@ -0,0 +1,66 @@
+--
+-- Concurrent refreshes of place_religion_overview.
+--
+-- The view is recreated with the ID of the time instance, so that a unique
+-- index identifies its rows. With the index, the server refreshes the view
+-- with `REFRESH MATERIALIZED VIEW CONCURRENTLY`, which does not block readers.
+-- The `materialized_view_refresh` table records the data version (see
+-- `data-version.sql`, which must be run first), time, and duration of the last
+-- refresh of each view. The server skips a refresh if the data version did not
+-- change since, and reports the time and staleness of the view. A concurrent
+-- refresh does not keep the rows in the order of the view's `ORDER BY`, so the
+-- server orders them by `tuple_id` when reading them.
+--
+-- This file can be run on an existing database.
+--
+
+DROP MATERIALIZED VIEW IF EXISTS public.place_religion_overview;
+
+CREATE MATERIALIZED VIEW public.place_religion_overview AS
+ SELECT evidence.id AS tuple_id,
+    place_instance.place_id,
+    time_instance.span AS time_span,
+    religion_instance.religion_id,
+    ( SELECT array_to_json(array_agg(source_instance.source_id)) AS array_to_json
+           FROM public.source_instance
+          WHERE (source_instance.evidence_id = evidence.id)) AS source_ids,
+    time_instance.confidence AS time_confidence,
+    place.confidence AS location_confidence,
+    place_instance.confidence AS place_attribution_confidence,
+    ( SELECT array_to_json(array_agg(source_instance.source_confidence)) AS array_to_json
+           FROM public.source_instance
+          WHERE (source_instance.evidence_id = evidence.id)) AS source_confidences,
+    evidence.interpretation_confidence,
+    religion_instance.confidence AS religion_confidence,
+    time_instance.id AS time_instance_id
+   FROM ((((((public.evidence
+     LEFT JOIN public.religion_instance ON ((evidence.religion_instance_id = religion_instance.id)))
+     LEFT JOIN public.place_instance ON ((evidence.place_instance_id = place_instance.id)))
+     LEFT JOIN public.time_group ON ((evidence.time_group_id = time_group.id)))
+     LEFT JOIN public.time_instance ON ((time_instance.time_group_id = time_group.id)))
+     JOIN public.place ON ((place_instance.place_id = place.id)))
+     JOIN public.place_type ON ((place.place_type_id = place_type.id)))
+  WHERE (evidence.visible AND place.visible AND place_type.visible)
+  ORDER BY evidence.id
+  WITH DATA;
+
+ALTER TABLE public.place_religion_overview OWNER TO api;
+
+CREATE UNIQUE INDEX place_religion_overview_unique ON public.place_religion_overview USING btree (tuple_id, time_instance_id);
+
+GRANT SELECT ON TABLE public.place_religion_overview TO ro_dump;
+GRANT SELECT,INSERT,DELETE,UPDATE ON TABLE public.place_religion_overview TO users;
+GRANT ALL ON TABLE public.place_religion_overview TO postgres;
+
+
+CREATE TABLE public.materialized_view_refresh (
+    name text NOT NULL PRIMARY KEY,
+    data_version bigint,
+    refreshed timestamp with time zone NOT NULL,
+    duration double precision NOT NULL
+);
+
+ALTER TABLE public.materialized_view_refresh OWNER TO api;
+GRANT SELECT ON TABLE public.materialized_view_refresh TO ro_dump;
+GRANT SELECT ON TABLE public.materialized_view_refresh TO users;
+GRANT ALL ON TABLE public.materialized_view_refresh TO postgres;
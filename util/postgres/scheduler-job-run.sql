@@ -0,0 +1,29 @@
+--
+-- Run history of the scheduled jobs.
+--
+-- The server process that leads the scheduled jobs records each run of a job
+-- (refreshing `place_religion_overview`, evicting reports, refreshing the
+-- annotation suggestions) with the host and process it ran in, its start and
+-- duration, and the traceback if it failed. Runs older than 30 days are
+-- deleted. The last run of each job is also listed by the `/stats` endpoint.
+--
+-- This file can be run on an existing database to add the history.
+--
+
+CREATE TABLE public.scheduler_job_run (
+    id bigserial NOT NULL PRIMARY KEY,
+    job text NOT NULL,
+    host text NOT NULL,
+    pid integer NOT NULL,
+    started timestamp with time zone NOT NULL,
+    duration double precision NOT NULL,
+    error text
+);
+
+CREATE INDEX scheduler_job_run_job_started ON public.scheduler_job_run USING btree (job, started);
+CREATE INDEX scheduler_job_run_started ON public.scheduler_job_run USING btree (started);
+
+ALTER TABLE public.scheduler_job_run OWNER TO api;
+GRANT SELECT ON TABLE public.scheduler_job_run TO ro_dump;
+GRANT SELECT ON TABLE public.scheduler_job_run TO users;
+GRANT ALL ON TABLE public.scheduler_job_run TO postgres;
@@ -2,8 +2,14 @@
 
 import pandas as pd
 import geopandas as gpd
+import os.path
 import sys
 import json
+from io import StringIO
+
+# the basemap store is built with the same code the server uses to read it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from damast.reporting.basemap import build_basemap, save_basemap
 
 if len(sys.argv) != 2:
     sys.stderr.write(F'Usage: {sys.argv[0]} <resolution>\n')
@@ -28,8 +34,11 @@ with open(F'ne_{res}_rivers_lake_centerlines.json') as f:
     rivers = gpd.GeoSeries.from_file(geofile, driver='GeoJSON')
 
 
-merged = lakes.append(ocean).append(rivers)
+merged = pd.concat([lakes, ocean, rivers])
 merged = merged[merged.apply(lambda x: x is not None)]
 merged.index = [ i for i in range(len(merged.index)) ]
 
 merged.to_file('features.geo.json', driver='GeoJSON')
+
+# pre-projected, simplified, and tiled store for the report maps
+save_basemap(build_basemap(merged), 'basemap.pickle.gz')
@@ -33,9 +33,6 @@ EOF
 
 /usr/bin/env python3 \
   -m gunicorn \
+  -c /damast/gunicorn.conf.py \
   -b "[::]:$DAMAST_PORT" \
-  'damast:create_app()' \
-  --worker-class=gevent \
-  --workers=1 \
-  --threads=4 \
-  --timeout 0
\ No newline at end of file
+  'damast:create_app()'
\ No newline at end of file